@@ -0,0 +1,125 @@
+import re
+
+from range_queries import CrossingIndex
+
+# Cost-per-unit levels the price milestones report the first year of
+PRICE_THRESHOLDS = [0.10, 0.12, 0.15]
+
+
+def parse_levels(text):
+    # Threshold levels typed into the sidebar, separated by commas or spaces; sorted and
+    # without duplicates
+    levels = set()
+    for part in re.split(r'[,;\s]+', text.strip()):
+        if not part:
+            continue
+        try:
+            levels.add(float(part.lstrip('$').replace('_', '')))
+        except ValueError:
+            raise ValueError(f"'{part}' is not a number") from None
+    return sorted(levels)
+
+
+def first_crossings(df, column, thresholds, below=False):
+    # First year the column reached each threshold (fell to it with below=True), None if never
+    index = CrossingIndex(df[column].to_numpy(), [(0, len(df))])
+    positions = index.first_positions(0, thresholds, below)
+    years = df['year'].to_numpy()
+    return {
+        threshold: int(years[position]) if position >= 0 else None
+        for threshold, position in zip(thresholds, positions)
+    }
+
+
+def period_split_year(first_year, last_year):
+    # Last year of the "early" period in the period comparison: 2015 when it falls
+    # inside the range, otherwise the middle of the range
+    if first_year <= 2015 < last_year:
+        return 2015
+    return first_year + (last_year - first_year - 1) // 2
+
+
+def usage_insights(df, stats):
+    biggest_drop = df.loc[df['usage_change'].idxmin()]
+    return {
+        'peak_drop_pct': ((stats['max_usage'] - df['usage'].iloc[-1]) / stats['max_usage']) * 100,
+        'biggest_drop_year': int(biggest_drop['year']),
+        'biggest_drop_pct': biggest_drop['usage_change'],
+        'current_vs_first_pct': (df['usage'].iloc[-1] / df['usage'].iloc[0]) * 100
+    }
+
+
+def cost_insights(df, stats):
+    biggest_increase = df.loc[df['cost_change'].idxmax()]
+    return {
+        'current_vs_peak_pct': (df['cost'].iloc[-1] / stats['max_cost']) * 100,
+        'biggest_increase_year': int(biggest_increase['year']),
+        'biggest_increase_pct': biggest_increase['cost_change'],
+        'current_vs_first_pct': (df['cost'].iloc[-1] / df['cost'].iloc[0]) * 100
+    }
+
+
+def cost_per_unit_insights(df, thresholds=PRICE_THRESHOLDS):
+    # Compound annual growth rate of the cost per unit, and the first year it reached each
+    # of the price thresholds (None if it never did)
+    rates = df['costPerUnit'].to_numpy()
+    years = len(df) - 1
+    return {
+        'first_rate': rates[0],
+        'last_rate': rates[-1],
+        'cagr': ((rates[-1] / rates[0]) ** (1 / years) - 1) * 100,
+        'thresholds': first_crossings(df, 'costPerUnit', thresholds)
+    }
+
+
+def period_analysis(df, split_year):
+    # Usage/cost correlation and the average cost per unit before and after split_year
+    early = df[df['year'] <= split_year]['costPerUnit'].mean()
+    recent = df[df['year'] > split_year]['costPerUnit'].mean()
+    return {
+        'correlation': df['usage'].corr(df['cost']),
+        'split_year': split_year,
+        'early_cost_per_unit': early,
+        'recent_cost_per_unit': recent,
+        'cost_per_unit_change': ((recent / early) - 1) * 100,
+        'usage_change': ((df['usage'].iloc[-1] / df['usage'].iloc[0]) - 1) * 100
+    }
+
+
+def year_over_year_analysis(df):
+    biggest_usage_drop = df.loc[df['usage_change'].idxmin()]
+    biggest_usage_increase = df.loc[df['usage_change'].idxmax()]
+    biggest_cost_increase = df.loc[df['cost_change'].idxmax()]
+    opposite = (
+        (df['usage_change'] > 0) & (df['cost_change'] < 0) |
+        (df['usage_change'] < 0) & (df['cost_change'] > 0)
+    )
+    return {
+        'biggest_usage_drop_pct': biggest_usage_drop['usage_change'],
+        'biggest_usage_drop_year': int(biggest_usage_drop['year']),
+        'biggest_usage_increase_pct': biggest_usage_increase['usage_change'],
+        'biggest_usage_increase_year': int(biggest_usage_increase['year']),
+        'biggest_cost_increase_pct': biggest_cost_increase['cost_change'],
+        'biggest_cost_increase_year': int(biggest_cost_increase['year']),
+        'usage_volatility': df['usage_change'].std(),
+        'cost_volatility': df['cost_change'].std(),
+        'opposite_trend_years': int(opposite.sum())
+    }
+
+
+def analyze(df, stats):
+    # Everything the dashboard's insight panels show, without rendering anything; used
+    # by the batch report as well as the dashboard
+    first_year = int(df['year'].iloc[0])
+    last_year = int(df['year'].iloc[-1])
+    return {
+        'first_year': first_year,
+        'last_year': last_year,
+        'years': len(df),
+        'stats': dict(stats),
+        'usage': usage_insights(df, stats),
+        'cost': cost_insights(df, stats),
+        'cost_per_unit': cost_per_unit_insights(df),
+        'periods': period_analysis(df, period_split_year(first_year, last_year)),
+        'year_over_year': year_over_year_analysis(df)
+    }
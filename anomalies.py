@@ -0,0 +1,475 @@
+import argparse
+import copy
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from data_sources import READING_CHUNK_ROWS, default_source, open_source
+from dataset_store import STORE
+from figure_cache import LRUCache
+from sites import ALL_SITES
+
+# Streaming leak and spike detection over interval meter readings. A source is scanned in
+# chunks; everything carried from one chunk to the next is a fixed amount of state per
+# meter (its last WINDOW readings, its last NIGHT_WINDOW minimum night flows, the night
+# being measured and any open run), so years of history for every meter are scanned in
+# bounded memory.
+#
+#     python anomalies.py readings.parquet --out flagged.csv
+
+# Trailing readings behind each reading's median and MAD; a week of hourly readings
+WINDOW = 168
+
+# Robust z-score, (reading - median) / (1.4826 * MAD), above which a reading is a spike
+SPIKE_THRESHOLD = 8.0
+
+# Scales the MAD to a standard deviation for normally distributed readings
+MAD_SCALE = 1.4826
+
+# Spread used when a window's MAD is smaller, as a fraction of its median; keeps meters
+# with very regular readings from flagging every small change
+MIN_SPREAD_RATIO = 0.05
+
+# Hours [start, end) whose lowest reading is a meter's minimum night flow
+NIGHT_HOURS = (1, 5)
+
+# Previous nights whose median is a meter's usual minimum night flow
+NIGHT_WINDOW = 28
+
+# A night is leaking when its minimum flow is this many times the meter's usual minimum
+# night flow; a leak is that many consecutive leaking nights
+LEAK_FLOW_RATIO = 2.0
+LEAK_NIGHTS = 5
+
+# Windows whose median and MAD are computed at once; bounds the temporary copies
+MEDIAN_BATCH = 8192
+
+# Flagged periods per dataset version and setting. The open scans behind them are kept by
+# the dataset store; one carries about 1.9 KB of state per meter, mostly its last WINDOW
+# readings and NIGHT_WINDOW nights.
+ANOMALY_CACHE_BYTES = 16 * 1024 * 1024
+
+# Allowance per meter for its name and its entry in the meter lookup, and per flagged period
+METER_BYTES = 200
+EVENT_BYTES = 200
+
+EVENT_COLUMNS = ['site', 'kind', 'start', 'end', 'count', 'peak', 'score']
+
+DAY_NS = 24 * 3600 * 10 ** 9
+HOUR_NS = 3600 * 10 ** 9
+
+
+def _grow(array, size, fill):
+    if len(array) >= size:
+        return array
+    grown = np.full((size,) + array.shape[1:], fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def rolling_median_mad(values, window, positions):
+    # Median and MAD of the `window` values before each of `positions` in `values`, taking
+    # the upper middle value for an even window. A window isn't full until its oldest value
+    # is a reading rather than the NaN padding of a new meter; those get NaN.
+    windows = sliding_window_view(values, window)
+    middle = window // 2
+    median = np.empty(len(positions))
+    mad = np.empty(len(positions))
+    for start in range(0, len(positions), MEDIAN_BATCH):
+        batch = windows[positions[start:start + MEDIAN_BATCH] - window]
+        full = ~np.isnan(batch[:, 0])
+        # One partition around the middle is much cheaper than np.median's general path
+        batch = np.where(full[:, None], batch, 0.0)
+        batch.partition(middle, axis=1)
+        center = batch[:, middle]
+        deviation = np.abs(batch - center[:, None])
+        deviation.partition(middle, axis=1)
+        median[start:start + MEDIAN_BATCH] = np.where(full, center, np.nan)
+        mad[start:start + MEDIAN_BATCH] = np.where(full, deviation[:, middle], np.nan)
+    return median, mad
+
+
+def trailing_layout(tail, codes, values):
+    # Lays out each meter's carried tail (its last len(tail[0]) values) followed by its new
+    # values, so the window before every new value is a slice of one array. Returns that
+    # array and the new values' positions in it; `tail` is updated in place. `codes` must
+    # be sorted.
+    window = tail.shape[1]
+    first = np.r_[True, codes[1:] != codes[:-1]]
+    heads = np.flatnonzero(first)
+    meters = codes[heads]
+    offsets = heads + window * np.arange(len(heads))
+
+    layout = np.empty(len(values) + window * len(heads))
+    layout[offsets[:, None] + np.arange(window)] = tail[meters]
+    positions = np.arange(len(values)) + window * np.cumsum(first)
+    layout[positions] = values
+
+    lengths = np.diff(np.r_[heads, len(values)])
+    tail[meters] = layout[(offsets + lengths)[:, None] + np.arange(window)]
+    return layout, window, positions
+
+
+class RunTracker:
+    # Runs of consecutive flagged records per meter, merged across chunks. Records arrive
+    # sorted by meter and key; with a `gap`, records further apart than it break a run even
+    # if both are flagged. Runs still open at the end of a chunk stay in the per-meter state.
+
+    def __init__(self, kind, min_count=1, gap=None):
+        self.kind = kind
+        self.min_count = min_count
+        self.gap = gap
+        self.open = np.zeros(0, dtype=bool)
+        self.start = np.zeros(0, dtype='int64')
+        self.end = np.zeros(0, dtype='int64')
+        self.count = np.zeros(0, dtype='int64')
+        self.peak = np.zeros(0)
+        self.score = np.zeros(0)
+        self.last_key = np.zeros(0, dtype='int64')
+
+    def resize(self, meters):
+        self.open = _grow(self.open, meters, False)
+        self.start = _grow(self.start, meters, 0)
+        self.end = _grow(self.end, meters, 0)
+        self.count = _grow(self.count, meters, 0)
+        self.peak = _grow(self.peak, meters, 0.0)
+        self.score = _grow(self.score, meters, 0.0)
+        self.last_key = _grow(self.last_key, meters, np.iinfo('int64').min)
+
+    def update(self, codes, keys, flags, values, scores):
+        # Returns the runs closed by these records as (code, start, end, count, peak, score)
+        closed = []
+        if len(codes) == 0:
+            return closed
+
+        first = np.r_[True, codes[1:] != codes[:-1]]
+        last = np.r_[codes[1:] != codes[:-1], True]
+        prev_key = np.where(first, self.last_key[codes], np.r_[0, keys[:-1]])
+        prev_flag = np.where(first, self.open[codes], np.r_[False, flags[:-1]])
+        contiguous = np.ones(len(codes), dtype=bool) if self.gap is None else keys - prev_key <= self.gap
+        continues = flags & prev_flag & contiguous
+
+        # Open runs that the meter's first record in this chunk doesn't continue are over
+        ended = codes[first & ~continues & self.open[codes]]
+        closed.extend(self._close(ended))
+
+        # Group the flagged records into runs; a run continuing from an earlier chunk is its
+        # own group so it can be merged with the carried state
+        group_start = flags & (~continues | first)
+        flagged = np.flatnonzero(flags)
+        if len(flagged):
+            starts = np.flatnonzero(group_start[flagged])
+            heads = flagged[starts]
+            tails = flagged[np.r_[starts[1:], len(flagged)] - 1]
+            run_codes = codes[heads]
+            run_start = keys[heads]
+            run_count = np.diff(np.r_[starts, len(flagged)])
+            run_peak = np.maximum.reduceat(values[flagged], starts)
+            run_score = np.maximum.reduceat(scores[flagged], starts)
+
+            carried = continues[heads]
+            carried_codes = run_codes[carried]
+            run_start[carried] = self.start[carried_codes]
+            run_count[carried] += self.count[carried_codes]
+            run_peak[carried] = np.maximum(run_peak[carried], self.peak[carried_codes])
+            run_score[carried] = np.maximum(run_score[carried], self.score[carried_codes])
+            self.open[carried_codes] = False
+
+            # Runs reaching the meter's last record in this chunk may go on in the next one
+            still_open = last[tails]
+            for index in np.flatnonzero(~still_open):
+                if run_count[index] >= self.min_count:
+                    closed.append((
+                        run_codes[index], run_start[index], keys[tails[index]], run_count[index],
+                        run_peak[index], run_score[index]
+                    ))
+            open_codes = run_codes[still_open]
+            self.open[open_codes] = True
+            self.start[open_codes] = run_start[still_open]
+            self.end[open_codes] = keys[tails[still_open]]
+            self.count[open_codes] = run_count[still_open]
+            self.peak[open_codes] = run_peak[still_open]
+            self.score[open_codes] = run_score[still_open]
+
+        self.last_key[codes[last]] = keys[last]
+        return closed
+
+    def finish(self):
+        return self._close(np.flatnonzero(self.open))
+
+    def nbytes(self):
+        arrays = [self.open, self.start, self.end, self.count, self.peak, self.score, self.last_key]
+        return sum(array.nbytes for array in arrays)
+
+    def _close(self, codes):
+        closed = [
+            (code, self.start[code], self.end[code], self.count[code], self.peak[code], self.score[code])
+            for code in codes if self.count[code] >= self.min_count
+        ]
+        self.open[codes] = False
+        return closed
+
+
+class AnomalyDetector:
+    # Feed readings (timestamp, usage and optionally site) with update(), in any chunking;
+    # each meter's readings must arrive in time order. finish() closes the open periods and
+    # returns every flagged period as a frame of EVENT_COLUMNS.
+    #
+    # Spikes are readings far above the median of the meter's previous WINDOW readings, in
+    # units of the MAD; consecutive spiking readings form one period. Leaks are runs of
+    # LEAK_NIGHTS or more consecutive nights whose minimum flow stays LEAK_FLOW_RATIO times
+    # above the median of the meter's previous NIGHT_WINDOW nights: a fixture or pipe that
+    # never stops running.
+
+    def __init__(self, window=WINDOW, spike_threshold=SPIKE_THRESHOLD, leak_nights=LEAK_NIGHTS,
+                 leak_ratio=LEAK_FLOW_RATIO):
+        self.window = window
+        self.spike_threshold = spike_threshold
+        self.leak_ratio = leak_ratio
+        self.meters = {}
+        self.names = []
+        self.tail = np.full((0, window), np.nan)
+        self.last_time = np.zeros(0, dtype='int64')
+        self.night_day = np.zeros(0, dtype='int64')
+        self.night_min = np.zeros(0)
+        self.night_tail = np.full((0, NIGHT_WINDOW), np.nan)
+        self.spikes = RunTracker('spike')
+        self.leaks = RunTracker('leak', min_count=leak_nights, gap=1)
+        self.events = []
+
+    def _codes(self, sites):
+        # Meter index per reading, registering meters seen for the first time
+        if sites is None:
+            inverse, names = None, [ALL_SITES]
+        else:
+            inverse, names = pd.factorize(sites)
+        for name in names:
+            if name not in self.meters:
+                self.meters[name] = len(self.names)
+                self.names.append(name)
+
+        meters = len(self.names)
+        if len(self.tail) < meters:
+            self.tail = _grow(self.tail, meters, np.nan)
+            self.last_time = _grow(self.last_time, meters, np.iinfo('int64').min)
+            self.night_day = _grow(self.night_day, meters, -1)
+            self.night_min = _grow(self.night_min, meters, np.inf)
+            self.night_tail = _grow(self.night_tail, meters, np.nan)
+            self.spikes.resize(meters)
+            self.leaks.resize(meters)
+
+        lookup = np.array([self.meters[name] for name in names], dtype='int64')
+        return lookup[0] if inverse is None else lookup[inverse]
+
+    def update(self, readings):
+        # Readings without a site belong to no meter; the site rollups leave them out too
+        present = readings['usage'].notna()
+        if 'site' in readings.columns:
+            present &= readings['site'].notna()
+        readings = readings[present]
+        if len(readings) == 0:
+            return self
+
+        times = pd.to_datetime(readings['timestamp']).to_numpy().astype('datetime64[ns]').view('int64')
+        codes = self._codes(readings['site'] if 'site' in readings.columns else None)
+        codes = np.broadcast_to(codes, times.shape)
+        order = np.lexsort((times, codes))
+        codes, times = codes[order], times[order]
+        usage = readings['usage'].to_numpy(dtype='float64')[order]
+
+        first = np.r_[True, codes[1:] != codes[:-1]]
+        late = first & (times <= self.last_time[codes])
+        if late.any():
+            meter = self.names[codes[late][0]]
+            raise ValueError(f"Readings for {meter} arrived out of time order; only appends are supported")
+
+        median, mad = rolling_median_mad(*trailing_layout(self.tail, codes, usage))
+        self._flag_spikes(codes, times, usage, median, mad)
+        self._measure_nights(codes, times, usage)
+
+        last = np.r_[codes[1:] != codes[:-1], True]
+        self.last_time[codes[last]] = times[last]
+        return self
+
+    def _flag_spikes(self, codes, times, usage, median, mad):
+        spread = np.maximum(MAD_SCALE * mad, MIN_SPREAD_RATIO * median)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = np.where(spread > 0, (usage - median) / spread, np.where(usage > median, np.inf, 0.0))
+        flags = score > self.spike_threshold
+        self._record(self.spikes, self.spikes.update(codes, times, flags, usage, np.nan_to_num(score)))
+
+    def _measure_nights(self, codes, times, usage):
+        # Minimum flow per meter and night. Each meter's latest night may continue in the
+        # next chunk, so it's carried over; the earlier ones are complete.
+        hours = times % DAY_NS // HOUR_NS
+        night = (hours >= NIGHT_HOURS[0]) & (hours < NIGHT_HOURS[1])
+        nights = pd.DataFrame({'code': codes[night], 'day': times[night] // DAY_NS, 'flow': usage[night]})
+        carried = np.flatnonzero(self.night_day >= 0)
+        carried = carried[np.isin(carried, nights['code'].to_numpy())]
+        nights = pd.concat([
+            pd.DataFrame({'code': carried, 'day': self.night_day[carried], 'flow': self.night_min[carried]}),
+            nights
+        ], ignore_index=True)
+        if len(nights) == 0:
+            return
+
+        nights = nights.groupby(['code', 'day'], sort=True)['flow'].min()
+        codes = nights.index.get_level_values('code').to_numpy()
+        days = nights.index.get_level_values('day').to_numpy()
+        flow = nights.to_numpy()
+
+        latest = np.r_[codes[1:] != codes[:-1], True]
+        self.night_day[codes[latest]] = days[latest]
+        self.night_min[codes[latest]] = flow[latest]
+        self._close_nights(codes[~latest], days[~latest], flow[~latest])
+
+    def _close_nights(self, codes, days, flow):
+        # A chunk may hold only nights that are still open, e.g. when every meter has one
+        if len(codes) == 0:
+            return
+        median, _ = rolling_median_mad(*trailing_layout(self.night_tail, codes, flow))
+        # Nothing is flagged until a meter has NIGHT_WINDOW nights to compare with
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(median > 0, flow / median, np.where(flow > 0, np.inf, 0.0))
+        ratio = np.where(np.isnan(median), 0.0, ratio)
+        flags = ratio > self.leak_ratio
+        self._record(self.leaks, self.leaks.update(codes, days, flags, flow, ratio))
+
+    def _record(self, tracker, closed):
+        for code, start, end, count, peak, score in closed:
+            if tracker.kind == 'leak':
+                start, end = start * DAY_NS, (end + 1) * DAY_NS
+            self.events.append((self.names[code], tracker.kind, start, end, count, peak, score))
+
+    def nbytes(self):
+        # Per-meter state and the flagged periods so far, each a tuple of seven values
+        arrays = [self.tail, self.last_time, self.night_day, self.night_min, self.night_tail]
+        return (
+            sum(array.nbytes for array in arrays) + self.spikes.nbytes() + self.leaks.nbytes()
+            + METER_BYTES * len(self.names) + EVENT_BYTES * len(self.events)
+        )
+
+    def finish(self):
+        # Closes the nights and runs still open, then returns every flagged period
+        pending = np.flatnonzero(self.night_day >= 0)
+        self._close_nights(pending, self.night_day[pending], self.night_min[pending])
+        self.night_day[pending] = -1
+        self._record(self.spikes, self.spikes.finish())
+        self._record(self.leaks, self.leaks.finish())
+
+        events = pd.DataFrame(self.events, columns=EVENT_COLUMNS)
+        events['start'] = pd.to_datetime(events['start'].astype('int64'))
+        events['end'] = pd.to_datetime(events['end'].astype('int64'))
+        events['count'] = events['count'].astype('int64')
+        events['peak'] = events['peak'].astype('float64')
+        events['score'] = events['score'].astype('float64')
+        return events.sort_values(['start', 'site'], ignore_index=True)
+
+
+def scan_columns(source):
+    # Columns the detector reads, or None when the readings have no timestamps
+    available = source.columns()
+    if 'timestamp' not in available:
+        return None
+    return [column for column in ['timestamp', 'site', 'usage'] if column in available]
+
+
+def scan_source(source, chunk_rows=READING_CHUNK_ROWS, **options):
+    # Flagged periods for a source, or None when its readings have no timestamps
+    columns = scan_columns(source)
+    if columns is None:
+        return None
+    detector = AnomalyDetector(**options)
+    for chunk in source.iter_readings(columns, chunk_rows):
+        detector.update(chunk)
+    return detector.finish()
+
+
+class SourceScan:
+    # A detector that has read a source's readings and is left open, so readings appended
+    # to the source's dataset later are scanned without reading the source again (see
+    # DatasetStore.scan). Flagged periods are taken from a copy, which leaves the scan open;
+    # the per-meter state copied is fixed in size.
+
+    def __init__(self, source, columns, chunk_rows=READING_CHUNK_ROWS, **options):
+        self.columns = columns
+        self.detector = AnomalyDetector(**options)
+        self.lock = threading.Lock()
+        for chunk in source.iter_readings(columns, chunk_rows):
+            self.detector.update(chunk)
+
+    def append(self, readings):
+        with self.lock:
+            self.detector.update(readings[[column for column in self.columns if column in readings.columns]])
+
+    def events(self):
+        with self.lock:
+            detector = copy.deepcopy(self.detector)
+        return detector.finish()
+
+    def nbytes(self):
+        return self.detector.nbytes()
+
+
+def dataset_events(source, dataset, store=STORE, **options):
+    # Flagged periods for a dataset version, or None when the readings have no timestamps.
+    # The source is scanned once per source version and setting, and the scan is kept up
+    # to date with the readings appended to its dataset.
+    columns = scan_columns(source)
+    if columns is None:
+        return None
+    scan = store.scan(
+        dataset, ('anomalies',) + tuple(sorted(options.items())), lambda: SourceScan(source, columns, **options)
+    )
+    return scan.events()
+
+
+class AnomalyCache(LRUCache):
+    # Flagged periods keyed by dataset version and detector settings, sized by their frames
+
+    def size_of(self, value):
+        if value is None:
+            return 0
+        return int(value.memory_usage(deep=True).sum())
+
+
+ANOMALIES = AnomalyCache(ANOMALY_CACHE_BYTES)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Flag leaks and usage spikes in interval meter readings.")
+    parser.add_argument('path', nargs='?', help="Meter export (.csv, .parquet, .arrow). Defaults to the dashboard's data source.")
+    parser.add_argument('--out', help="Write the flagged periods to this CSV file instead of printing them")
+    parser.add_argument('--chunk-rows', type=int, default=READING_CHUNK_ROWS, help="Readings scanned per chunk")
+    parser.add_argument('--window', type=int, default=WINDOW, help="Trailing readings behind the median and MAD")
+    parser.add_argument('--spike-threshold', type=float, default=SPIKE_THRESHOLD, help="Robust z-score of a spike")
+    parser.add_argument('--leak-nights', type=int, default=LEAK_NIGHTS, help="Consecutive leaking nights of a leak")
+    parser.add_argument('--leak-ratio', type=float, default=LEAK_FLOW_RATIO,
+                        help="Minimum night flow of a leaking night, as a multiple of the meter's usual one")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    source = open_source(args.path) if args.path else default_source()
+    events = scan_source(
+        source, args.chunk_rows, window=args.window, spike_threshold=args.spike_threshold,
+        leak_nights=args.leak_nights, leak_ratio=args.leak_ratio
+    )
+    if events is None:
+        print("The readings have no timestamps; anomalies are detected in interval data only", file=sys.stderr)
+        return 1
+
+    if args.out:
+        events.to_csv(args.out, index=False)
+        print(f"Wrote {len(events)} flagged periods to {args.out}")
+    else:
+        print(events.to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
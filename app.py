@@ -1,9 +1,39 @@
-import streamlit as st
+import calendar
+import os
+import time
+
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import numpy as np
+import streamlit as st
+
+from analysis import (
+    PRICE_THRESHOLDS, cost_insights, cost_per_unit_insights, parse_levels, period_analysis, period_split_year,
+    usage_insights, year_over_year_analysis
+)
+from anomalies import ANOMALIES, LEAK_NIGHTS, SPIKE_THRESHOLD, dataset_events
+from data_sources import default_source
+from dataset_store import STORE, get_dataset
+from downsample import DEFAULT_POINT_BUDGET, METHODS
+from exports import EXPORT_FORMATS, EXPORTS, build_export, export_file_name, export_mime
+from figure_cache import FIGURES, figure_key
+from figures import (
+    cluster_shapes_figure, combined_figure, cost_figure, cost_per_unit_figure, readings_figure,
+    tariff_comparison_figure, usage_figure, year_over_year_figure
+)
+from forecast import DEFAULT_HORIZON, FORECAST_METHODS, FORECASTS, fit_view
+from ingest import ingestion_for
+from live import (
+    DEFAULT_LIVE_POINTS, DEFAULT_REFRESH, LIVE_WINDOWS, REFRESH_INTERVALS, LiveWindow, shared_mode, shared_window
+)
+from pyramid import resolution_label
+from similarity import (
+    CLUSTER_COUNTS, DEFAULT_CLUSTERS, SIMILAR_METERS, SIMILARITY, cluster_profiles, cluster_summary,
+    covariate_correlations, covariates_path, load_covariates, meter_profiles, similar_meters, top_correlations
+)
+from table_view import PAGE_SIZES, ROW_ORDERS, ordered_positions, page_of
+from tariffs import TARIFF_PRESETS, Tariff, scenario_dataset
+from timing import DEV_MODE_ENV, TIMINGS, rerun_timing, span
+from sites import ALL_SITES, LEVELS
+from snapshot import boot_snapshot
 
 # Set page configuration
 st.set_page_config(
@@ -88,51 +118,200 @@ add_custom_styling()
 st.markdown('<h1 class="main-header">Water Usage and Cost Dashboard</h1>', unsafe_allow_html=True)
 
 class WaterUsageDashboard:
-    def __init__(self):
-        # Initialize data
-        self.data = [
-            {'year': 2011, 'usage': 2178900, 'cost': 209828.00, 'costPerUnit': 0.0963},
-            {'year': 2012, 'usage': 1427550, 'cost': 137535.00, 'costPerUnit': 0.0963},
-            {'year': 2013, 'usage': 1532850, 'cost': 172209.00, 'costPerUnit': 0.1123},
-            {'year': 2014, 'usage': 1071650, 'cost': 125883.00, 'costPerUnit': 0.1175},
-            {'year': 2015, 'usage': 1381200, 'cost': 161637.00, 'costPerUnit': 0.1170},
-            {'year': 2016, 'usage': 1711350, 'cost': 201544.00, 'costPerUnit': 0.1178},
-            {'year': 2017, 'usage': 1607100, 'cost': 194743.00, 'costPerUnit': 0.1212},
-            {'year': 2018, 'usage': 1800750, 'cost': 218194.00, 'costPerUnit': 0.1212},
-            {'year': 2019, 'usage': 1507500, 'cost': 180065.00, 'costPerUnit': 0.1240},
-            {'year': 2020, 'usage': 1148800, 'cost': 122968.00, 'costPerUnit': 0.1070},
-            {'year': 2021, 'usage': 1035350, 'cost': 126298.00, 'costPerUnit': 0.1220},
-            {'year': 2022, 'usage': 1272460, 'cost': 165442.70, 'costPerUnit': 0.1300},
-            {'year': 2023, 'usage': 1088370, 'cost': 165066.76, 'costPerUnit': 0.1517}
-        ]
-        
-        # Convert to dataframe for easier plotting
-        self.df = pd.DataFrame(self.data)
-        
-        # Calculate year-over-year changes
-        self.df['usage_change'] = self.df['usage'].pct_change() * 100
-        self.df['cost_change'] = self.df['cost'].pct_change() * 100
-        
-        # Calculate stats
-        self.stats = {
-            'total_usage': self.df['usage'].sum(),
-            'total_cost': self.df['cost'].sum(),
-            'avg_usage': self.df['usage'].mean(),
-            'avg_cost': self.df['cost'].mean(),
-            'min_usage': self.df['usage'].min(),
-            'max_usage': self.df['usage'].max(),
-            'min_cost': self.df['cost'].min(),
-            'max_cost': self.df['cost'].max(),
-            'min_year_usage': int(self.df.loc[self.df['usage'].idxmin(), 'year']),
-            'max_year_usage': int(self.df.loc[self.df['usage'].idxmax(), 'year']),
-            'min_year_cost': int(self.df.loc[self.df['cost'].idxmin(), 'year']),
-            'max_year_cost': int(self.df.loc[self.df['cost'].idxmax(), 'year']),
-            'cost_per_unit_increase': ((self.df['costPerUnit'].iloc[-1] / self.df['costPerUnit'].iloc[0]) - 1) * 100
-        }
+    def __init__(self, source=None):
+        # Shared dataset for the configured source; built once per source version and
+        # reused by every rerun and session instead of recomputing changes and stats
+        self.source = source if source is not None else default_source()
+        with span('data_load'):
+            # A new worker given a snapshot boots from it instead of loading the source
+            boot_snapshot(self.source)
+            self.dataset = get_dataset(self.source)
+        # New readings from the head-end API, when one is configured, are appended in the
+        # background and show up as new dataset versions on later reruns
+        self.ingestion = ingestion_for(self.source)
+        # The metered dataset; self.dataset is swapped for a re-priced one in tariff scenarios
+        self.actual_dataset = self.dataset
+        self.tariff = None
+        self.select_view()
+
+    def select_view(self, level='all', key=None, years=None):
+        # Point the views at the whole portfolio, one site group or one site, optionally
+        # limited to a (first, last) year range. The frames, stats and range queries are
+        # precomputed in the shared dataset, so this is only a lookup.
+        self.selection = (level, key)
+        self.years = years
+        with span('select_view'):
+            self.df, self.stats = self.dataset.select(level, key, years)
+        self.first_year = int(self.df['year'].iloc[0])
+        self.last_year = int(self.df['year'].iloc[-1])
+        self.year_label = f"{self.first_year}-{self.last_year}"
+
+    def cached_figure(self, view, build, **options):
+        # Reuse a figure built for the same view, data version, filters and options
+        key = figure_key(view, self.dataset.version, self.selection, self.years, options)
+        
+        def timed_build():
+            with span(f'figure_build:{view}'):
+                return build()
+        
+        return FIGURES.get_or_build(key, timed_build)
+
+    def forecast_for(self, column):
+        # Forecast band for the selected series, or None when forecasts are off or the year
+        # range stops before the series' last year. The fits for every series at the selection
+        # level are cached per dataset version, so switching sites or horizons doesn't refit.
+        if not self.forecast_options['show']:
+            return None
+        level, key = self.selection
+        method = self.forecast_options['method']
+        with span(f'forecast:{column}'):
+            fitted = FORECASTS.get_or_build(
+                ('forecast', self.dataset.version, level, column, method),
+                lambda: fit_view(self.dataset, level, column, method)
+            )
+            forecast = fitted.forecast(key, self.forecast_options['horizon'])
+        if forecast is None or forecast['year'].iloc[0] != self.last_year + 1:
+            return None
+        return forecast
+
+    def anomalies_for(self):
+        # Flagged leak and spike periods for the selected sites and years, or None when
+        # detection is off. The source is scanned once per setting, and the dataset store
+        # passes each appended batch to that scan once.
+        options = self.anomaly_options
+        if not options['show']:
+            return None
+        with span('anomaly_scan'):
+            events = ANOMALIES.get_or_build(
+                ('anomalies', self.actual_dataset.version, options['spike_threshold'], options['leak_nights']),
+                lambda: dataset_events(
+                    self.source, self.actual_dataset,
+                    spike_threshold=options['spike_threshold'], leak_nights=options['leak_nights']
+                )
+            )
+        if events is None:
+            return None
+        
+        level, key = self.selection
+        if level == 'site':
+            events = events[events['site'] == key]
+        elif level == 'site_group':
+            events = events[events['site'].isin(self.group_sites(key))]
+        first = pd.Timestamp(year=self.first_year, month=1, day=1)
+        last = pd.Timestamp(year=self.last_year + 1, month=1, day=1)
+        return events[(events['end'] >= first) & (events['start'] < last)]
+
+    def apply_tariff(self, tariff):
+        # Point every view at the dataset re-priced under the tariff, keeping the selection
+        with span('tariff_scenario'):
+            self.dataset = scenario_dataset(self.source, self.actual_dataset, tariff)
+        self.tariff = tariff
+        self.select_view(self.selection[0], self.selection[1], self.years)
+
+    def similarity_for(self):
+        # Meter profiles, every meter's best matches and the clustering, each computed once
+        # per dataset version (and cluster count) and shared by every session; picking
+        # another meter only looks up its row of the cached matches
+        version = self.actual_dataset.version
+        clusters = self.similarity_options['clusters']
+        with span('meter_similarity'):
+            profiles = SIMILARITY.get_or_build(
+                ('profiles', version), lambda: meter_profiles(self.source, self.actual_dataset)
+            )
+            correlations = SIMILARITY.get_or_build(
+                ('correlations', version), lambda: top_correlations(profiles)
+            )
+            clustering = SIMILARITY.get_or_build(
+                ('clusters', version, clusters), lambda: cluster_profiles(profiles, clusters)
+            )
+        return profiles, correlations, clustering
+
+    def covariates_for(self, profiles):
+        # Each meter's correlation with the configured covariates, or None when none are set
+        path = covariates_path()
+        if path is None:
+            return None
+        modified = os.path.getmtime(path)
+        with span('covariate_correlations'):
+            covariates = SIMILARITY.get_or_build(('covariates', path, modified), lambda: load_covariates(path))
+            return SIMILARITY.get_or_build(
+                ('covariate_correlations', self.actual_dataset.version, path, modified),
+                lambda: covariate_correlations(profiles, covariates)
+            )
+
+    def group_sites(self, group):
+        site_yearly = self.dataset.rollups.site_yearly
+        return list(site_yearly.loc[site_yearly['site_group'] == group, 'site'].unique())
+
+    def milestones(self, column, levels, below=False):
+        # First year the selected series reached each level (fell to it with below=True) in
+        # the selected years, or None, from the dataset's precomputed crossing index
+        level, key = self.selection
+        crossings = self.dataset.crossing_years(level, column, levels, [key], self.years, below)
+        return {threshold: None if pd.isna(year) else int(year) for threshold, year in crossings.iloc[0].items()}
+
+    def render_site_milestones(self, title, column, levels, labels, below=False):
+        # The same milestones for every site in the selection, answered in one batch
+        if self.dataset.rollups is None or self.selection[0] == 'site' or not levels:
+            return
+        keys = self.group_sites(self.selection[1]) if self.selection[0] == 'site_group' else None
+        crossings = self.dataset.crossing_years('site', column, levels, keys, self.years, below)
+        crossings.columns = labels
+        with st.expander(f"{title} by site"):
+            st.caption("First year each site got there in the selected years; empty where it never did.")
+            st.dataframe(crossings, use_container_width=True)
+
+    def anomaly_key(self, anomalies):
+        # Figure cache options for a chart with or without anomaly annotations
+        if anomalies is None:
+            return {}
+        return {'anomalies': (self.anomaly_options['spike_threshold'], self.anomaly_options['leak_nights'])}
+
+    def render_anomaly_summary(self, anomalies):
+        leaks = int((anomalies['kind'] == 'leak').sum())
+        spikes = int((anomalies['kind'] == 'spike').sum())
+        st.caption(f"⚠️ Flagged in the selected years: possible leaks: {leaks:,} • usage spikes: {spikes:,}")
+        if len(anomalies):
+            with st.expander("Flagged periods"):
+                st.dataframe(
+                    anomalies.sort_values('score', ascending=False),
+                    hide_index=True,
+                    use_container_width=True,
+                    column_config={
+                        'site': 'Site',
+                        'kind': 'Kind',
+                        'start': st.column_config.DatetimeColumn('Start', format='YYYY-MM-DD HH:mm'),
+                        'end': st.column_config.DatetimeColumn('End', format='YYYY-MM-DD HH:mm'),
+                        'count': st.column_config.NumberColumn('Readings / nights'),
+                        'peak': st.column_config.NumberColumn('Peak usage', format='%.1f'),
+                        'score': st.column_config.NumberColumn(
+                            'Score', format='%.1f',
+                            help="Robust z-score for spikes; minimum night flow over the usual for leaks"
+                        )
+                    }
+                )
+
+    def forecast_key(self, forecast):
+        # Figure cache options for a chart with or without a forecast overlay
+        if forecast is None:
+            return {}
+        return {'forecast': (self.forecast_options['method'], self.forecast_options['horizon'])}
+
+    def plotly_chart(self, view, fig):
+        # Serializing the figure and sending it to the browser, timed apart from building it
+        with span(f'plotly_chart:{view}'):
+            st.plotly_chart(fig, use_container_width=True)
+
+    def dev_mode(self):
+        return os.environ.get(DEV_MODE_ENV) == '1' or st.query_params.get('dev') == '1'
 
     def format_number(self, num):
         return f"{num:,}"
     
+    def format_rate(self, rate):
+        # Cost per unit levels keep at least cents, and any further digits typed in
+        return f"${rate:.2f}" if round(rate, 2) == rate else f"${rate:g}"
+    
     def format_currency(self, num):
         return f"${num:,.2f}"
     
@@ -162,605 +341,1061 @@ class WaterUsageDashboard:
         with col4:
             st.markdown('<div class="metric-card">', unsafe_allow_html=True)
             st.markdown(f'<div class="metric-value">{self.stats["cost_per_unit_increase"]:.1f}%</div>', unsafe_allow_html=True)
-            st.markdown('<div class="metric-label">Cost per Unit Increase (2011-2023)</div>', unsafe_allow_html=True)
+            st.markdown(f'<div class="metric-label">Cost per Unit Increase ({self.year_label})</div>', unsafe_allow_html=True)
             st.markdown('</div>', unsafe_allow_html=True)
     
     def render_dashboard(self):
-        # Show KPI metrics
-        self.render_kpi_metrics()
+        # The sidebar goes first because its selections decide what every view shows
+        with span('render_sidebar'):
+            self.render_sidebar()
+        
+        if self.tariff is not None:
+            st.info(
+                f"💡 Tariff scenario: costs are the metered usage billed under **{self.tariff.name}**. "
+                "Turn off the scenario in the sidebar to see actual costs."
+            )
         
-        # Create tabs for different visualizations
-        tab1, tab2, tab3, tab4, tab5 = st.tabs(["📊 Combined View", "💧 Water Usage", "💰 Cost", "📈 Cost per Unit", "📋 Data Table"])
+        # Show KPI metrics
+        with span('render_kpi_metrics'):
+            self.render_kpi_metrics()
+        
+        # The live panel reruns on its own timer; the rest of the page waits for a full rerun
+        if self.live_options['show']:
+            st.fragment(self.render_live_panel, run_every=self.live_options['refresh'])()
+        
+        # Create tabs for different visualizations. Switching tabs reruns the app, and only
+        # the selected tab's figures and insights are computed and sent.
+        views = {
+            "📊 Combined View": self.render_combined_view,
+            "💧 Water Usage": self.render_usage_view,
+            "💰 Cost": self.render_cost_view,
+            "📈 Cost per Unit": self.render_cost_per_unit_view,
+            "📋 Data Table": self.render_data_table
+        }
+        tabs = st.tabs(list(views), key='view_tab', on_change='rerun')
         
-        with tab1:
-            self.render_combined_view()
-            
-        with tab2:
-            self.render_usage_view()
-            
-        with tab3:
-            self.render_cost_view()
-            
-        with tab4:
-            self.render_cost_per_unit_view()
-            
-        with tab5:
-            self.render_data_table()
+        for tab, render in zip(tabs, views.values()):
+            if tab.open:
+                with tab, span(render.__name__):
+                    render()
         
         # Show analysis section
         st.markdown('<h2 class="sub-header">Detailed Analysis</h2>', unsafe_allow_html=True)
-        self.render_detailed_analysis()
+        with span('render_detailed_analysis'):
+            self.render_detailed_analysis()
+        
+        if self.similarity_options['show']:
+            st.markdown('<h2 class="sub-header">Meter Similarity</h2>', unsafe_allow_html=True)
+            with span('render_meter_similarity'):
+                self.render_meter_similarity()
         
         # Show year-over-year changes
         st.markdown('<h2 class="sub-header">Year-over-Year Changes</h2>', unsafe_allow_html=True)
-        self.render_year_over_year()
+        with span('render_year_over_year'):
+            self.render_year_over_year()
         
-        # Add a sidebar with additional options
-        self.render_sidebar()
+        self.render_cache_metrics()
         
         # Footer
         st.markdown('<div class="footer">Water Usage Dashboard • Created with Streamlit • 2025</div>', unsafe_allow_html=True)
     
-    def render_combined_view(self):
-        st.markdown('<div class="card">', unsafe_allow_html=True)
-        
-        # Create figure with secondary y-axis
-        fig = make_subplots(specs=[[{"secondary_y": True}]])
-        
-        # Add bar chart for usage
-        fig.add_trace(
-            go.Bar(
-                x=self.df['year'], 
-                y=self.df['usage'], 
-                name="Water Usage",
-                marker_color='#AB2330',
-                hovertemplate='Year: %{x}<br>Usage: %{y:,.0f} cubic feet<extra></extra>'
-            ),
-            secondary_y=False,
-        )
-        
-        # Add line chart for cost
-        fig.add_trace(
-            go.Scatter(
-                x=self.df['year'], 
-                y=self.df['cost'], 
-                name="Water Cost",
-                line=dict(color='#EF4444', width=3),
-                hovertemplate='Year: %{x}<br>Cost: $%{y:,.2f}<extra></extra>'
-            ),
-            secondary_y=True,
-        )
-        
-        # Set titles and labels
-        fig.update_layout(
-            title="Water Usage and Cost (2011-2023)",
-            hovermode="x unified",
-            hoverlabel=dict(bgcolor="white", font_size=12),
-            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-            height=500,
-            margin=dict(l=60, r=60, t=80, b=60),
-            plot_bgcolor='rgba(245,250,255,0.5)'
-        )
-        
-        # Update axes
-        fig.update_xaxes(
-            title_text="Year",
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(211,211,211,0.5)',
-            tickmode='linear'
+    def render_live_panel(self):
+        # The latest dataset version, which may be newer than the one this run started with
+        dataset = STORE.get(self.source)
+        points = self.live_options['points']
+        if shared_mode():
+            # One window for every session on this source and size; the session only
+            # remembers which version it drew last
+            live = shared_window(dataset.source_key, points)
+        else:
+            live = st.session_state.get('live_window')
+            if live is None or live.source_key != dataset.source_key or live.max_points != points:
+                live = LiveWindow(dataset.source_key, points)
+                st.session_state['live_window'] = live
+        # Read under the window's lock, so another session's refresh can't change it midway
+        with span('live_update'), live.lock:
+            live.update(dataset)
+            fig = live.figure()
+            latest = live.timestamps[-1]
+            shown = len(live.timestamps)
+            totals = dict(live.totals)
+            added = live.arrived_since(st.session_state.get('live_version'))
+        st.session_state['live_version'] = live.version
+        
+        st.markdown('<h2 class="sub-header">Live Readings</h2>', unsafe_allow_html=True)
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Latest reading", f"{latest.astype('datetime64[s]').item():%Y-%m-%d %H:%M}")
+        col2.metric(
+            f"Usage, last {shown:,} readings", f"{totals['usage']:,.0f} ft³",
+            delta=f"+{added['usage']:,.0f} ft³" if added['readings'] else None
         )
-        
-        fig.update_yaxes(
-            title_text="Water Usage (cubic feet)",
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(211,211,211,0.5)',
-            tickformat=",.0f",
-            secondary_y=False
+        col3.metric(
+            "Cost, same readings", self.format_currency(totals['cost']),
+            delta=f"+{self.format_currency(added['cost'])}" if added['readings'] else None,
+            delta_color='inverse'
         )
-        
-        fig.update_yaxes(
-            title_text="Cost ($)",
-            showgrid=False,
-            tickprefix="$",
-            tickformat=",.2f",
-            secondary_y=True
+        current = dataset.df.iloc[-1]
+        col4.metric(f"Usage in {int(current['year'])} so far", f"{current['usage']:,.0f} ft³")
+        self.plotly_chart('live', fig)
+        
+        if dataset.version != self.actual_dataset.version:
+            st.caption(
+                f"New readings have arrived since the views below were drawn (dataset v{self.actual_dataset.version}, "
+                f"now v{dataset.version})."
+            )
+            if st.button("Refresh all views", key='live_refresh_all'):
+                st.rerun()
+
+    def render_single_year_note(self):
+        # Insights that compare years have nothing to compare within a single year
+        st.info(
+            f"💡 Only {self.first_year} is in the selected data, so there are no year-over-year changes or "
+            "trends to show. Add more years of readings to see them."
         )
+
+    def render_combined_view(self):
+        st.markdown('<div class="card">', unsafe_allow_html=True)
         
-        st.plotly_chart(fig, use_container_width=True)
+        fig = self.cached_figure('combined', lambda: combined_figure(self.df, self.year_label))
+        self.plotly_chart('combined', fig)
         st.markdown('</div>', unsafe_allow_html=True)
 
     def render_usage_view(self):
         st.markdown('<div class="card">', unsafe_allow_html=True)
         
-        # Create interactive bar chart for usage
-        fig = px.bar(
-            self.df,
-            x='year',
-            y='usage',
-            title='Annual Water Usage (2011-2023)',
-            labels={'year': 'Year', 'usage': 'Water Usage (cubic feet)'},
-            color_discrete_sequence=['#7851A9'],
-            text_auto='.2s'
-        )
-        
-        # Customize layout
-        fig.update_layout(
-            hovermode="x unified",
-            hoverlabel=dict(bgcolor="white", font_size=12),
-            height=500,
-            margin=dict(l=60, r=60, t=80, b=60),
-            plot_bgcolor='rgba(245,250,255,0.5)'
-        )
-        
-        fig.update_traces(
-            hovertemplate='Year: %{x}<br>Usage: %{y:,.0f} cubic feet<extra></extra>',
-            textposition='outside'
-        )
-        
-        fig.update_xaxes(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(211,211,211,0.5)',
-            tickmode='linear'
-        )
-        
-        fig.update_yaxes(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(211,211,211,0.5)',
-            tickformat=",.0f"
-        )
-        
-        st.plotly_chart(fig, use_container_width=True)
-        
-        # Add insights for water usage
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown("""
-            #### Key Insights:
-            - Highest usage in **{}** with {:,} cubic feet
-            - Lowest usage in **{}** with {:,} cubic feet
-            - Notable **{:.1f}%** decrease from peak usage to present
-            """.format(
-                self.stats['max_year_usage'], 
-                self.stats['max_usage'],
-                self.stats['min_year_usage'],
-                self.stats['min_usage'],
-                ((self.stats['max_usage'] - self.df['usage'].iloc[-1]) / self.stats['max_usage']) * 100
-            ))
-        
-        with col2:
-            # Add year with biggest drop
-            biggest_drop_idx = self.df['usage_change'].idxmin()
-            biggest_drop_year = self.df.loc[biggest_drop_idx, 'year']
-            biggest_drop_pct = self.df.loc[biggest_drop_idx, 'usage_change']
-            
-            st.markdown("""
-            #### Notable Changes:
-            - Largest single-year decrease: **{:.1f}%** in **{}**
-            - Average annual usage: {:,} cubic feet
-            - Current usage is **{:.1f}%** of 2011 baseline
-            """.format(
-                biggest_drop_pct,
-                int(biggest_drop_year),
-                int(self.stats['avg_usage']),
-                (self.df['usage'].iloc[-1] / self.df['usage'].iloc[0]) * 100
+        anomalies = self.anomalies_for()
+        if self.show_readings():
+            self.render_readings_chart('usage')
+        else:
+            forecast = self.forecast_for('usage')
+            fig = self.cached_figure(
+                'usage',
+                lambda: usage_figure(self.df, self.year_label, forecast, anomalies),
+                **self.forecast_key(forecast),
+                **self.anomaly_key(anomalies)
+            )
+            self.plotly_chart('usage', fig)
+        if anomalies is not None:
+            self.render_anomaly_summary(anomalies)
+        
+        if len(self.df) < 2:
+            self.render_single_year_note()
+        else:
+            # Add insights for water usage
+            insights = usage_insights(self.df, self.stats)
+            col1, col2 = st.columns(2)
+        
+            with col1:
+                st.markdown("""
+                #### Key Insights:
+                - Highest usage in **{}** with {:,} cubic feet
+                - Lowest usage in **{}** with {:,} cubic feet
+                - Notable **{:.1f}%** decrease from peak usage to present
+                """.format(
+                    self.stats['max_year_usage'], 
+                    self.stats['max_usage'],
+                    self.stats['min_year_usage'],
+                    self.stats['min_usage'],
+                    insights['peak_drop_pct']
+                ))
+        
+            with col2:
+                st.markdown("""
+                #### Notable Changes:
+                - Largest single-year decrease: **{:.1f}%** in **{}**
+                - Average annual usage: {:,} cubic feet
+                - Current usage is **{:.1f}%** of {} baseline
+                """.format(
+                    insights['biggest_drop_pct'],
+                    insights['biggest_drop_year'],
+                    int(self.stats['avg_usage']),
+                    insights['current_vs_first_pct'],
+                    self.first_year
+                ))
+        
+        if self.usage_levels:
+            # First year usage fell to each of the levels set in the sidebar, highest first
+            levels = self.usage_levels[::-1]
+            milestones = self.milestones('usage', levels, below=True)
+            st.markdown("#### Usage Milestones:\n" + "\n".join(
+                f"- Fell to {level:,.0f} cubic feet or less: **{'N/A' if year is None else year}**"
+                for level, year in milestones.items()
             ))
+            self.render_site_milestones(
+                "Usage milestones", 'usage', levels, [f"≤ {level:,.0f}" for level in levels], below=True
+            )
         
         st.markdown('</div>', unsafe_allow_html=True)
 
+    def show_readings(self):
+        # Reading-level charts need timestamped data; they cover the whole portfolio only
+        return self.chart_detail['resolution'] == 'readings' and self.selection[0] == 'all'
+
+    # A fragment, so moving the zoom slider reruns only this chart
+    @st.fragment
+    def render_readings_chart(self, column):
+        readings = self.dataset.series_between(self.first_year, self.last_year)
+        start = readings.index[0].to_pydatetime()
+        end = readings.index[-1].to_pydatetime()
+        
+        # Streamlit doesn't report Plotly zoom events, so zooming is a slider: a narrower
+        # window re-queries the readings and spends the same point budget on fewer of them
+        zoom = st.slider(
+            f"Zoom {column} chart",
+            min_value=start,
+            max_value=end,
+            value=(start, end),
+            format="YYYY-MM-DD"
+        )
+        window = readings.loc[zoom[0]:zoom[1]]
+        
+        anomalies = self.anomalies_for() if column == 'usage' else None
+        if anomalies is not None:
+            anomalies = anomalies[(anomalies['end'] >= zoom[0]) & (anomalies['start'] <= zoom[1])]
+        
+        # Wide windows are drawn from day, month or year buckets of the rollup pyramid, so
+        # downsampling never walks more than a few times the point budget
+        budget = self.chart_detail['budget']
+        method = self.chart_detail['method']
+        pyramid = self.dataset.rollup_pyramid()
+        level = pyramid.level_for(zoom[0], zoom[1], budget)
+        resolution = resolution_label(level, method)
+        fig = self.cached_figure(
+            f'{column}_readings',
+            lambda: readings_figure(
+                pyramid.points(level, column, zoom[0], zoom[1], method), column, self.year_label, budget, method,
+                anomalies, resolution
+            ),
+            zoom=zoom,
+            **self.chart_detail,
+            **self.anomaly_key(anomalies)
+        )
+        self.plotly_chart(f'{column}_readings', fig)
+        shown = f"{len(window):,} readings in view"
+        if resolution is not None:
+            shown += f", rolled up to {resolution}"
+        st.caption(f"{shown}; up to {budget:,} points plotted ({METHODS[method]})")
+
     def render_cost_view(self):
         st.markdown('<div class="card">', unsafe_allow_html=True)
         
-        # Create line chart for cost
-        fig = px.line(
-            self.df,
-            x='year',
-            y='cost',
-            title='Annual Water Cost (2011-2023)',
-            labels={'year': 'Year', 'cost': 'Cost ($)'},
-            markers=True
-        )
-        
-        # Customize layout
-        fig.update_layout(
-            hovermode="x unified",
-            hoverlabel=dict(bgcolor="white", font_size=12),
-            height=500,
-            margin=dict(l=60, r=60, t=80, b=60),
-            plot_bgcolor='rgba(245,250,255,0.5)'
-        )
+        # Scenario bills are monthly; a re-priced dataset's reading-level costs are only its
+        # monthly bills spread over the readings, so they aren't charted
+        if self.show_readings() and self.tariff is None:
+            self.render_readings_chart('cost')
+        else:
+            forecast = self.forecast_for('cost')
+            fig = self.cached_figure(
+                'cost', lambda: cost_figure(self.df, self.year_label, forecast), **self.forecast_key(forecast)
+            )
+            self.plotly_chart('cost', fig)
+        
+        if self.tariff is not None:
+            self.render_tariff_comparison()
+        
+        if len(self.df) < 2:
+            self.render_single_year_note()
+        else:
+            # Add insights for cost
+            insights = cost_insights(self.df, self.stats)
+            col1, col2 = st.columns(2)
+        
+            with col1:
+                st.markdown("""
+                #### Cost Insights:
+                - Highest cost in **{}** at ${}
+                - Lowest cost in **{}** at ${}
+                - Current annual cost represents **{:.1f}%** of the peak
+                """.format(
+                    self.stats['max_year_cost'], 
+                    self.format_number(int(self.stats['max_cost'])),
+                    self.stats['min_year_cost'],
+                    self.format_number(int(self.stats['min_cost'])),
+                    insights['current_vs_peak_pct']
+                ))
+        
+            with col2:
+                st.markdown("""
+                #### Notable Changes:
+                - Largest single-year cost increase: **{:.1f}%** in **{}**
+                - Total {}-year water expenditure: **${}**
+                - Current cost is **{:.1f}%** of {} baseline
+                """.format(
+                    insights['biggest_increase_pct'],
+                    insights['biggest_increase_year'],
+                    len(self.df),
+                    self.format_number(int(self.stats['total_cost'])),
+                    insights['current_vs_first_pct'],
+                    self.first_year
+                ))
         
-        fig.update_traces(
-            line=dict(color='#EF4444', width=3),
-            marker=dict(size=8, color='#EF4444'),
-            hovertemplate='Year: %{x}<br>Cost: $%{y:,.2f}<extra></extra>'
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    def render_tariff_comparison(self):
+        actual, _ = self.actual_dataset.select(self.selection[0], self.selection[1], self.years)
+        fig = self.cached_figure(
+            'tariff_comparison', lambda: tariff_comparison_figure(actual, self.df, self.year_label, self.tariff.name)
         )
-        
-        fig.update_xaxes(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(211,211,211,0.5)',
-            tickmode='linear'
+        self.plotly_chart('tariff_comparison', fig)
+        
+        actual_total = actual['cost'].sum()
+        scenario_total = self.df['cost'].sum()
+        change = (scenario_total - actual_total) / actual_total * 100 if actual_total else 0.0
+        st.caption(
+            f"{self.year_label}: {self.format_currency(actual_total)} actual vs "
+            f"{self.format_currency(scenario_total)} under {self.tariff.name} ({change:+.1f}%)"
         )
+
+    def render_cost_per_unit_view(self):
+        st.markdown('<div class="card">', unsafe_allow_html=True)
         
-        fig.update_yaxes(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(211,211,211,0.5)',
-            tickprefix="$",
-            tickformat=",.2f"
+        forecast = self.forecast_for('costPerUnit')
+        fig = self.cached_figure(
+            'cost_per_unit', lambda: cost_per_unit_figure(self.df, self.year_label, forecast),
+            **self.forecast_key(forecast)
         )
+        self.plotly_chart('cost_per_unit', fig)
         
-        st.plotly_chart(fig, use_container_width=True)
-        
-        # Add insights for cost
+        # Add insights for cost per unit; the growth rate needs at least two years
         col1, col2 = st.columns(2)
         
         with col1:
-            st.markdown("""
-            #### Cost Insights:
-            - Highest cost in **{}** at ${}
-            - Lowest cost in **{}** at ${}
-            - Current annual cost represents **{:.1f}%** of the peak
-            """.format(
-                self.stats['max_year_cost'], 
-                self.format_number(int(self.stats['max_cost'])),
-                self.stats['min_year_cost'],
-                self.format_number(int(self.stats['min_cost'])),
-                (self.df['cost'].iloc[-1] / self.stats['max_cost']) * 100
-            ))
+            if len(self.df) < 2:
+                self.render_single_year_note()
+            else:
+                insights = cost_per_unit_insights(self.df, thresholds=())
+                st.markdown("""
+                #### Cost per Unit Insights:
+                - Starting rate ({}): **${}**
+                - Current rate ({}): **${}**
+                - Total increase: **{:.1f}%** over {} years
+                - Compound annual growth rate: **{:.2f}%**
+                """.format(
+                    self.first_year,
+                    insights['first_rate'],
+                    self.last_year,
+                    insights['last_rate'],
+                    self.stats['cost_per_unit_increase'],
+                    len(self.df),
+                    insights['cagr']
+                ))
         
         with col2:
-            # Add year with biggest cost increase
-            biggest_increase_idx = self.df['cost_change'].idxmax()
-            biggest_increase_year = self.df.loc[biggest_increase_idx, 'year']
-            biggest_increase_pct = self.df.loc[biggest_increase_idx, 'cost_change']
+            # First year the cost per unit reached each of the levels set in the sidebar
+            milestones = self.milestones('costPerUnit', self.price_levels)
+            lines = ''.join(
+                f"\n            - Exceeded {self.format_rate(level)} per cubic foot: **{'N/A' if year is None else year}**"
+                for level, year in milestones.items()
+            )
+            
+            # The projection comes from the forecast shown on the chart, when there is one
+            if forecast is not None:
+                projected = forecast.iloc[-1]
+                # Escaped, since a second $ on the line would start a math span
+                lines += (
+                    f"\n            - {FORECAST_METHODS[self.forecast_options['method']]} projection for "
+                    f"{int(projected['year'])}: **\\${projected['forecast']:.4f}** per cubic foot "
+                    f"(\\${projected['lower']:.4f} to \\${projected['upper']:.4f})"
+                )
+            if not lines:
+                lines = "\n            - Set price levels or turn on forecasts in the sidebar to see them here"
             
             st.markdown("""
-            #### Notable Changes:
-            - Largest single-year cost increase: **{:.1f}%** in **{}**
-            - Total 13-year water expenditure: **${}**
-            - Current cost is **{:.1f}%** of 2011 baseline
-            """.format(
-                biggest_increase_pct,
-                int(biggest_increase_year),
-                self.format_number(int(self.stats['total_cost'])),
-                (self.df['cost'].iloc[-1] / self.df['cost'].iloc[0]) * 100
-            ))
+            #### Price Milestones:{}
+            """.format(lines))
+        
+        self.render_site_milestones(
+            "Price milestones", 'costPerUnit', self.price_levels, [self.format_rate(level) for level in self.price_levels]
+        )
         
         st.markdown('</div>', unsafe_allow_html=True)
 
-    def render_cost_per_unit_view(self):
+    def table_frame(self, rows):
+        # Rows shown in the table and offered for export, without copying them
+        if rows == 'readings':
+            return self.dataset.series_between(self.first_year, self.last_year)
+        return self.df[['year', 'usage', 'cost', 'costPerUnit']]
+
+    # A fragment, so sorting, filtering and paging rerun only the table
+    @st.fragment
+    def render_data_table(self):
         st.markdown('<div class="card">', unsafe_allow_html=True)
         
-        # Create line chart for cost per unit
-        fig = px.line(
-            self.df,
-            x='year',
-            y='costPerUnit',
-            title='Cost per Cubic Foot (2011-2023)',
-            labels={'year': 'Year', 'costPerUnit': 'Cost per Cubic Foot ($)'},
-            markers=True
-        )
-        
-        # Add a trendline
-        fig.add_trace(
-            go.Scatter(
-                x=self.df['year'],
-                y=np.polyval(np.polyfit(self.df['year'], self.df['costPerUnit'], 1), self.df['year']),
-                mode='lines',
-                line=dict(color='rgba(255, 99, 132, 0.3)', width=2, dash='dash'),
-                name='Trend',
-                hoverinfo='skip'
+        options = ['annual']
+        if self.dataset.series is not None and self.selection[0] == 'all':
+            options.append('readings')
+        # Meter readings are read from the source at their metered costs, so a tariff
+        # scenario leaves them out
+        if self.source.queryable and self.tariff is None:
+            options.append('meters')
+        rows = 'annual'
+        if len(options) > 1:
+            rows = st.radio(
+                "Rows",
+                options,
+                format_func={'annual': 'Annual totals', 'readings': 'Individual readings', 'meters': 'Meter readings'}.get,
+                horizontal=True,
+                key='table_rows'
             )
-        )
-        
-        # Customize layout
-        fig.update_layout(
-            hovermode="x unified",
-            hoverlabel=dict(bgcolor="white", font_size=12),
-            height=500,
-            margin=dict(l=60, r=60, t=80, b=60),
-            plot_bgcolor='rgba(245,250,255,0.5)'
-        )
-        
-        fig.update_traces(
-            selector=dict(name='costPerUnit'),
-            line=dict(color='#10B981', width=3),
-            marker=dict(size=8, color='#10B981'),
-            hovertemplate='Year: %{x}<br>Cost per Cubic Foot: $%{y:.4f}<extra></extra>'
-        )
+        if rows == 'meters':
+            self.render_meter_table()
+            st.markdown('</div>', unsafe_allow_html=True)
+            return
+        frame = self.table_frame(rows)
         
-        fig.update_xaxes(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(211,211,211,0.5)',
-            tickmode='linear'
+        labels = {
+            'timestamp': 'Timestamp',
+            'year': 'Year',
+            'usage': 'Water Usage (cubic feet)',
+            'cost': 'Water Cost',
+            'costPerUnit': 'Cost per Cubic Foot'
+        }
+        columns = ([frame.index.name] if frame.index.name else []) + list(frame.columns)
+        
+        # Sorting, filtering and paging run here on the server; only the visible page is sent
+        with st.expander("Sort, filter and page"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                sort_by = st.selectbox(
+                    "Sort by",
+                    [None] + columns,
+                    format_func=lambda column: 'Original order' if column is None else labels[column],
+                    key=f'table_sort_{rows}'
+                )
+                descending = st.checkbox("Descending", key='table_descending')
+            with col2:
+                filter_column = st.selectbox(
+                    "Filter on",
+                    list(frame.columns),
+                    format_func=labels.get,
+                    key=f'table_filter_{rows}'
+                )
+                page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1, key='table_page_size')
+            with col3:
+                low = st.number_input("Minimum", value=None, key=f'table_min_{rows}')
+                high = st.number_input("Maximum", value=None, key=f'table_max_{rows}')
+        
+        order_key = (
+            'table', self.dataset.version, self.selection, self.years, rows,
+            sort_by, descending, filter_column, low, high
         )
-        
-        fig.update_yaxes(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(211,211,211,0.5)',
-            tickprefix="$",
-            tickformat=".4f"
+        positions = ROW_ORDERS.get_or_build(
+            order_key,
+            lambda: ordered_positions(frame, sort_by, descending, filter_column, low, high)
         )
         
-        st.plotly_chart(fig, use_container_width=True)
+        page_count = max(1, -(-len(positions) // page_size))
+        page_key = f'table_page_{rows}'
+        if st.session_state.get(page_key, 1) > page_count:
+            st.session_state[page_key] = 1
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1, key=page_key)
         
-        # Add insights for cost per unit
-        col1, col2 = st.columns(2)
+        page_df = page_of(frame, positions, page, page_size)
+        if rows == 'readings':
+            page_df = page_df.reset_index()
+        first_row = (page - 1) * page_size
+        st.caption(f"Rows {min(first_row + 1, len(positions)):,}–{first_row + len(page_df):,} of {len(positions):,}")
         
-        with col1:
-            # Calculate annual growth rate (CAGR)
-            years = len(self.df) - 1
-            starting_cost = self.df['costPerUnit'].iloc[0]
-            ending_cost = self.df['costPerUnit'].iloc[-1]
-            cagr = ((ending_cost / starting_cost) ** (1 / years) - 1) * 100
-            
-            st.markdown("""
-            #### Cost per Unit Insights:
-            - Starting rate (2011): **${}**
-            - Current rate (2023): **${}**
-            - Total increase: **{:.1f}%** over 13 years
-            - Compound annual growth rate: **{:.2f}%**
-            """.format(
-                self.df['costPerUnit'].iloc[0],
-                self.df['costPerUnit'].iloc[-1],
-                self.stats['cost_per_unit_increase'],
-                cagr
-            ))
+        # Number formats are applied by the table itself instead of building strings per row
+        st.dataframe(
+            page_df.rename(columns=labels),
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                labels['timestamp']: st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm"),
+                labels['year']: st.column_config.NumberColumn(format="%d"),
+                labels['usage']: st.column_config.NumberColumn(format="%,d"),
+                labels['cost']: st.column_config.NumberColumn(format="dollar"),
+                labels['costPerUnit']: st.column_config.NumberColumn(format="$%.4f")
+            }
+        )
         
-        with col2:
-            # Find when cost per unit exceeded certain thresholds
-            threshold_10cents = self.df[self.df['costPerUnit'] >= 0.10].iloc[0]['year'] if not self.df[self.df['costPerUnit'] >= 0.10].empty else 'N/A'
-            threshold_12cents = self.df[self.df['costPerUnit'] >= 0.12].iloc[0]['year'] if not self.df[self.df['costPerUnit'] >= 0.12].empty else 'N/A'
-            threshold_15cents = self.df[self.df['costPerUnit'] >= 0.15].iloc[0]['year'] if not self.df[self.df['costPerUnit'] >= 0.15].empty else 'N/A'
-            
-            st.markdown("""
-            #### Price Milestones:
-            - Exceeded $0.10 per cubic foot: **{}**
-            - Exceeded $0.12 per cubic foot: **{}**
-            - Exceeded $0.15 per cubic foot: **{}**
-            - If trend continues, projected to reach $0.20 by 2030
-            """.format(
-                threshold_10cents,
-                threshold_12cents,
-                threshold_15cents
-            ))
+        self.render_export_controls(rows)
         
         st.markdown('</div>', unsafe_allow_html=True)
 
-    def render_data_table(self):
-        st.markdown('<div class="card">', unsafe_allow_html=True)
+    def render_meter_table(self):
+        # Every meter's readings in the selection, filtered, sorted and paged by the SQL
+        # backend; only the rows on the page are loaded
+        columns = self.source.table_columns()
+        labels = {
+            'timestamp': 'Timestamp',
+            'year': 'Year',
+            'site': 'Site',
+            'usage': 'Water Usage (cubic feet)',
+            'cost': 'Water Cost'
+        }
         
-        # Format the dataframe for display
-        display_df = self.df.copy()
-        display_df['usage'] = display_df['usage'].apply(lambda x: f"{int(x):,}")
-        display_df['cost'] = display_df['cost'].apply(lambda x: f"${x:,.2f}")
-        display_df['costPerUnit'] = display_df['costPerUnit'].apply(lambda x: f"${x:.4f}")
+        with st.expander("Sort, filter and page"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                sort_by = st.selectbox(
+                    "Sort by",
+                    [None] + columns,
+                    format_func=lambda column: 'Original order' if column is None else labels[column],
+                    key='table_sort_meters'
+                )
+                descending = st.checkbox("Descending", key='table_descending')
+            with col2:
+                filter_column = st.selectbox(
+                    "Filter on",
+                    [column for column in columns if column in ('year', 'usage', 'cost')],
+                    format_func=labels.get,
+                    key='table_filter_meters'
+                )
+                page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1, key='table_page_size')
+            with col3:
+                low = st.number_input("Minimum", value=None, key='table_min_meters')
+                high = st.number_input("Maximum", value=None, key='table_max_meters')
+        
+        level, key = self.selection
+        sites = [key] if level == 'site' else self.group_sites(key) if level == 'site_group' else None
+        query = {
+            'sites': sites,
+            'years': self.years,
+            'filter_column': filter_column,
+            'low': low,
+            'high': high
+        }
+        with span('table_query'):
+            count = self.source.count_readings(**query)
         
-        # Drop the change columns for the main table
-        if 'usage_change' in display_df.columns:
-            display_df = display_df.drop(['usage_change', 'cost_change'], axis=1)
+        page_count = max(1, -(-count // page_size))
+        if st.session_state.get('table_page_meters', 1) > page_count:
+            st.session_state['table_page_meters'] = 1
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1, key='table_page_meters')
         
-        # Rename columns
-        display_df = display_df.rename(columns={
-            'year': 'Year',
-            'usage': 'Water Usage (cubic feet)',
-            'cost': 'Water Cost',
-            'costPerUnit': 'Cost per Cubic Foot'
-        })
+        first_row = (page - 1) * page_size
+        with span('table_query'):
+            page_df = self.source.readings_page(first_row, page_size, sort_by=sort_by, descending=descending, **query)
+        st.caption(f"Rows {min(first_row + 1, count):,}–{first_row + len(page_df):,} of {count:,}")
         
-        # Show data table with formatting
         st.dataframe(
-            display_df,
+            page_df.rename(columns=labels),
             hide_index=True,
-            use_container_width=True
+            use_container_width=True,
+            column_config={
+                labels['timestamp']: st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm"),
+                labels['year']: st.column_config.NumberColumn(format="%d"),
+                labels['usage']: st.column_config.NumberColumn(format="%,.2f"),
+                labels['cost']: st.column_config.NumberColumn(format="dollar")
+            }
         )
+
+    def export_frame(self, rows):
+        # Rows behind the download button; only called when a download is requested
+        if rows == 'readings':
+            return self.table_frame(rows).reset_index()
+        return self.df
+
+    def render_export_controls(self, rows):
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            export_format = st.selectbox(
+                "Export format",
+                list(EXPORT_FORMATS),
+                format_func=lambda name: EXPORT_FORMATS[name]['label'],
+                key='export_format'
+            )
+        with col2:
+            compress = st.checkbox("Gzip compress", key='export_gzip')
         
-        # Add download button
-        csv = self.df.to_csv(index=False).encode('utf-8')
+        # The file is written in chunks only when the button is clicked, then cached for
+        # everyone viewing the same data version, selection and format
+        key = ('export', self.dataset.version, self.selection, self.years, rows, export_format, compress)
+        label = EXPORT_FORMATS[export_format]['label']
         st.download_button(
-            label="📥 Download Data as CSV",
-            data=csv,
-            file_name="water_usage_data.csv",
-            mime="text/csv",
-            help="Download the complete dataset as a CSV file"
+            label=f"📥 Download Data as {label}",
+            data=lambda: EXPORTS.get_or_build(
+                key, lambda: build_export(self.export_frame(rows), export_format, compress)
+            ),
+            file_name=export_file_name("water_usage_data", export_format, compress),
+            mime=export_mime(export_format, compress),
+            help=f"Download the selected data as a {label} file",
+            on_click='ignore'
         )
-        
-        st.markdown('</div>', unsafe_allow_html=True)
 
     def render_detailed_analysis(self):
         st.markdown('<div class="card">', unsafe_allow_html=True)
         
-        col1, col2 = st.columns(2)
+        if len(self.df) < 2:
+            self.render_single_year_note()
+        else:
+            # Usage/cost correlation and the cost per unit before and after the split year
+            periods = period_analysis(self.df, period_split_year(self.first_year, self.last_year))
+            col1, col2 = st.columns(2)
         
-        with col1:
-            # Calculate correlation between usage and cost
-            correlation = self.df['usage'].corr(self.df['cost'])
+            with col1:
+                st.markdown("""
+                #### Cost Analysis
             
-            # Calculate average cost per unit over time periods
-            early_years = self.df[self.df['year'] <= 2015]['costPerUnit'].mean()
-            recent_years = self.df[self.df['year'] > 2015]['costPerUnit'].mean()
-            percent_increase = ((recent_years / early_years) - 1) * 100
+                - Correlation between usage and cost: **{:.2f}**
+                - Average cost per unit ({}-{}): **${:.4f}**
+                - Average cost per unit ({}-{}): **${:.4f}**
+                - Price increase between periods: **{:.1f}%**
             
-            st.markdown("""
-            #### Cost Analysis
+                The data shows a strong correlation between water usage and cost, indicating that billing is primarily usage-based. However, the increasing cost per cubic foot demonstrates that water has become more expensive over time, even when controlling for usage.
+                """.format(
+                    periods['correlation'],
+                    self.first_year,
+                    periods['split_year'],
+                    periods['early_cost_per_unit'],
+                    periods['split_year'] + 1,
+                    self.last_year,
+                    periods['recent_cost_per_unit'],
+                    periods['cost_per_unit_change']
+                ))
+        
+            with col2:
+                st.markdown("""
+                #### Usage Analysis
             
-            - Correlation between usage and cost: **{:.2f}**
-            - Average cost per unit (2011-2015): **${:.4f}**
-            - Average cost per unit (2016-2023): **${:.4f}**
-            - Price increase between periods: **{:.1f}%**
+                - Total water usage over {} years: **{:,} cubic feet**
+                - Average annual usage: **{:,} cubic feet**
+                - Usage change from {} to {}: **{:.1f}%**
             
-            The data shows a strong correlation between water usage and cost, indicating that billing is primarily usage-based. However, the increasing cost per cubic foot demonstrates that water has become more expensive over time, even when controlling for usage.
-            """.format(
-                correlation,
-                early_years,
-                recent_years,
-                percent_increase
-            ))
+                The data suggests periods of both high and low water usage. The significant drop in 2019 could indicate a conservation effort, operational changes, or other factors affecting water consumption. Understanding these patterns can help identify opportunities for future water conservation and cost savings.
+                """.format(
+                    len(self.df),
+                    int(self.stats['total_usage']),
+                    int(self.stats['avg_usage']),
+                    self.first_year,
+                    self.last_year,
+                    periods['usage_change']
+                ))
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # A fragment, so picking another meter reruns only this section
+    @st.fragment
+    def render_meter_similarity(self):
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        
+        profiles, correlations, clustering = self.similarity_for()
+        labels, _, shapes = clustering
+        st.caption(
+            f"Correlation of {profiles.label} across {len(profiles.sites):,} meters and "
+            f"{len(profiles.starts):,} periods."
+        )
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.markdown("#### Most Similar Meters")
+            site = st.selectbox("Meter", profiles.sites, key='similarity_meter')
+            similar = similar_meters(profiles, correlations, site, self.similarity_options['top'])
+            if len(similar):
+                similar['cluster'] = labels[profiles.sites.get_indexer(similar['site'])] + 1
+                st.dataframe(
+                    similar,
+                    hide_index=True,
+                    use_container_width=True,
+                    column_config={
+                        'site': 'Site',
+                        'correlation': st.column_config.NumberColumn('Correlation', format='%.3f'),
+                        'cluster': 'Cluster'
+                    }
+                )
+            else:
+                st.info("This meter's usage never changes, so it has no correlation with other meters.")
         
         with col2:
-            # Find efficiency improvements
-            earliest_year_data = self.df.iloc[0]
-            latest_year_data = self.df.iloc[-1]
-            usage_change = ((latest_year_data['usage'] / earliest_year_data['usage']) - 1) * 100
-            
-            st.markdown("""
-            #### Usage Analysis
-            
-            - Total water usage over 13 years: **{:,} cubic feet**
-            - Average annual usage: **{:,} cubic feet**
-            - Usage change from 2011 to 2023: **{:.1f}%**
-            
-            The data suggests periods of both high and low water usage. The significant drop in 2019 could indicate a conservation effort, operational changes, or other factors affecting water consumption. Understanding these patterns can help identify opportunities for future water conservation and cost savings.
-            """.format(
-                int(self.stats['total_usage']),
-                int(self.stats['avg_usage']),
-                usage_change
-            ))
+            st.markdown("#### Meter Clusters")
+            summary = cluster_summary(profiles, clustering)
+            st.dataframe(
+                summary,
+                hide_index=True,
+                use_container_width=True,
+                column_config={
+                    'cluster': 'Cluster',
+                    'meters': st.column_config.NumberColumn('Meters', format='%d'),
+                    'typical_meter': 'Most typical meter',
+                    'mean_correlation': st.column_config.NumberColumn(
+                        'Fit', format='%.3f',
+                        help="Average correlation of the members' usage with the cluster's typical pattern"
+                    )
+                }
+            )
+        
+        fig = self.cached_figure(
+            'cluster_shapes',
+            lambda: cluster_shapes_figure(profiles.starts, shapes, summary['meters'], profiles.label),
+            clusters=self.similarity_options['clusters']
+        )
+        self.plotly_chart('cluster_shapes', fig)
+        
+        try:
+            covariates = self.covariates_for(profiles)
+        except (OSError, ValueError) as error:
+            st.error(f"Couldn't read the covariates: {error}")
+            covariates = None
+        if covariates is not None:
+            meters, portfolio = covariates
+            st.markdown("#### Covariates")
+            st.markdown("  \n".join(
+                f"- Portfolio usage vs {name}: **{value:.2f}**" for name, value in portfolio.items()
+                if pd.notna(value)
+            ) or "No covariate overlaps the readings' periods.")
+            with st.expander("Correlation with covariates by meter"):
+                st.dataframe(meters, use_container_width=True)
         
         st.markdown('</div>', unsafe_allow_html=True)
 
     def render_year_over_year(self):
         st.markdown('<div class="card">', unsafe_allow_html=True)
         
-        # Create a year-over-year change chart
-        # Filter out the first year since it has no previous year for comparison
-        yoy_df = self.df.dropna().copy()
-        
-        # Create the figure
-        fig = go.Figure()
-        
-        # Add usage change bars
-        fig.add_trace(go.Bar(
-            x=yoy_df['year'],
-            y=yoy_df['usage_change'],
-            name='Usage Change (%)',
-            marker_color='#AB2330',
-            hovertemplate='Year: %{x}<br>Usage Change: %{y:.1f}%<extra></extra>'
-        ))
-        
-        # Add cost change bars
-        fig.add_trace(go.Bar(
-            x=yoy_df['year'],
-            y=yoy_df['cost_change'],
-            name='Cost Change (%)',
-            marker_color='#AB2330',
-            hovertemplate='Year: %{x}<br>Cost Change: %{y:.1f}%<extra></extra>'
-        ))
-        
-        # Add zero line
-        fig.add_shape(
-            type="line",
-            x0=yoy_df['year'].min() - 0.5,
-            x1=yoy_df['year'].max() + 0.5,
-            y0=0,
-            y1=0,
-            line=dict(color="gray", width=1, dash="dash"),
-        )
-        
-        # Update layout
-        fig.update_layout(
-            title='Year-over-Year Percentage Changes',
-            xaxis_title='Year',
-            yaxis_title='Change (%)',
-            barmode='group',
-            hovermode="x unified",
-            hoverlabel=dict(bgcolor="white", font_size=12),
-            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-            height=400,
-            margin=dict(l=60, r=60, t=80, b=60),
-            plot_bgcolor='rgba(245,250,255,0.5)'
-        )
-        
-        fig.update_xaxes(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(211,211,211,0.5)',
-            tickmode='linear'
-        )
-        
-        fig.update_yaxes(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(211,211,211,0.5)',
-            ticksuffix="%"
-        )
-        
-        st.plotly_chart(fig, use_container_width=True)
+        if len(self.df) < 2:
+            self.render_single_year_note()
+        else:
+            fig = self.cached_figure('year_over_year', lambda: year_over_year_figure(self.df))
+            self.plotly_chart('year_over_year', fig)
     
-        # Find notable year-over-year changes
-        biggest_usage_drop = self.df.loc[self.df['usage_change'].idxmin()]
-        biggest_usage_increase = self.df
-# Find notable year-over-year changes
-        biggest_usage_drop = self.df.loc[self.df['usage_change'].idxmin()]
-        biggest_usage_increase = self.df.loc[self.df['usage_change'].idxmax()]
-        biggest_cost_increase = self.df.loc[self.df['cost_change'].idxmax()]
-        
-        # Add analysis text
-        col1, col2 = st.columns(2)
+            # Find notable year-over-year changes
+            changes = year_over_year_analysis(self.df)
         
-        with col1:
-            st.markdown("""
-            #### Notable Annual Changes
-            
-            - Largest usage decrease: **{:.1f}%** in **{}**
-            - Largest usage increase: **{:.1f}%** in **{}**
-            - Largest cost increase: **{:.1f}%** in **{}**
-            """.format(
-                biggest_usage_drop['usage_change'],
-                int(biggest_usage_drop['year']),
-                biggest_usage_increase['usage_change'],
-                int(biggest_usage_increase['year']),
-                biggest_cost_increase['cost_change'],
-                int(biggest_cost_increase['year'])
-            ))
+            # Add analysis text
+            col1, col2 = st.columns(2)
         
-        with col2:
-            # Calculate volatility (standard deviation of changes)
-            usage_volatility = self.df['usage_change'].std()
-            cost_volatility = self.df['cost_change'].std()
+            with col1:
+                st.markdown("""
+                #### Notable Annual Changes
             
-            st.markdown("""
-            #### Volatility Analysis
+                - Largest usage decrease: **{:.1f}%** in **{}**
+                - Largest usage increase: **{:.1f}%** in **{}**
+                - Largest cost increase: **{:.1f}%** in **{}**
+                """.format(
+                    changes['biggest_usage_drop_pct'],
+                    changes['biggest_usage_drop_year'],
+                    changes['biggest_usage_increase_pct'],
+                    changes['biggest_usage_increase_year'],
+                    changes['biggest_cost_increase_pct'],
+                    changes['biggest_cost_increase_year']
+                ))
+        
+            with col2:
+                st.markdown("""
+                #### Volatility Analysis
             
-            - Usage change volatility: **{:.1f}%** standard deviation
-            - Cost change volatility: **{:.1f}%** standard deviation
-            - Years with opposite trends: **{}** (usage and cost moved in different directions)
-            """.format(
-                usage_volatility,
-                cost_volatility,
-                len(self.df[(self.df['usage_change'] > 0) & (self.df['cost_change'] < 0) | 
-                            (self.df['usage_change'] < 0) & (self.df['cost_change'] > 0)].dropna())
-            ))
+                - Usage change volatility: **{:.1f}%** standard deviation
+                - Cost change volatility: **{:.1f}%** standard deviation
+                - Years with opposite trends: **{}** (usage and cost moved in different directions)
+                """.format(
+                    changes['usage_volatility'],
+                    changes['cost_volatility'],
+                    changes['opposite_trend_years']
+                ))
         
         st.markdown('</div>', unsafe_allow_html=True)
 
+    def render_site_selector(self):
+        st.sidebar.markdown("### Sites")
+        
+        level_labels = {'all': ALL_SITES, 'site_group': 'Site group', 'site': 'Single site'}
+        level = st.sidebar.radio("Show", LEVELS, format_func=level_labels.get, key='site_level')
+        
+        key = None
+        if level != 'all':
+            key = st.sidebar.selectbox(
+                level_labels[level],
+                self.dataset.rollups.options(level),
+                key=f'site_key_{level}'
+            )
+        
+        self.select_view(level, key)
+        st.sidebar.markdown("---")
+    
+    def render_chart_detail_options(self):
+        st.sidebar.markdown("### Chart Detail")
+        
+        resolution = st.sidebar.radio(
+            "Usage and cost charts",
+            ['annual', 'readings'],
+            format_func={'annual': 'Annual totals', 'readings': 'Individual readings'}.get,
+            key='chart_resolution'
+        )
+        method = st.sidebar.selectbox(
+            "Downsampling",
+            list(METHODS),
+            format_func=METHODS.get,
+            key='downsample_method',
+            help="LTTB keeps the visual shape of the series; min/max buckets keep every peak and trough."
+        )
+        budget = st.sidebar.select_slider(
+            "Points per chart",
+            options=[500, 1000, 2000, 5000, 10000],
+            value=DEFAULT_POINT_BUDGET,
+            key='point_budget'
+        )
+        
+        if resolution == 'readings' and self.selection[0] != 'all':
+            st.sidebar.info("💡 Reading-level charts cover all sites; site and group views show annual totals.")
+        
+        self.chart_detail = {'resolution': resolution, 'method': method, 'budget': budget}
+        st.sidebar.markdown("---")
+    
+    def render_anomaly_options(self):
+        st.sidebar.markdown("### Anomalies")
+        
+        show = st.sidebar.checkbox(
+            "Flag leaks and spikes",
+            value=False,
+            key='anomalies_show',
+            help="Scans every meter's readings for sustained night flow (possible leaks) and sudden spikes."
+        )
+        spike_threshold = st.sidebar.select_slider(
+            "Spike sensitivity (robust z-score)",
+            options=[4.0, 6.0, 8.0, 10.0, 15.0],
+            value=SPIKE_THRESHOLD,
+            key='spike_threshold',
+            disabled=not show
+        )
+        leak_nights = st.sidebar.slider(
+            "Nights of sustained flow for a leak",
+            min_value=2,
+            max_value=14,
+            value=LEAK_NIGHTS,
+            key='leak_nights',
+            disabled=not show
+        )
+        
+        self.anomaly_options = {'show': show, 'spike_threshold': spike_threshold, 'leak_nights': leak_nights}
+        st.sidebar.markdown("---")
+    
+    def render_live_options(self):
+        st.sidebar.markdown("### Live Mode")
+        
+        show = st.sidebar.checkbox(
+            "Follow new readings",
+            value=False,
+            key='live_show',
+            help="Refreshes a panel of the latest readings on a timer, adding only the readings that "
+                 "arrived since the last refresh. The other views update on the next full rerun."
+        )
+        refresh = st.sidebar.select_slider(
+            "Refresh every (seconds)",
+            options=REFRESH_INTERVALS,
+            value=DEFAULT_REFRESH,
+            key='live_refresh',
+            disabled=not show
+        )
+        points = st.sidebar.select_slider(
+            "Readings kept on the live chart",
+            options=LIVE_WINDOWS,
+            value=DEFAULT_LIVE_POINTS,
+            key='live_points',
+            disabled=not show
+        )
+        
+        self.live_options = {'show': show, 'refresh': refresh, 'points': points}
+        st.sidebar.markdown("---")
+    
+    def render_milestone_options(self):
+        st.sidebar.markdown("### Milestones")
+        
+        price_text = st.sidebar.text_input(
+            "Cost per unit levels ($)",
+            value=', '.join(f"{level:.2f}" for level in PRICE_THRESHOLDS),
+            key='price_levels',
+            help="Separated by commas or spaces. The Cost per Unit tab shows the first year each was reached."
+        )
+        usage_text = st.sidebar.text_input(
+            "Usage levels (cubic feet)",
+            value='',
+            key='usage_levels',
+            placeholder="e.g. 1500000 1200000",
+            help="Separated by commas or spaces. The Water Usage tab shows the first year usage fell to each."
+        )
+        
+        try:
+            self.price_levels = parse_levels(price_text)
+        except ValueError as error:
+            st.sidebar.error(f"Cost per unit levels: {error}")
+            self.price_levels = PRICE_THRESHOLDS
+        try:
+            self.usage_levels = parse_levels(usage_text)
+        except ValueError as error:
+            st.sidebar.error(f"Usage levels: {error}")
+            self.usage_levels = []
+        
+        st.sidebar.markdown("---")
+    
+    def render_forecast_options(self):
+        st.sidebar.markdown("### Forecast")
+        
+        show = st.sidebar.checkbox("Show forecast", value=False, key='forecast_show')
+        method = st.sidebar.selectbox(
+            "Model",
+            list(FORECAST_METHODS),
+            format_func=FORECAST_METHODS.get,
+            key='forecast_method',
+            disabled=not show,
+            help="Seasonal smoothing uses monthly totals, so it applies to the whole portfolio of "
+                 "timestamped readings; other views use the damped trend."
+        )
+        horizon = st.sidebar.slider(
+            "Years ahead", min_value=1, max_value=10, value=DEFAULT_HORIZON, key='forecast_horizon', disabled=not show
+        )
+        
+        if show and self.years is not None and self.years[1] < self.dataset.df['year'].iloc[-1]:
+            st.sidebar.info("💡 Forecasts start after the latest year; extend the range to see them.")
+        
+        self.forecast_options = {'show': show, 'method': method, 'horizon': horizon}
+        st.sidebar.markdown("---")
+    
+    def render_similarity_options(self):
+        st.sidebar.markdown("### Meter Similarity")
+        
+        show = st.sidebar.checkbox(
+            "Compare meters",
+            value=False,
+            key='similarity_show',
+            help="Correlates every meter's usage with every other meter's and groups meters with "
+                 "similar consumption patterns."
+        )
+        clusters = st.sidebar.select_slider(
+            "Clusters",
+            options=CLUSTER_COUNTS,
+            value=DEFAULT_CLUSTERS,
+            key='similarity_clusters',
+            disabled=not show
+        )
+        top = st.sidebar.slider(
+            "Similar meters listed",
+            min_value=5,
+            max_value=SIMILAR_METERS,
+            value=10,
+            key='similarity_top',
+            disabled=not show
+        )
+        
+        self.similarity_options = {'show': show, 'clusters': clusters, 'top': top}
+        st.sidebar.markdown("---")
+    
+    def render_tariff_options(self):
+        st.sidebar.markdown("### Tariff Scenario")
+        
+        show = st.sidebar.checkbox(
+            "Re-price with a different tariff",
+            value=False,
+            key='tariff_show',
+            help="Bills every meter's monthly usage under the rate structure below; every cost view, "
+                 "forecast and milestone then uses those bills."
+        )
+        preset = st.sidebar.selectbox(
+            "Rate structure",
+            list(TARIFF_PRESETS),
+            format_func=lambda name: TARIFF_PRESETS[name].name,
+            key='tariff_preset',
+            disabled=not show
+        )
+        base = TARIFF_PRESETS[preset]
+        
+        # Edits are kept per preset, so switching presets and back doesn't lose them
+        with st.sidebar.expander("Edit rates"):
+            fixed_charge = st.number_input(
+                "Fixed charge per monthly bill ($)",
+                min_value=0.0,
+                value=base.fixed_charge,
+                step=5.0,
+                key=f'tariff_fixed_{preset}',
+                disabled=not show
+            )
+            blocks = st.data_editor(
+                pd.DataFrame(base.blocks(), columns=['limit', 'rate']),
+                num_rows='dynamic',
+                hide_index=True,
+                key=f'tariff_blocks_{preset}',
+                disabled=not show,
+                column_config={
+                    'limit': st.column_config.NumberColumn('Up to (cubic feet / month)', min_value=0, format='%d'),
+                    'rate': st.column_config.NumberColumn('Rate ($ / cubic foot)', min_value=0.0, format='%.4f')
+                }
+            )
+            st.caption("Blocks apply in order; the last one has no upper limit.")
+            season_months = st.multiselect(
+                "Peak-season months",
+                list(range(1, 13)),
+                default=list(base.season_months),
+                format_func=lambda month: calendar.month_abbr[month],
+                key=f'tariff_season_months_{preset}',
+                disabled=not show
+            )
+            season_factor = st.number_input(
+                "Peak-season multiplier",
+                min_value=0.1,
+                value=base.season_factor,
+                step=0.05,
+                key=f'tariff_season_factor_{preset}',
+                disabled=not show
+            )
+        
+        if show:
+            blocks = blocks.dropna(subset=['rate'])
+            try:
+                tariff = Tariff(
+                    base.name,
+                    [(None if pd.isna(limit) else limit, rate) for limit, rate in zip(blocks['limit'], blocks['rate'])],
+                    fixed_charge,
+                    season_months,
+                    season_factor
+                )
+            except ValueError as error:
+                st.sidebar.error(f"Tariff: {error}")
+            else:
+                if tariff.key() != base.key():
+                    tariff.name = f"{base.name} (edited)"
+                self.apply_tariff(tariff)
+        
+        st.sidebar.markdown("---")
+    
     def render_sidebar(self):
         st.sidebar.title("Dashboard Controls")
         
+        if self.dataset.rollups is not None:
+            self.render_site_selector()
+        
         st.sidebar.markdown("### Data Range")
         
-        # Year range slider
-        min_year = int(self.df['year'].min())
-        max_year = int(self.df['year'].max())
-        selected_years = st.sidebar.slider(
-            "Select Years",
-            min_value=min_year,
-            max_value=max_year,
-            value=(min_year, max_year)
-        )
+        # Year range slider; every view and KPI below uses the selected range
+        min_year = self.first_year
+        max_year = self.last_year
+        if min_year < max_year:
+            selected_years = st.sidebar.slider(
+                "Select Years",
+                min_value=min_year,
+                max_value=max_year,
+                value=(min_year, max_year)
+            )
+        else:
+            selected_years = (min_year, max_year)
+        
+        # Year-over-year views need at least two years to compare
+        if selected_years[0] == selected_years[1] and min_year < max_year:
+            st.sidebar.warning("Select at least two years; showing the full range.")
+            selected_years = (min_year, max_year)
+        
+        if selected_years != (min_year, max_year):
+            self.select_view(self.selection[0], self.selection[1], selected_years)
         
-        # This would filter the data if implemented fully
         st.sidebar.markdown(f"Selected range: {selected_years[0]} - {selected_years[1]}")
         st.sidebar.markdown("---")
         
+        self.chart_detail = {'resolution': 'annual', 'method': 'lttb', 'budget': DEFAULT_POINT_BUDGET}
+        self.anomaly_options = {'show': False}
+        self.live_options = {'show': False}
+        if self.dataset.series is not None:
+            self.render_chart_detail_options()
+            self.render_anomaly_options()
+            self.render_live_options()
+        
+        self.render_forecast_options()
+        self.render_milestone_options()
+        self.render_tariff_options()
+        
+        self.similarity_options = {'show': False}
+        if self.actual_dataset.rollups is not None:
+            self.render_similarity_options()
+        
         # Add some analysis options
         st.sidebar.markdown("### Analysis Options")
         
@@ -778,7 +1413,7 @@ class WaterUsageDashboard:
         # Add context information
         st.sidebar.markdown("### About This Dashboard")
         st.sidebar.markdown("""
-        This dashboard visualizes water usage and cost data from 2011 to 2023. It provides insights into:
+        This dashboard visualizes water usage and cost data from {} to {}. It provides insights into:
         
         - Water consumption trends
         - Cost analysis
@@ -786,13 +1421,82 @@ class WaterUsageDashboard:
         - Year-over-year comparisons
         
         Use the tabs above to explore different aspects of the data.
-        """)
+        """.format(min_year, max_year))
         
         st.sidebar.markdown("---")
+        # Filled in after the views render, so the figure cache counts include this rerun
+        self.cache_metrics_slot = st.sidebar.empty()
+        # Developer timing panel, also filled in last so it includes this rerun's spans
+        self.dev_panel_slot = st.sidebar.container() if self.dev_mode() else None
         st.sidebar.markdown("📊 **Water Usage Dashboard** | v1.0")
+    
+    def render_cache_metrics(self):
+        dataset_info = STORE.info()
+        figure_info = FIGURES.info()
+        self.cache_metrics_slot.caption(
+            f"Dataset v{self.actual_dataset.version} • cache hits: {dataset_info['hits']} • misses: {dataset_info['misses']}  \n"
+            f"Figure cache: {figure_info['entries']} figures • "
+            f"{figure_info['bytes'] / 1024:,.0f} KB of {figure_info['max_bytes'] / 1024 / 1024:,.0f} MB • "
+            f"hits: {figure_info['hits']} • misses: {figure_info['misses']}"
+            + self.ingestion_status()
+        )
+    
+    def ingestion_status(self):
+        if self.ingestion is None:
+            return ""
+        status = self.ingestion.status()
+        last_poll = time.strftime('%H:%M:%S', time.localtime(status['last_poll'])) if status['last_poll'] else "pending"
+        line = (
+            f"  \nLive feed: {status['readings']:,} readings ingested • last poll {last_poll} • "
+            f"retries: {status['retries']} • failed polls: {status['errors']}"
+        )
+        if status['last_error']:
+            line += f"  \nLast feed error: {status['last_error']}"
+        return line
+        
+
+    def request_profile(self):
+        st.session_state['profile_next_rerun'] = True
+    
+    def render_dev_panel(self, rerun):
+        if self.dev_panel_slot is None:
+            return
+        if rerun['profile'] is not None:
+            st.session_state['last_profile'] = rerun['profile']
+        
+        with self.dev_panel_slot.expander("🛠️ Developer: timings"):
+            summary = TIMINGS.summary()
+            st.caption(f"Rerun {rerun['id']} • last {TIMINGS.window} samples per span")
+            st.dataframe(
+                summary,
+                hide_index=True,
+                column_config={
+                    column: st.column_config.NumberColumn(format="%.1f")
+                    for column in ['last_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+                }
+            )
+            
+            name = st.selectbox("Latency histogram", [row['span'] for row in summary], key='dev_span')
+            if name is not None:
+                st.bar_chart(TIMINGS.histogram_frame(name), x_label="ms", y_label="samples")
+            
+            st.download_button(
+                label="📥 Download span log (JSON Lines)",
+                data=TIMINGS.export_jsonl,
+                file_name="timings.jsonl",
+                mime="application/x-ndjson",
+                on_click='ignore'
+            )
+            
+            # cProfile only runs when asked for, on the rerun the button click triggers
+            st.button("Profile next rerun", on_click=self.request_profile, key='dev_profile')
+            if 'last_profile' in st.session_state:
+                st.code(st.session_state['last_profile'], language=None)
         
 
 # Run the dashboard
 if __name__ == "__main__":
-    dashboard = WaterUsageDashboard()
-    dashboard.render_dashboard()
+    with rerun_timing(profile=st.session_state.pop('profile_next_rerun', False)) as rerun:
+        dashboard = WaterUsageDashboard()
+        dashboard.render_dashboard()
+    dashboard.render_dev_panel(rerun)
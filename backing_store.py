@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+
+# Directory where aggregated frames are kept as uncompressed Arrow IPC files. Every
+# dashboard process serving the same data maps the same files, so the operating system
+# shares their pages between processes instead of each one holding its own copy.
+BACKING_DIR_ENV = 'WATER_USAGE_CACHE_DIR'
+
+# Frames a data source loads into, in the order DataSource keeps them
+BACKING_PARTS = ['yearly', 'site_yearly', 'series']
+
+
+def backing_dir():
+    return os.environ.get(BACKING_DIR_ENV) or None
+
+
+def _digest(value):
+    return hashlib.sha1(repr(value).encode()).hexdigest()[:16]
+
+
+def _paths(key, directory):
+    # Files are named after the source (path) and the version (mtime and size) they hold
+    prefix = f"{_digest(key[:2])}-{_digest(key)}"
+    manifest = os.path.join(directory, f"{prefix}.json")
+    parts = {part: os.path.join(directory, f"{prefix}-{part}.arrow") for part in BACKING_PARTS}
+    return manifest, parts
+
+
+def _map_frame(path):
+    # Numeric columns come back as zero-copy, read-only views of the mapped file
+    import pyarrow as pa
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def map_frames(key, directory):
+    # The frames stored for this source version, or None if they haven't been written
+    manifest, parts = _paths(key, directory)
+    try:
+        with open(manifest) as f:
+            stored = json.load(f)['parts']
+        return tuple(_map_frame(parts[part]) if part in stored else None for part in BACKING_PARTS)
+    except (OSError, ValueError):
+        return None
+
+
+def write_frames(key, directory, frames):
+    import pyarrow as pa
+
+    os.makedirs(directory, exist_ok=True)
+    manifest, parts = _paths(key, directory)
+    stored = []
+    for part, frame in zip(BACKING_PARTS, frames):
+        if frame is None:
+            continue
+        # Written under a temporary name and renamed, so readers never see a partial file
+        temporary = f"{parts[part]}.{os.getpid()}.tmp"
+        table = pa.Table.from_pandas(frame)
+        with pa.OSFile(temporary, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(temporary, parts[part])
+        stored.append(part)
+
+    # The manifest goes last; it is what marks the version as complete
+    temporary = f"{manifest}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump({'key': list(map(str, key)), 'parts': stored}, f)
+    os.replace(temporary, manifest)
+
+    _remove_old_versions(key, directory)
+
+
+def _remove_old_versions(key, directory):
+    # Files of older versions of the same source. Processes still mapping them keep their
+    # pages until they unmap, so removing them here is safe.
+    source_prefix = f"{_digest(key[:2])}-"
+    current_prefix = f"{source_prefix}{_digest(key)}"
+    for name in os.listdir(directory):
+        if name.startswith(source_prefix) and not name.startswith(current_prefix):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
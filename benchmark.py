@@ -0,0 +1,419 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from analysis import analyze
+from anomalies import scan_source
+from data_sources import DATA_PATH_ENV, READING_CHUNK_ROWS, ParquetSource, clear_load_cache
+from dataset_store import STORE, DatasetStore
+from downsample import DEFAULT_POINT_BUDGET
+from exports import build_export
+from figures import (
+    combined_figure, cost_figure, cost_per_unit_figure, readings_figure, usage_figure, year_over_year_figure
+)
+from pyramid import RollupPyramid, resolution_label
+from similarity import cluster_profiles, meter_profiles, top_correlations
+from snapshot import SNAPSHOT_ENV
+from stats import compute_stats
+from table_view import ordered_positions, page_of
+
+# Benchmarks for the dashboard's data path on synthetic meter data. Every size writes a
+# Parquet file of generated readings, then times loading it into a dataset, the stats,
+# each figure build (including serialization, which st.plotly_chart does), the data table
+# and the exports, and optionally a full app run. Results are written as JSON so runs
+# from different commits can be compared:
+#
+#     python benchmark.py --sizes 1e3 1e5 1e6 --out before.json
+#     python benchmark.py --sizes 1e3 1e5 1e6 --out after.json --compare before.json
+#
+# With --cold-start, every size also times what a new dashboard worker pays before its
+# first page is drawn, each run in a fresh interpreter: importing the modules app.py
+# imports, and a first full run, without and then with a snapshot of the file.
+
+DEFAULT_SIZES = [1e3, 1e4, 1e5, 1e6]
+
+DEFAULT_METERS = 100
+
+DEFAULT_YEARS = 13
+
+# Median slowdown against the comparison run that is reported as a regression
+DEFAULT_REGRESSION_RATIO = 1.25
+
+# Cold-start runs, executed with `python -c` in a fresh interpreter. Streamlit is imported
+# before timing starts, since a server has it imported before any session arrives. Each
+# prints its seconds and the process' peak resident memory as JSON. The peak is read from
+# /proc: ru_maxrss would report the benchmark's own peak, which the child inherits.
+COLD_PEAK = '''
+peak = 0
+with open('/proc/self/status') as f:
+    for line in f:
+        if line.startswith('VmHWM:'):
+            peak = int(line.split()[1]) * 1024
+'''
+
+COLD_IMPORT = '''
+import ast, json, os, sys, time
+import streamlit
+app = sys.argv[1]
+sys.path.insert(0, os.path.dirname(app))
+with open(app) as f:
+    tree = ast.parse(f.read())
+modules = []
+for node in tree.body:
+    if isinstance(node, ast.Import):
+        modules += [alias.name for alias in node.names]
+    elif isinstance(node, ast.ImportFrom):
+        modules.append(node.module)
+timings = {}
+for module in modules:
+    started = time.perf_counter()
+    __import__(module)
+    timings[module] = time.perf_counter() - started
+''' + COLD_PEAK + '''
+print(json.dumps({'seconds': sum(timings.values()), 'peak_bytes': peak, 'modules': timings}))
+'''
+
+COLD_FIRST_PAINT = '''
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=float(sys.argv[2]))
+started = time.perf_counter()
+at.run()
+seconds = time.perf_counter() - started
+if at.exception:
+    sys.exit(at.exception[0].message)
+''' + COLD_PEAK + '''
+print(json.dumps({'seconds': seconds, 'peak_bytes': peak}))
+'''
+
+
+def synthetic_chunks(n_readings, meters=DEFAULT_METERS, interval=None, years=DEFAULT_YEARS,
+                     start='2011-01-01', seed=0, chunk_rows=READING_CHUNK_ROWS):
+    # Deterministic meter readings in frames of at most chunk_rows rows, meter by meter:
+    # `meters` sites, each with the same number of readings at a fixed interval. Without an
+    # interval the readings are spread over `years` years. Usage follows a per-meter
+    # baseline with a daily cycle and noise; the tariff rises a little every year.
+    # Only one chunk is in memory at a time, so 1e8 readings can be written to a file.
+    meters = max(1, min(meters, n_readings))
+    per_meter = max(1, n_readings // meters)
+    if interval is None:
+        step = pd.Timedelta(days=365 * years) / per_meter
+    else:
+        step = pd.Timedelta(interval)
+
+    first = pd.Timestamp(start)
+    site_names = [f'site-{i:05d}' for i in range(meters)]
+    groups = max(1, meters // 10)
+    group_names = [f'group-{i:03d}' for i in range(groups)]
+    baselines = np.random.default_rng(seed).lognormal(mean=3.0, sigma=0.5, size=meters)
+
+    # Several whole meters per chunk, or one meter split into pieces when it alone is larger
+    meters_per_chunk = max(1, chunk_rows // per_meter)
+    piece_rows = min(per_meter, chunk_rows)
+    for first_meter in range(0, meters, meters_per_chunk):
+        chunk_meters = np.arange(first_meter, min(meters, first_meter + meters_per_chunk), dtype='int32')
+        for lo in range(0, per_meter, piece_rows):
+            hi = min(per_meter, lo + piece_rows)
+            # Every chunk draws its noise from its own stream, independent of the chunk size before it
+            rng = np.random.default_rng([seed, first_meter, lo])
+
+            offsets = np.arange(lo, hi, dtype='int64') * step.value
+            timestamps = pd.to_datetime(first.value + np.tile(offsets, len(chunk_meters)))
+            codes = np.repeat(chunk_meters, hi - lo)
+
+            hours = timestamps.hour.to_numpy()
+            daily = 1.0 + 0.5 * np.sin((hours - 6) / 24 * 2 * np.pi)
+            usage = baselines[codes] * daily * rng.gamma(shape=4.0, scale=0.25, size=len(codes))
+
+            tariff = 0.095 + 0.004 * (timestamps.year.to_numpy() - first.year)
+            yield pd.DataFrame({
+                'timestamp': timestamps,
+                'site': pd.Categorical.from_codes(codes, site_names),
+                'site_group': pd.Categorical.from_codes(codes % groups, group_names),
+                'usage': usage,
+                'cost': usage * tariff
+            })
+
+
+def synthetic_readings(n_readings, meters=DEFAULT_METERS, interval=None, years=DEFAULT_YEARS,
+                       start='2011-01-01', seed=0):
+    # All of synthetic_chunks() as one frame, for sizes that fit in memory
+    chunks = synthetic_chunks(n_readings, meters, interval, years, start, seed)
+    return pd.concat(list(chunks), ignore_index=True)
+
+
+def write_readings(chunks, path):
+    # Writes generated chunks to a Parquet file one at a time; returns the readings written
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    written = 0
+    try:
+        for chunk in chunks:
+            if writer is None:
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            written += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
+
+
+def measure(step, fn, repeat):
+    # Timed runs first, then one run under tracemalloc for the peak traced allocation
+    # (NumPy and pandas buffers are traced too), so tracing doesn't skew the timings
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'step': step,
+        'min_seconds': min(timings),
+        'median_seconds': statistics.median(timings),
+        'peak_bytes': peak
+    }
+
+
+def package_path(name):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+
+def app_run(path, timeout):
+    # A full script run of the dashboard against the file, in-process via Streamlit's AppTest
+    from streamlit.testing.v1 import AppTest
+    os.environ[DATA_PATH_ENV] = path
+    at = AppTest.from_file(package_path('app.py'), default_timeout=timeout)
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+
+def benchmark_steps(path, include_app, app_timeout):
+    # (step name, callable) pairs for one data file, in the order the dashboard runs them
+    source = ParquetSource(path)
+
+    def build_dataset():
+        clear_load_cache()
+        STORE.invalidate()
+        return STORE.get(source)
+
+    yield 'dataset', build_dataset
+    dataset = build_dataset()
+    df = dataset.df
+    year_label = f"{int(df['year'].iloc[0])}-{int(df['year'].iloc[-1])}"
+
+    yield 'stats', lambda: compute_stats(df)
+    # Year comparisons need two years, and a range strictly inside the data needs three;
+    # short runs (e.g. small sizes at --interval 1h) cover fewer
+    if len(df) >= 2:
+        yield 'analysis', lambda: analyze(df, dataset.stats)
+    if len(df) >= 3:
+        yield 'select_years', lambda: dataset.select('all', None, (int(df['year'].iloc[1]), int(df['year'].iloc[-2])))
+    if dataset.series is not None:
+        yield 'anomaly_scan', lambda: scan_source(source)
+        yield 'rollup_pyramid', lambda: RollupPyramid(dataset.series)
+    if dataset.rollups is not None:
+        # A store without the dataset doesn't keep the scan, so every run reads the source
+        profiles = meter_profiles(source, dataset, store=DatasetStore())
+        yield 'meter_profiles', lambda: meter_profiles(source, dataset, store=DatasetStore())
+        yield 'meter_correlations', lambda: top_correlations(profiles)
+        yield 'meter_clusters', lambda: cluster_profiles(profiles)
+
+    figures = {
+        'combined': lambda: combined_figure(df, year_label),
+        'usage': lambda: usage_figure(df, year_label),
+        'cost': lambda: cost_figure(df, year_label),
+        'cost_per_unit': lambda: cost_per_unit_figure(df, year_label),
+        'year_over_year': lambda: year_over_year_figure(df)
+    }
+    if dataset.series is not None:
+        figures['usage_readings'] = lambda: readings_figure(dataset.series, 'usage', year_label)
+        figures['cost_readings'] = lambda: readings_figure(dataset.series, 'cost', year_label)
+        # The whole range as the dashboard draws it: from the coarsest pyramid level that fills the budget
+        pyramid = dataset.rollup_pyramid()
+        first, last = dataset.series.index[0], dataset.series.index[-1]
+        level = pyramid.level_for(first, last, DEFAULT_POINT_BUDGET)
+        figures['usage_pyramid'] = lambda: readings_figure(
+            pyramid.points(level, 'usage', first, last), 'usage', year_label, resolution=resolution_label(level, 'lttb')
+        )
+    for name, build in figures.items():
+        yield f'figure_{name}', lambda build=build: build().to_json()
+
+    readings = dataset.series if dataset.series is not None else df
+    yield 'table_sort_page', lambda: page_of(readings, ordered_positions(readings, 'usage', True), 1, 50)
+    yield 'table_filter_page', lambda: page_of(
+        readings, ordered_positions(readings, None, False, 'usage', readings['usage'].median(), None), 1, 50
+    )
+    rows = readings.reset_index() if dataset.series is not None else df
+    yield 'export_csv', lambda: build_export(rows, 'csv')
+    yield 'export_parquet', lambda: build_export(rows, 'parquet')
+
+    if include_app:
+        yield 'app_run', lambda: app_run(path, app_timeout)
+
+
+def measure_cold(step, code, argv, env, repeat):
+    # Like measure(), with every run in a new process; the peak is the process' peak
+    # resident memory, since a cold start's allocations are mostly imported modules
+    timings = []
+    peaks = []
+    for _ in range(repeat):
+        finished = subprocess.run([sys.executable, '-c', code] + argv, env=env, capture_output=True, text=True)
+        if finished.returncode != 0:
+            raise RuntimeError(f"{step} failed: {finished.stderr.strip()[-2000:]}")
+        run = json.loads(finished.stdout.strip().splitlines()[-1])
+        timings.append(run['seconds'])
+        peaks.append(run['peak_bytes'])
+
+    result = {
+        'step': step,
+        'min_seconds': min(timings),
+        'median_seconds': statistics.median(timings),
+        'peak_bytes': max(peaks)
+    }
+    if 'modules' in run:
+        result['modules'] = run['modules']
+    return result
+
+
+def cold_start_steps(path, workdir, app_timeout):
+    # (step name, code, arguments, environment) of the cold-start runs for one data file
+    env = dict(os.environ)
+    env[DATA_PATH_ENV] = path
+    env.pop(SNAPSHOT_ENV, None)
+    app = package_path('app.py')
+    yield 'cold_import', COLD_IMPORT, [app], env
+    yield 'cold_first_paint', COLD_FIRST_PAINT, [app, str(app_timeout)], env
+
+    # Written by the snapshot script in its own process, as it would be for a deployment
+    snapshot = os.path.join(workdir, 'snapshot.zip')
+    subprocess.run([sys.executable, package_path('snapshot.py'), snapshot], env=env, capture_output=True, check=True)
+    yield 'cold_first_paint_snapshot', COLD_FIRST_PAINT, [app, str(app_timeout)], dict(env, **{SNAPSHOT_ENV: snapshot})
+    os.remove(snapshot)
+
+
+def run_size(n_readings, args, workdir):
+    path = os.path.join(workdir, f'readings_{n_readings}.parquet')
+    write_readings(synthetic_chunks(n_readings, args.meters, args.interval, args.years, seed=args.seed), path)
+    file_bytes = os.path.getsize(path)
+
+    results = []
+    for step, fn in benchmark_steps(path, args.app, args.app_timeout):
+        result = measure(step, fn, args.repeat)
+        result.update(readings=n_readings, meters=args.meters, file_bytes=file_bytes)
+        results.append(result)
+        print(
+            f"{n_readings:>12,} {step:<28} {result['median_seconds'] * 1000:>10.1f} ms"
+            f" {result['peak_bytes'] / 1024 / 1024:>10.1f} MB peak",
+            flush=True
+        )
+
+    if args.cold_start:
+        for step, code, argv, env in cold_start_steps(path, workdir, args.app_timeout):
+            result = measure_cold(step, code, argv, env, args.repeat)
+            result.update(readings=n_readings, meters=args.meters, file_bytes=file_bytes)
+            results.append(result)
+            print(
+                f"{n_readings:>12,} {step:<28} {result['median_seconds'] * 1000:>10.1f} ms"
+                f" {result['peak_bytes'] / 1024 / 1024:>10.1f} MB peak RSS",
+                flush=True
+            )
+    os.remove(path)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    }
+
+
+def compare(results, baseline_path, ratio):
+    # Median time of every (size, step) against an earlier run; returns the regressions
+    with open(baseline_path) as f:
+        baseline = {(r['readings'], r['step']): r for r in json.load(f)['results']}
+
+    regressions = []
+    for result in results:
+        before = baseline.get((result['readings'], result['step']))
+        if before is None or before['median_seconds'] == 0:
+            continue
+        change = result['median_seconds'] / before['median_seconds']
+        if change > ratio:
+            regressions.append((result, change))
+            print(f"REGRESSION {result['readings']:>12,} {result['step']:<28} {change:.2f}x slower")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's data path on synthetic meter data.")
+    parser.add_argument('--sizes', type=float, nargs='+', default=DEFAULT_SIZES,
+                        help="Numbers of readings to generate, e.g. 1e3 1e6 1e8")
+    parser.add_argument('--meters', type=int, default=DEFAULT_METERS, help="Number of meters (sites)")
+    parser.add_argument('--interval', default=None,
+                        help="Reading interval, e.g. 15min or 1h (default: spread over --years)")
+    parser.add_argument('--years', type=int, default=DEFAULT_YEARS, help="Years covered when no interval is given")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per step")
+    parser.add_argument('--app', action='store_true', help="Also time a full dashboard run with Streamlit's AppTest")
+    parser.add_argument('--app-timeout', type=float, default=600, help="Seconds allowed for a dashboard run")
+    parser.add_argument('--cold-start', action='store_true',
+                        help="Also time imports and a first dashboard run in fresh processes, with and without a snapshot")
+    parser.add_argument('--out', default='benchmark.json', help="Where to write the results")
+    parser.add_argument('--compare', help="Earlier results file to check for regressions")
+    parser.add_argument('--regression-ratio', type=float, default=DEFAULT_REGRESSION_RATIO)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            results.extend(run_size(int(size), args, workdir))
+
+    with open(args.out, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.out}")
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.regression_ratio) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
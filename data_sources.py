@@ -0,0 +1,415 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from backing_store import backing_dir, map_frames, write_frames
+
+# Built-in sample data, used when no data file is configured
+SAMPLE_DATA = [
+    {'year': 2011, 'usage': 2178900, 'cost': 209828.00, 'costPerUnit': 0.0963},
+    {'year': 2012, 'usage': 1427550, 'cost': 137535.00, 'costPerUnit': 0.0963},
+    {'year': 2013, 'usage': 1532850, 'cost': 172209.00, 'costPerUnit': 0.1123},
+    {'year': 2014, 'usage': 1071650, 'cost': 125883.00, 'costPerUnit': 0.1175},
+    {'year': 2015, 'usage': 1381200, 'cost': 161637.00, 'costPerUnit': 0.1170},
+    {'year': 2016, 'usage': 1711350, 'cost': 201544.00, 'costPerUnit': 0.1178},
+    {'year': 2017, 'usage': 1607100, 'cost': 194743.00, 'costPerUnit': 0.1212},
+    {'year': 2018, 'usage': 1800750, 'cost': 218194.00, 'costPerUnit': 0.1212},
+    {'year': 2019, 'usage': 1507500, 'cost': 180065.00, 'costPerUnit': 0.1240},
+    {'year': 2020, 'usage': 1148800, 'cost': 122968.00, 'costPerUnit': 0.1070},
+    {'year': 2021, 'usage': 1035350, 'cost': 126298.00, 'costPerUnit': 0.1220},
+    {'year': 2022, 'usage': 1272460, 'cost': 165442.70, 'costPerUnit': 0.1300},
+    {'year': 2023, 'usage': 1088370, 'cost': 165066.76, 'costPerUnit': 0.1517}
+]
+
+# Environment variable pointing the dashboard at a meter export
+DATA_PATH_ENV = 'WATER_USAGE_DATA'
+
+# Only these columns are read from a meter export; anything else in the file is skipped.
+# Readings need either a `timestamp` or a `year` column plus `usage` and `cost`. Exports
+# covering several service points add a `site` column and optionally a `site_group`.
+READING_COLUMNS = ['timestamp', 'year', 'site', 'site_group', 'usage', 'cost', 'costPerUnit']
+
+READING_DTYPES = {
+    'year': 'int64',
+    'site': 'category',
+    'site_group': 'category',
+    'usage': 'float64',
+    'cost': 'float64',
+    'costPerUnit': 'float64'
+}
+
+SITE_YEARLY_COLUMNS = ['site', 'site_group', 'year', 'usage', 'cost', 'costPerUnit']
+
+YEARLY_COLUMNS = ['year', 'usage', 'cost', 'costPerUnit']
+
+# Storage dtypes of the frames kept after loading. Percentage changes fit in float32; costs
+# stay float64 so totals in the millions keep their cents, and so does the published cost
+# per unit, which is shown as-is. Aggregated usage volumes are stored as int32 when they
+# fit, otherwise int64.
+COMPACT_DTYPES = {
+    'year': 'int16',
+    'usage_change': 'float32',
+    'cost_change': 'float32'
+}
+
+# Readings per chunk when a source is scanned in pieces rather than loaded whole
+READING_CHUNK_ROWS = 250_000
+
+# Per-timestamp totals behind the reading-level charts and table
+SERIES_DTYPES = {
+    'usage': 'float32',
+    'cost': 'float32'
+}
+
+
+def dtypes_for(columns):
+    return {column: dtype for column, dtype in READING_DTYPES.items() if column in columns}
+
+
+def compact_frame(frame):
+    # Cast to the compact storage dtypes; columns already stored that way are left alone
+    dtypes = {
+        column: dtype for column, dtype in COMPACT_DTYPES.items()
+        if column in frame.columns and frame[column].dtype != dtype
+    }
+    if 'usage' in frame.columns and frame['usage'].dtype == 'int64':
+        if len(frame) and frame['usage'].max() <= np.iinfo('int32').max:
+            dtypes['usage'] = 'int32'
+    return frame.astype(dtypes) if dtypes else frame
+
+
+def reading_years(readings):
+    # Billing year of each reading, validating the required columns on the way
+    missing = {'usage', 'cost'} - set(readings.columns)
+    if missing:
+        raise ValueError(f"Readings are missing required columns: {', '.join(sorted(missing))}")
+
+    if 'year' in readings.columns:
+        return readings['year'].astype('int64')
+    if 'timestamp' in readings.columns:
+        return pd.to_datetime(readings['timestamp']).dt.year.astype('int64')
+    raise ValueError("Readings need either a 'timestamp' or a 'year' column")
+
+
+def aggregate_yearly(readings):
+    # Roll raw readings up to the one-row-per-year frame the dashboard renders
+    years = reading_years(readings)
+
+    # Already annual (e.g. the sample data): keep the published cost per unit as-is
+    if 'costPerUnit' in readings.columns and years.is_unique:
+        yearly = readings.assign(year=years, usage=readings['usage'].round().astype('int64'))
+        return compact_frame(yearly[YEARLY_COLUMNS].sort_values('year', ignore_index=True))
+
+    totals = readings[['usage', 'cost']].groupby(years.to_numpy(), sort=True).sum()
+    yearly = pd.DataFrame({
+        'year': totals.index.astype('int64'),
+        'usage': totals['usage'].round().astype('int64').to_numpy(),
+        'cost': totals['cost'].round(2).to_numpy(),
+        'costPerUnit': (totals['cost'] / totals['usage']).to_numpy()
+    })
+    return compact_frame(yearly)
+
+
+def aggregate_site_yearly(readings):
+    # One row per (site, year), built with a single groupby over all sites. Sites without a
+    # group are put in a group of their own name so every site belongs to exactly one group.
+    years = reading_years(readings).rename('year')
+    sites = readings['site'].astype('category')
+
+    site_yearly = readings[['usage', 'cost']].groupby([sites, years], observed=True, sort=True).sum().reset_index()
+    site_yearly['usage'] = site_yearly['usage'].round().astype('int64')
+    site_yearly['cost'] = site_yearly['cost'].round(2)
+    site_yearly['costPerUnit'] = site_yearly['cost'] / site_yearly['usage']
+
+    # Group of each site, taken from its first reading; works on category codes, not strings
+    group_of_site = np.asarray(sites.cat.categories, dtype=object)
+    if 'site_group' in readings.columns:
+        present, first_rows = np.unique(sites.cat.codes.to_numpy(), return_index=True)
+        first_rows = first_rows[present >= 0]
+        present = present[present >= 0]
+        groups = readings['site_group'].iloc[first_rows].astype(object).to_numpy()
+        known = pd.notna(groups)
+        group_of_site[present[known]] = groups[known]
+    site_yearly['site_group'] = pd.Categorical(group_of_site[site_yearly['site'].cat.codes.to_numpy()])
+    return compact_frame(site_yearly[SITE_YEARLY_COLUMNS])
+
+
+def site_year_sums(readings):
+    # Unrounded usage and cost per (site, year), indexed by both; readings without a site
+    # are left out
+    years = reading_years(readings).rename('year')
+    sites = pd.Series(readings['site'].to_numpy(dtype=object), index=readings.index, name='site')
+    return readings[['usage', 'cost']].astype('float64').groupby([sites, years], sort=True).sum()
+
+
+def restate_site_years(site_yearly, sums):
+    # The (site, year) rows that have unrounded `sums` rounded from them, as
+    # aggregate_site_yearly rounds a single load's sums; the other rows are kept
+    rows = pd.MultiIndex.from_arrays([
+        site_yearly['site'].to_numpy(dtype=object), site_yearly['year'].to_numpy().astype('int64')
+    ])
+    sums = sums.reindex(rows)
+    known = sums['usage'].notna().to_numpy()
+    usage = np.where(known, sums['usage'].round().to_numpy(), site_yearly['usage'].to_numpy())
+    cost = np.where(known, sums['cost'].round(2).to_numpy(), site_yearly['cost'].to_numpy())
+    return compact_frame(site_yearly.assign(usage=usage.astype('int64'), cost=cost, costPerUnit=cost / usage))
+
+
+def merge_site_yearly(site_yearly, update):
+    # Add newly aggregated (site, year) rows into existing ones. Works on the aggregated
+    # rows only, so its cost doesn't depend on how many raw readings are behind them.
+    combined = pd.concat([site_yearly, update], ignore_index=True).astype({'site': 'category'})
+    merged = combined.groupby(['site', 'year'], observed=True, sort=True).agg(
+        site_group=('site_group', 'first'),
+        usage=('usage', 'sum'),
+        cost=('cost', 'sum')
+    ).reset_index()
+    merged['costPerUnit'] = merged['cost'] / merged['usage']
+    merged['site_group'] = merged['site_group'].astype('category')
+    return compact_frame(merged[SITE_YEARLY_COLUMNS])
+
+
+def aggregate_series(readings):
+    # Portfolio-wide usage and cost per reading timestamp, indexed by timestamp
+    timestamps = pd.to_datetime(readings['timestamp']).rename('timestamp')
+    return readings[['usage', 'cost']].groupby(timestamps, sort=True).sum().astype(SERIES_DTYPES)
+
+
+def merge_series(series, update):
+    # Append newer readings to a timestamp series, re-summing only if the two overlap
+    if series is None:
+        return update
+    if len(update) == 0 or update.index[0] > series.index[-1]:
+        return pd.concat([series, update])
+    return pd.concat([series, update]).groupby(level=0, sort=True).sum().astype(SERIES_DTYPES)
+
+
+def yearly_from_sites(site_yearly):
+    # Portfolio-wide yearly totals from the per-site rows
+    totals = site_yearly.groupby('year', sort=True)[['usage', 'cost']].sum()
+    return compact_frame(pd.DataFrame({
+        'year': totals.index.astype('int64'),
+        'usage': totals['usage'].to_numpy(),
+        'cost': totals['cost'].round(2).to_numpy(),
+        'costPerUnit': (totals['cost'] / totals['usage']).to_numpy()
+    }))
+
+
+class DataSource:
+    # A place readings can be loaded from. Subclasses implement read() and cache_key().
+
+    # Whether the loaded frames may be kept in the memory-mapped backing store
+    backed = False
+    
+    # Whether meter-level readings can be paged with count_readings() and readings_page()
+    queryable = False
+
+    def read(self):
+        raise NotImplementedError
+
+    def cache_key(self):
+        raise NotImplementedError
+
+    def load(self):
+        # Year-level frame for this source, parsed at most once per cache key
+        return _load_cached(self)[0]
+
+    def load_sites(self):
+        # Per-site yearly rows, or None when the readings have no `site` column
+        return _load_cached(self)[1]
+
+    def load_series(self):
+        # Portfolio totals per reading timestamp, or None when readings have no `timestamp`
+        return _load_cached(self)[2]
+
+    def aggregate(self):
+        # (yearly, site yearly or None, series or None) frames of all the readings
+        readings = self.read()
+        series = aggregate_series(readings) if 'timestamp' in readings.columns else None
+        if 'site' in readings.columns:
+            site_yearly = aggregate_site_yearly(readings)
+            return yearly_from_sites(site_yearly), site_yearly, series
+        return aggregate_yearly(readings), None, series
+
+    def columns(self):
+        return list(self.read().columns)
+
+    def iter_readings(self, columns, chunk_rows=READING_CHUNK_ROWS):
+        # The readings' `columns` in chunks of at most chunk_rows rows, in file order
+        readings = self.read()[columns]
+        for start in range(0, len(readings), chunk_rows):
+            yield readings.iloc[start:start + chunk_rows]
+
+
+class SampleSource(DataSource):
+    def read(self):
+        sample = pd.DataFrame(SAMPLE_DATA)
+        return sample.astype(dtypes_for(sample.columns))
+
+    def cache_key(self):
+        return ('sample',)
+
+
+class FileSource(DataSource):
+    backed = True
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def cache_key(self):
+        # A rewritten file gets a new mtime (and usually a new size), which invalidates the cache
+        stat = os.stat(self.path)
+        return (type(self).__name__, self.path, stat.st_mtime_ns, stat.st_size)
+
+    def available_columns(self):
+        raise NotImplementedError
+
+    def projected_columns(self):
+        available = set(self.available_columns())
+        return [column for column in READING_COLUMNS if column in available]
+
+    def columns(self):
+        return self.projected_columns()
+
+    def iter_readings(self, columns, chunk_rows=READING_CHUNK_ROWS):
+        # Only one chunk of the file is materialized at a time
+        for chunk in self.read_chunks(columns, chunk_rows):
+            yield chunk.astype(dtypes_for(columns))
+
+    def read_chunks(self, columns, chunk_rows):
+        raise NotImplementedError
+
+    def read(self):
+        columns = self.projected_columns()
+        readings = self.read_columns(columns)
+        return readings.astype(dtypes_for(columns))
+
+    def read_columns(self, columns):
+        raise NotImplementedError
+
+
+class CSVSource(FileSource):
+    def available_columns(self):
+        return pd.read_csv(self.path, nrows=0).columns
+
+    def read_columns(self, columns):
+        return pd.read_csv(
+            self.path,
+            usecols=columns,
+            dtype=dtypes_for(columns),
+            parse_dates=['timestamp'] if 'timestamp' in columns else False,
+            engine='pyarrow'
+        )
+
+    def read_chunks(self, columns, chunk_rows):
+        # The pyarrow engine can't read in chunks, so the C parser is used here
+        return pd.read_csv(
+            self.path,
+            usecols=columns,
+            dtype=dtypes_for(columns),
+            parse_dates=['timestamp'] if 'timestamp' in columns else False,
+            chunksize=chunk_rows
+        )
+
+
+class ParquetSource(FileSource):
+    def available_columns(self):
+        import pyarrow.parquet as pq
+        return pq.read_schema(self.path).names
+
+    def read_columns(self, columns):
+        return pd.read_parquet(self.path, columns=columns, memory_map=True)
+
+    def read_chunks(self, columns, chunk_rows):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(self.path, memory_map=True)
+        for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+
+
+class ArrowSource(FileSource):
+    # Arrow IPC file format (also written as .feather)
+
+    def available_columns(self):
+        import pyarrow as pa
+        with pa.memory_map(self.path) as source:
+            return pa.ipc.open_file(source).schema.names
+
+    def read_columns(self, columns):
+        import pyarrow.feather as feather
+        return feather.read_table(self.path, columns=columns, memory_map=True).to_pandas()
+
+    def read_chunks(self, columns, chunk_rows):
+        import pyarrow as pa
+        with pa.memory_map(self.path) as source:
+            reader = pa.ipc.open_file(source)
+            for index in range(reader.num_record_batches):
+                batch = reader.get_batch(index).select(columns)
+                for start in range(0, batch.num_rows, chunk_rows):
+                    yield batch.slice(start, chunk_rows).to_pandas()
+
+
+SOURCE_TYPES = {
+    '.csv': CSVSource,
+    '.parquet': ParquetSource,
+    '.pq': ParquetSource,
+    '.arrow': ArrowSource,
+    '.feather': ArrowSource,
+    '.ipc': ArrowSource
+}
+
+
+def open_source(path):
+    # Pick a reader from the file extension
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SOURCE_TYPES:
+        raise ValueError(f"Unsupported data file '{path}'. Expected one of: {', '.join(sorted(SOURCE_TYPES))}")
+    return SOURCE_TYPES[extension](path)
+
+
+def default_source():
+    path = os.environ.get(DATA_PATH_ENV)
+    if not path:
+        return SampleSource()
+    # Imported here: the SQL backend builds on this module
+    from sql_backend import sql_source
+    return sql_source(open_source(path))
+
+
+# Parsed year-level frames, one entry per source. Streamlit reruns re-execute app.py but
+# keep imported modules, so this survives reruns and is shared by every session.
+_load_cache = {}
+_load_lock = threading.Lock()
+
+
+def _load_cached(source):
+    key = source.cache_key()
+    slot = key[:2]
+    with _load_lock:
+        cached = _load_cache.get(slot)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+    # Another worker process may already have aggregated this version of the file into the
+    # backing store; mapping its files skips reading the readings altogether
+    directory = backing_dir() if source.backed else None
+    loaded = map_frames(key, directory) if directory else None
+
+    if loaded is None:
+        loaded = source.aggregate()
+        if directory:
+            # Use the mapped copies too, so this process shares pages with the others
+            write_frames(key, directory, loaded)
+            loaded = map_frames(key, directory) or loaded
+
+    with _load_lock:
+        # Replacing the slot drops the frames parsed from an older version of the same file
+        _load_cache[slot] = (key, loaded)
+    return loaded
+
+
+def clear_load_cache():
+    with _load_lock:
+        _load_cache.clear()
@@ -0,0 +1,292 @@
+import threading
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+
+from data_sources import (
+    aggregate_series, aggregate_site_yearly, compact_frame, merge_series, merge_site_yearly, restate_site_years,
+    site_year_sums, yearly_from_sites
+)
+from figure_cache import LRUCache
+from pyramid import RollupPyramid
+from range_queries import CrossingIndex, RangeQueries
+from sites import SiteRollups
+from stats import IncrementalStats, add_yoy_changes, compute_stats
+from timing import span
+
+# Open scans over the readings of loaded sources, kept up to date as readings are
+# appended. An anomaly detector carries about 1.9 KB per meter, so this fits the scans of
+# a 100,000-meter portfolio at a couple of detector settings besides its billing totals.
+SCAN_CACHE_BYTES = 512 * 1024 * 1024
+
+
+class Dataset:
+    # Year-level frame plus its stats, built once per source version and shared by every
+    # session. Treat it as read-only: views that need to change the frame must copy it.
+    # Multi-site sources also carry precomputed per-site and per-group rollups, and sources
+    # with timestamps keep the portfolio totals per reading for reading-level charts.
+
+    def __init__(self, version, source_key, df, stats, rollups=None, series=None, pyramid=None):
+        self.version = version
+        self.source_key = source_key
+        self.df = df
+        self.stats = MappingProxyType(stats)
+        self.rollups = rollups
+        self.series = series
+        self.ranges = RangeQueries(df)
+        self.crossing_indexes = {}
+        self.pyramid = pyramid
+        self.lock = threading.Lock()
+
+    def series_between(self, first_year, last_year):
+        # Reading-level totals for whole years first_year..last_year, located by binary search
+        lo = self.series.index.searchsorted(pd.Timestamp(year=first_year, month=1, day=1), side='left')
+        hi = self.series.index.searchsorted(pd.Timestamp(year=last_year + 1, month=1, day=1), side='left')
+        return self.series.iloc[lo:hi]
+
+    def rollup_pyramid(self):
+        # Day, month and year rollups of the reading-level totals, built on first use
+        with self.lock:
+            if self.pyramid is None:
+                with span('rollup_pyramid'):
+                    self.pyramid = RollupPyramid(self.series)
+            return self.pyramid
+
+    def level_rows(self, level):
+        # Year-level rows of every series at a selection level, and each series' row span
+        if level == 'all' or self.rollups is None:
+            return self.df, {None: (0, len(self.df))}
+        return self.rollups.frames[level], self.rollups.spans[level]
+
+    def crossing_years(self, level, column, thresholds, keys=None, years=None, below=False):
+        # First year each series at a level reached each threshold (fell to it with
+        # below=True), optionally within a (first, last) year range: a frame indexed by
+        # series with one column per threshold, <NA> where it never did. The crossing index
+        # behind it is built once per level and column.
+        frame, spans = self.level_rows(level)
+        with self.lock:
+            index = self.crossing_indexes.get((level, column))
+            if index is None:
+                index = CrossingIndex(frame[column].to_numpy(), list(spans.values()))
+                self.crossing_indexes[(level, column)] = index
+
+        labels = list(spans)
+        if keys is None:
+            series = np.arange(len(labels))
+            keys = labels
+        else:
+            row_of = {label: row for row, label in enumerate(labels)}
+            series = np.array([row_of[key] for key in keys], dtype='int64')
+
+        lo = hi = None
+        if years is not None:
+            # Rows are sorted by series, then year, so series * 10000 + year is sorted too
+            row_series = np.repeat(np.arange(len(labels)), index.stops - index.starts)
+            year_keys = row_series * 10000 + frame['year'].to_numpy()
+            lo = np.searchsorted(year_keys, series * 10000 + years[0], side='left')[:, None]
+            hi = np.searchsorted(year_keys, series * 10000 + years[1], side='right')[:, None]
+
+        positions = index.first_positions(series[:, None], np.asarray(thresholds)[None, :], below, lo, hi)
+        found = frame['year'].to_numpy()[np.maximum(positions, 0)]
+        crossings = pd.DataFrame(found, index=pd.Index(keys, name=level), columns=list(thresholds)).astype('Int16')
+        return crossings.mask(positions < 0)
+
+    def select(self, level='all', key=None, years=None):
+        # Frame and stats for the whole portfolio, one site group or one site, optionally
+        # limited to a (first, last) year range answered from the precomputed range queries
+        if level != 'all' and self.rollups is not None:
+            df, stats = self.rollups.select(level, key, years)
+            return df, MappingProxyType(stats)
+        if years is None:
+            return self.df, self.stats
+        lo, hi = self.ranges.positions(years[0], years[1])
+        return self.df.iloc[lo:hi].reset_index(drop=True), MappingProxyType(self.ranges.stats(lo, hi))
+
+
+def build_dataset(version, source_key, yearly, site_yearly=None, series=None):
+    # Changes, stats and site rollups for loaded year-level frames
+    with span('dataset_stats'):
+        # A shallow copy: the change columns are added without copying the loaded columns
+        df = compact_frame(add_yoy_changes(yearly.copy(deep=False)))
+        stats = compute_stats(df)
+    with span('dataset_rollups'):
+        rollups = SiteRollups(site_yearly) if site_yearly is not None else None
+    return Dataset(version, source_key, df, stats, rollups, series)
+
+
+class ScanCache(LRUCache):
+    # Open scans keyed by source version and scan, sized by the state they carry
+
+    def size_of(self, value):
+        return value.nbytes()
+
+
+class DatasetStore:
+    # Process-wide cache of built datasets, one per source. A source whose cache key
+    # changed (e.g. the file was rewritten) is rebuilt under a new version number.
+
+    def __init__(self):
+        self.datasets = {}
+        self.engines = {}
+        # Unrounded sums of the latest site-years of each appended multi-site dataset
+        self.site_sums = {}
+        self.scans = ScanCache(SCAN_CACHE_BYTES)
+        self.next_version = 1
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, source):
+        key = source.cache_key()
+        slot = key[:2]
+        with self.lock:
+            dataset = self.datasets.get(slot)
+            if dataset is not None and dataset.source_key == key:
+                self.hits += 1
+                return dataset
+
+            # Build while holding the lock so concurrent sessions don't all rebuild the same data
+            self.misses += 1
+            with span('dataset_load'):
+                yearly = source.load()
+            dataset = build_dataset(self.next_version, key, yearly, source.load_sites(), source.load_series())
+            self.next_version += 1
+            self.datasets[slot] = dataset
+            self.engines.pop(slot, None)
+            self.site_sums.pop(slot, None)
+            return dataset
+
+    def seed(self, key, build):
+        # Install a dataset built elsewhere, e.g. from a snapshot, for the source version
+        # `key`; build(version) is only called when that version isn't loaded yet
+        slot = key[:2]
+        with self.lock:
+            dataset = self.datasets.get(slot)
+            if dataset is not None and dataset.source_key == key:
+                return dataset
+            dataset = build(self.next_version)
+            self.next_version += 1
+            self.datasets[slot] = dataset
+            self.engines.pop(slot, None)
+            self.site_sums.pop(slot, None)
+            return dataset
+
+    def append(self, source, readings):
+        # Fold newly arrived readings into the source's dataset without re-aggregating its
+        # history. Publishes a new dataset version; sessions holding the old one keep it.
+        #
+        # Only the stats engine is incremental. The new version's year-level frame, range
+        # queries and site rollups are full rebuilds, but over year-level rows (years, or
+        # sites x years), never over readings. Batches with timestamps also copy the
+        # reading-level series once to append to it. Open scans of the source's readings
+        # (see scan()) are advanced by the batch.
+        dataset = self.get(source)
+        slot = dataset.source_key[:2]
+        with self.lock:
+            engine = self.engines.get(slot)
+            if engine is None:
+                engine = IncrementalStats(dataset.df)
+                self.engines[slot] = engine
+            # Site rollups are rebuilt from the merged per-site yearly rows, not raw readings.
+            # The portfolio years the batch touches are then summed from those rows, as a
+            # fresh load sums them, so the frame and the site totals agree.
+            rollups = dataset.rollups
+            shown = None
+            sums = None
+            if rollups is not None:
+                if 'site' not in readings.columns:
+                    raise ValueError("Readings appended to a multi-site dataset need a 'site' column")
+                update = aggregate_site_yearly(readings)
+                site_yearly = merge_site_yearly(rollups.site_yearly, update)
+                site_yearly, sums = self._restate_open_site_years(slot, source, rollups.site_yearly, site_yearly, readings)
+                rollups = SiteRollups(site_yearly)
+                if len(update):
+                    shown = yearly_from_sites(site_yearly[site_yearly['year'] >= update['year'].min()])
+            engine.append(readings, shown)
+            if sums is not None:
+                self.site_sums[slot] = sums
+
+            series = dataset.series
+            pyramid = None
+            if 'timestamp' in readings.columns:
+                update = aggregate_series(readings)
+                series = merge_series(series, update)
+                # A pyramid already built is extended from the first new reading's buckets;
+                # otherwise the new version builds its own when a chart first needs it
+                if dataset.pyramid is not None and len(update):
+                    pyramid = dataset.pyramid.extend(series, update.index[0])
+
+            # Each open scan of the source reads the batch once
+            with self.scans.lock:
+                scans = [(key, entry[0]) for key, entry in self.scans.entries.items() if key[0] == dataset.source_key]
+            for key, scan in scans:
+                scan.append(readings)
+                self.scans.put(key, scan)
+
+            dataset = Dataset(
+                self.next_version, dataset.source_key, compact_frame(engine.frame()), engine.stats(), rollups, series,
+                pyramid
+            )
+            self.next_version += 1
+            self.datasets[slot] = dataset
+            return dataset
+
+    def scan(self, dataset, name, build):
+        # A scan over the readings of the dataset's source, e.g. an open anomaly detector:
+        # build() reads the source once, then every batch appended to the source's dataset
+        # goes to the scan's append() once, before the batch's version is published. A scan
+        # always reflects the newest version. One first asked for after readings were
+        # appended starts from the source alone and misses them, as does one rebuilt after
+        # it was evicted; scans of a source version no longer loaded aren't kept.
+        key = dataset.source_key
+        with self.lock:
+            current = self.datasets.get(key[:2])
+            if current is None or current.source_key != key:
+                return build()
+            # Built under the store lock, so no batch is appended while the source is read
+            return self.scans.get_or_build((key, name), build)
+
+    def _restate_open_site_years(self, slot, source, loaded, site_yearly, readings):
+        # Site-years a batch can still add to keep their unrounded sums between appends, and
+        # are rounded from those; summing rounded batches would drift from a fresh load of
+        # the same readings. Returns the restated rows and the sums to keep, those of the
+        # latest year; earlier years are closed. The first append takes the sums of the
+        # loaded latest year from the source, in one pass over its readings.
+        sums = self.site_sums.get(slot)
+        if sums is None:
+            last = int(loaded['year'].max())
+            columns = [column for column in ['timestamp', 'year', 'site', 'usage', 'cost'] if column in source.columns()]
+            sums = [
+                chunk_sums[chunk_sums.index.get_level_values('year') == last]
+                for chunk_sums in map(site_year_sums, source.iter_readings(columns))
+            ]
+        else:
+            sums = [sums]
+        sums = pd.concat(sums + [site_year_sums(readings)]).groupby(level=['site', 'year'], sort=True).sum()
+        years = sums.index.get_level_values('year')
+        return restate_site_years(site_yearly, sums), sums[years == years.max()]
+
+    def invalidate(self):
+        with self.lock:
+            self.datasets.clear()
+            self.engines.clear()
+            self.site_sums.clear()
+            self.scans.clear()
+
+    def info(self):
+        with self.lock:
+            return {
+                'datasets': len(self.datasets),
+                'versions': {slot: dataset.version for slot, dataset in self.datasets.items()},
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+# Shared by all reruns and sessions of this server process
+STORE = DatasetStore()
+
+
+def get_dataset(source):
+    return STORE.get(source)
@@ -0,0 +1,74 @@
+import numpy as np
+
+# Default number of points sent to the browser per trace
+DEFAULT_POINT_BUDGET = 2000
+
+# Traces with more points than this are drawn with WebGL (Scattergl) instead of SVG
+WEBGL_MIN_POINTS = 1000
+
+METHODS = {'lttb': 'LTTB', 'minmax': 'Min/max buckets'}
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the point of each bucket that forms the largest
+    # triangle with the previously kept point and the next bucket's average. Returns the
+    # positions of the kept points, always including the first and last.
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    # Bucket edges 1 + i * (n - 2) / (threshold - 2), floored in integers: a float step can
+    # land a hair under a whole row and move the edge back one
+    edges = 1 + np.arange(threshold - 1, dtype=np.int64) * (n - 2) // (threshold - 2)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    anchor = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_stop = edges[bucket + 1], edges[bucket + 2]
+            next_x = x[next_start:next_stop].mean()
+            next_y = y[next_start:next_stop].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        areas = np.abs(
+            (x[anchor] - next_x) * (y[start:stop] - y[anchor])
+            - (x[anchor] - x[start:stop]) * (next_y - y[anchor])
+        )
+        anchor = start + int(np.argmax(areas))
+        selected[bucket + 1] = anchor
+    return selected
+
+
+def minmax_buckets(y, threshold):
+    # Splits the series into threshold / 2 equal buckets and keeps each bucket's minimum and
+    # maximum, so every peak and trough survives. Returns sorted positions.
+    n = len(y)
+    buckets = threshold // 2
+    if threshold >= n or buckets < 1:
+        return np.arange(n)
+
+    size = -(-n // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+
+    valid = ~np.isnan(padded).all(axis=1)
+    lows = offsets[valid] + np.nanargmin(padded[valid], axis=1)
+    highs = offsets[valid] + np.nanargmax(padded[valid], axis=1)
+    return np.unique(np.concatenate([[0, n - 1], lows, highs]))
+
+
+def downsample(x, y, budget=DEFAULT_POINT_BUDGET, method='lttb'):
+    # Positions of the points to plot; every position when the series fits the budget
+    if method == 'lttb':
+        return lttb(x, y, budget)
+    if method == 'minmax':
+        return minmax_buckets(np.asarray(y, dtype='float64'), budget)
+    raise ValueError(f"Unknown downsampling method '{method}'. Expected one of: {', '.join(METHODS)}")
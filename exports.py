@@ -0,0 +1,81 @@
+import gzip
+import io
+
+from figure_cache import LRUCache
+
+# Rows serialized per chunk; bounds the intermediate text/batches held at once
+EXPORT_CHUNK_ROWS = 100_000
+
+# Upper bound on the size of all cached export files
+EXPORT_CACHE_BYTES = 128 * 1024 * 1024
+
+EXPORT_FORMATS = {
+    'csv': {'label': 'CSV', 'extension': 'csv', 'mime': 'text/csv'},
+    'parquet': {'label': 'Parquet', 'extension': 'parquet', 'mime': 'application/vnd.apache.parquet'},
+    'arrow': {'label': 'Arrow IPC', 'extension': 'arrow', 'mime': 'application/vnd.apache.arrow.file'}
+}
+
+
+def write_csv(df, stream, chunk_rows):
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    for start in range(0, max(len(df), 1), chunk_rows):
+        df.iloc[start:start + chunk_rows].to_csv(text, header=(start == 0), index=False)
+    text.flush()
+    text.detach()
+
+
+def write_parquet(df, stream, chunk_rows, compression):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(stream, schema, compression=compression) as writer:
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def write_arrow(df, stream, chunk_rows):
+    import pyarrow as pa
+
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pa.ipc.new_file(stream, schema) as writer:
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def build_export(df, export_format, compress=False, chunk_rows=EXPORT_CHUNK_ROWS):
+    # Serialize `df` chunk by chunk. CSV and Arrow are gzipped as a stream; Parquet uses its
+    # own gzip codec so the file stays readable by Parquet tools.
+    buffer = io.BytesIO()
+    if export_format == 'parquet':
+        write_parquet(df, buffer, chunk_rows, 'gzip' if compress else 'snappy')
+        return buffer.getvalue()
+
+    stream = gzip.GzipFile(fileobj=buffer, mode='wb') if compress else buffer
+    if export_format == 'csv':
+        write_csv(df, stream, chunk_rows)
+    elif export_format == 'arrow':
+        write_arrow(df, stream, chunk_rows)
+    else:
+        raise ValueError(f"Unknown export format '{export_format}'. Expected one of: {', '.join(EXPORT_FORMATS)}")
+    if compress:
+        stream.close()
+    return buffer.getvalue()
+
+
+def export_file_name(base_name, export_format, compress=False):
+    extension = EXPORT_FORMATS[export_format]['extension']
+    suffix = '.gz' if compress and export_format != 'parquet' else ''
+    return f"{base_name}.{extension}{suffix}"
+
+
+def export_mime(export_format, compress=False):
+    if compress and export_format != 'parquet':
+        return 'application/gzip'
+    return EXPORT_FORMATS[export_format]['mime']
+
+
+# Built export files keyed by dataset version, filter state and format; shared by all sessions
+EXPORTS = LRUCache(EXPORT_CACHE_BYTES)
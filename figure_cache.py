@@ -0,0 +1,117 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Upper bound on the estimated size of all cached figures
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Trace properties that hold per-point data, which is most of a figure's size
+DATA_PROPERTIES = ['x', 'y', 'z', 'text', 'hovertext', 'customdata']
+
+# Allowance for the layout and template of a figure, and the styling of one trace
+FIGURE_BYTES = 8 * 1024
+TRACE_BYTES = 1024
+
+# Elements of a list looked at to estimate the size of the whole list
+SAMPLE_ITEMS = 64
+
+
+class LRUCache:
+    # Values keyed by (view, dataset version, filter state, options), evicted
+    # least-recently-used first once their total size passes max_bytes. Keys carry the
+    # dataset version, so entries are safe to share between sessions; cached values must
+    # not be modified after they are stored. Subclasses define how a value is sized.
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Build outside the lock so one slow build doesn't block other sessions
+        return self.put(key, build())
+
+    def put(self, key, value):
+        size = self.size_of(value)
+        with self.lock:
+            if size > self.max_bytes:
+                return value
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def size_of(self, value):
+        return len(value)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def info(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class FigureCache(LRUCache):
+    # Built Plotly figures, sized by an estimate from their traces' data. Serializing each
+    # figure to measure it would cost as much again as st.plotly_chart sending it.
+
+    def size_of(self, fig):
+        size = FIGURE_BYTES
+        for trace in fig.data:
+            size += TRACE_BYTES
+            for name in DATA_PROPERTIES:
+                size += value_bytes(getattr(trace, name, None))
+        return size
+
+
+def value_bytes(value):
+    # Numeric arrays by their buffers; lists and object arrays from a sample of their items
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        return value.nbytes
+    if isinstance(value, (list, tuple, np.ndarray)):
+        if len(value) == 0:
+            return 0
+        sample = value[:SAMPLE_ITEMS]
+        return len(value) * sum(value_bytes(item) for item in sample) // len(sample)
+    return 8
+
+
+def figure_key(view, version, selection=('all', None), years=None, options=None):
+    # Cache key of a view's figure for a dataset version, selection, year range and options
+    return (view, version, selection, years, tuple(sorted((options or {}).items())))
+
+
+# Shared by all reruns and sessions of this server process
+FIGURES = FigureCache()
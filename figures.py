@@ -0,0 +1,583 @@
+import plotly.graph_objects as go
+
+from downsample import DEFAULT_POINT_BUDGET, WEBGL_MIN_POINTS, downsample
+from forecast import linear_trend
+
+# Most flagged periods of each kind drawn on a chart, highest scores first, so one noisy
+# meter can't flood the chart with shapes
+ANNOTATED_PERIODS = 100
+
+# plotly.express and plotly.subplots are imported by the figures that use them. Importing
+# plotly.express takes longer than importing all of the dashboard's own modules, and a
+# worker booted from a snapshot paints its first page without building any figure.
+
+
+def add_forecast(fig, forecast, color, hover_format):
+    # Forecast line continuing from the last actual year, inside a shaded prediction band
+    years = list(forecast['year'])
+    fig.add_trace(go.Scatter(
+        x=years + years[::-1],
+        y=list(forecast['upper']) + list(forecast['lower'])[::-1],
+        fill='toself',
+        fillcolor=color.replace('1)', '0.15)'),
+        line=dict(width=0),
+        name='Forecast range (80%)',
+        hoverinfo='skip'
+    ))
+    fig.add_trace(go.Scatter(
+        x=years,
+        y=forecast['forecast'],
+        mode='lines+markers',
+        line=dict(color=color, width=2, dash='dot'),
+        marker=dict(size=6, color=color),
+        name='Forecast',
+        customdata=forecast[['lower', 'upper']],
+        hovertemplate=(
+            f'Year: %{{x}}<br>Forecast: %{{y:{hover_format}}}'
+            f'<br>Range: %{{customdata[0]:{hover_format}}} – %{{customdata[1]:{hover_format}}}<extra></extra>'
+        )
+    ))
+
+
+def add_anomaly_counts(fig, df, anomalies):
+    # Number of flagged periods starting in each year, above that year's bar
+    counts = anomalies.groupby([anomalies['start'].dt.year, 'kind']).size().unstack(fill_value=0)
+    usage = df.set_index('year')['usage']
+    for year, row in counts.iterrows():
+        if year not in usage.index:
+            continue
+        parts = []
+        if row.get('leak', 0):
+            parts.append(f"{row['leak']} leak{'s' if row['leak'] > 1 else ''}")
+        if row.get('spike', 0):
+            parts.append(f"{row['spike']} spike{'s' if row['spike'] > 1 else ''}")
+        fig.add_annotation(
+            x=year,
+            y=usage[year],
+            text='⚠️ ' + ', '.join(parts),
+            showarrow=False,
+            yshift=32,
+            font=dict(size=11, color='#B45309')
+        )
+
+
+def add_anomaly_periods(fig, anomalies, readings, column):
+    # Leak periods as shaded bands and spikes as markers on a reading-level chart
+    leaks = anomalies[anomalies['kind'] == 'leak'].nlargest(ANNOTATED_PERIODS, 'score')
+    spikes = anomalies[anomalies['kind'] == 'spike'].nlargest(ANNOTATED_PERIODS, 'score')
+    for leak in leaks.itertuples():
+        fig.add_vrect(x0=leak.start, x1=leak.end, fillcolor='rgba(245, 158, 11, 0.18)', line_width=0, layer='below')
+    
+    values = readings[column].to_numpy()
+    for periods, name, symbol, color, hovertemplate in [
+        (leaks, 'Possible leaks', 'diamond', '#F59E0B',
+         'Possible leak at %{customdata[0]}<br>%{customdata[1]} nights, up to %{customdata[2]:.1f}× usual night flow<extra></extra>'),
+        (spikes, 'Usage spikes', 'triangle-up', '#DC2626',
+         'Spike at %{customdata[0]}<br>%{customdata[1]} readings, robust z-score %{customdata[2]:.1f}<extra></extra>')
+    ]:
+        if len(periods) == 0 or len(values) == 0:
+            continue
+        positions = readings.index.searchsorted(periods['start']).clip(max=len(values) - 1)
+        fig.add_trace(go.Scatter(
+            x=periods['start'],
+            y=values[positions],
+            mode='markers',
+            marker=dict(symbol=symbol, size=10, color=color, line=dict(width=1, color='white')),
+            name=name,
+            customdata=periods[['site', 'count', 'score']],
+            hovertemplate=hovertemplate
+        ))
+
+
+def combined_figure(df, year_label):
+    from plotly.subplots import make_subplots
+    
+    # Create figure with secondary y-axis
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    
+    # Add bar chart for usage
+    fig.add_trace(
+        go.Bar(
+            x=df['year'], 
+            y=df['usage'], 
+            name="Water Usage",
+            marker_color='#AB2330',
+            hovertemplate='Year: %{x}<br>Usage: %{y:,.0f} cubic feet<extra></extra>'
+        ),
+        secondary_y=False,
+    )
+    
+    # Add line chart for cost
+    fig.add_trace(
+        go.Scatter(
+            x=df['year'], 
+            y=df['cost'], 
+            name="Water Cost",
+            line=dict(color='#EF4444', width=3),
+            hovertemplate='Year: %{x}<br>Cost: $%{y:,.2f}<extra></extra>'
+        ),
+        secondary_y=True,
+    )
+    
+    # Set titles and labels
+    fig.update_layout(
+        title=f"Water Usage and Cost ({year_label})",
+        hovermode="x unified",
+        hoverlabel=dict(bgcolor="white", font_size=12),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        height=500,
+        margin=dict(l=60, r=60, t=80, b=60),
+        plot_bgcolor='rgba(245,250,255,0.5)'
+    )
+    
+    # Update axes
+    fig.update_xaxes(
+        title_text="Year",
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        tickmode='linear'
+    )
+    
+    fig.update_yaxes(
+        title_text="Water Usage (cubic feet)",
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        tickformat=",.0f",
+        secondary_y=False
+    )
+    
+    fig.update_yaxes(
+        title_text="Cost ($)",
+        showgrid=False,
+        tickprefix="$",
+        tickformat=",.2f",
+        secondary_y=True
+    )
+    
+    return fig
+
+
+def usage_figure(df, year_label, forecast=None, anomalies=None):
+    import plotly.express as px
+    
+    # Create interactive bar chart for usage
+    fig = px.bar(
+        df,
+        x='year',
+        y='usage',
+        title=f'Annual Water Usage ({year_label})',
+        labels={'year': 'Year', 'usage': 'Water Usage (cubic feet)'},
+        color_discrete_sequence=['#7851A9'],
+        text_auto='.2s'
+    )
+    
+    # Customize layout
+    fig.update_layout(
+        hovermode="x unified",
+        hoverlabel=dict(bgcolor="white", font_size=12),
+        height=500,
+        margin=dict(l=60, r=60, t=80, b=60),
+        plot_bgcolor='rgba(245,250,255,0.5)'
+    )
+    
+    fig.update_traces(
+        hovertemplate='Year: %{x}<br>Usage: %{y:,.0f} cubic feet<extra></extra>',
+        textposition='outside'
+    )
+    
+    if forecast is not None:
+        add_forecast(fig, forecast, 'rgba(120, 81, 169, 1)', ',.0f')
+    
+    if anomalies is not None:
+        add_anomaly_counts(fig, df, anomalies)
+    
+    fig.update_xaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        tickmode='linear'
+    )
+    
+    fig.update_yaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        tickformat=",.0f"
+    )
+    
+    return fig
+
+
+def cost_figure(df, year_label, forecast=None):
+    import plotly.express as px
+    
+    # Create line chart for cost
+    fig = px.line(
+        df,
+        x='year',
+        y='cost',
+        title=f'Annual Water Cost ({year_label})',
+        labels={'year': 'Year', 'cost': 'Cost ($)'},
+        markers=True
+    )
+    
+    # Customize layout
+    fig.update_layout(
+        hovermode="x unified",
+        hoverlabel=dict(bgcolor="white", font_size=12),
+        height=500,
+        margin=dict(l=60, r=60, t=80, b=60),
+        plot_bgcolor='rgba(245,250,255,0.5)'
+    )
+    
+    fig.update_traces(
+        line=dict(color='#EF4444', width=3),
+        marker=dict(size=8, color='#EF4444'),
+        hovertemplate='Year: %{x}<br>Cost: $%{y:,.2f}<extra></extra>'
+    )
+    
+    if forecast is not None:
+        add_forecast(fig, forecast, 'rgba(239, 68, 68, 1)', '$,.2f')
+    
+    fig.update_xaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        tickmode='linear'
+    )
+    
+    fig.update_yaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        tickprefix="$",
+        tickformat=",.2f"
+    )
+    
+    return fig
+
+
+def tariff_comparison_figure(actual, scenario, year_label, tariff_name):
+    # Grouped bars of the metered annual cost next to the same usage billed under a tariff
+    fig = go.Figure()
+    
+    fig.add_trace(go.Bar(
+        x=actual['year'],
+        y=actual['cost'],
+        name='Actual cost',
+        marker_color='#EF4444',
+        hovertemplate='Year: %{x}<br>Actual: $%{y:,.2f}<extra></extra>'
+    ))
+    
+    fig.add_trace(go.Bar(
+        x=scenario['year'],
+        y=scenario['cost'],
+        name=tariff_name,
+        marker_color='#3B82F6',
+        hovertemplate='Year: %{x}<br>Scenario: $%{y:,.2f}<extra></extra>'
+    ))
+    
+    fig.update_layout(
+        title=f'Actual Cost vs {tariff_name} ({year_label})',
+        xaxis_title='Year',
+        yaxis_title='Cost ($)',
+        barmode='group',
+        hovermode="x unified",
+        hoverlabel=dict(bgcolor="white", font_size=12),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        height=400,
+        margin=dict(l=60, r=60, t=80, b=60),
+        plot_bgcolor='rgba(245,250,255,0.5)'
+    )
+    
+    fig.update_xaxes(tickmode='linear')
+    fig.update_yaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        tickprefix="$",
+        tickformat=",.0f"
+    )
+    
+    return fig
+
+
+def readings_figure(readings, column, year_label, budget=DEFAULT_POINT_BUDGET, method='lttb', anomalies=None,
+                    resolution=None):
+    # Downsample to the point budget so peaks survive without shipping every reading.
+    # `readings` may also be rolled-up buckets, named by `resolution` (e.g. 'daily means').
+    positions = downsample(
+        readings.index.to_numpy().astype('int64'),
+        readings[column].to_numpy(),
+        budget,
+        method
+    )
+    scatter = go.Scattergl if len(positions) > WEBGL_MIN_POINTS else go.Scatter
+    
+    if column == 'usage':
+        title = 'Water Usage per Reading'
+        color = '#7851A9'
+        hovertemplate = '%{x}<br>Usage: %{y:,.0f} cubic feet<extra></extra>'
+        yaxis = dict(title_text='Water Usage (cubic feet)', tickformat=",.0f")
+    else:
+        title = 'Water Cost per Reading'
+        color = '#EF4444'
+        hovertemplate = '%{x}<br>Cost: $%{y:,.2f}<extra></extra>'
+        yaxis = dict(title_text='Cost ($)', tickprefix="$", tickformat=",.2f")
+    
+    fig = go.Figure(
+        scatter(
+            x=readings.index[positions],
+            y=readings[column].to_numpy()[positions],
+            mode='lines',
+            line=dict(color=color, width=1.5),
+            hovertemplate=hovertemplate
+        )
+    )
+    
+    if anomalies is not None:
+        fig.data[0].showlegend = False
+        add_anomaly_periods(fig, anomalies, readings, column)
+    
+    if resolution is not None:
+        title = f"{title}, {resolution}"
+    
+    fig.update_layout(
+        title=f"{title} ({year_label})",
+        hovermode="x unified",
+        hoverlabel=dict(bgcolor="white", font_size=12),
+        height=500,
+        margin=dict(l=60, r=60, t=80, b=60),
+        plot_bgcolor='rgba(245,250,255,0.5)'
+    )
+    
+    fig.update_xaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)'
+    )
+    
+    fig.update_yaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        **yaxis
+    )
+    
+    return fig
+
+
+def live_figure(timestamps, usage, cost):
+    # Latest readings' usage and cost for live mode, cost on a second axis
+    from plotly.subplots import make_subplots
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    
+    fig.add_trace(
+        go.Scattergl(
+            x=timestamps,
+            y=usage,
+            name='Water Usage',
+            mode='lines',
+            line=dict(color='#7851A9', width=1.5),
+            hovertemplate='%{x}<br>Usage: %{y:,.0f} cubic feet<extra></extra>'
+        ),
+        secondary_y=False
+    )
+    
+    fig.add_trace(
+        go.Scattergl(
+            x=timestamps,
+            y=cost,
+            name='Cost',
+            mode='lines',
+            line=dict(color='#EF4444', width=1.5),
+            hovertemplate='%{x}<br>Cost: $%{y:,.2f}<extra></extra>'
+        ),
+        secondary_y=True
+    )
+    
+    fig.update_layout(
+        title='Latest Readings',
+        hovermode="x unified",
+        hoverlabel=dict(bgcolor="white", font_size=12),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        height=400,
+        margin=dict(l=60, r=60, t=80, b=60),
+        plot_bgcolor='rgba(245,250,255,0.5)',
+        # Keeps the zoom and legend state across refreshes
+        uirevision='live'
+    )
+    
+    fig.update_yaxes(title_text="Water Usage (cubic feet)", tickformat=",.0f", secondary_y=False)
+    fig.update_yaxes(title_text="Cost ($)", tickprefix="$", tickformat=",.2f", secondary_y=True)
+    
+    return fig
+
+
+def cluster_shapes_figure(starts, shapes, sizes, label):
+    # Each meter cluster's typical usage per period, relative to its members' own average,
+    # so clusters of large and small meters with the same pattern line up
+    fig = go.Figure()
+    
+    for cluster, (shape, size) in enumerate(zip(shapes, sizes)):
+        fig.add_trace(go.Scatter(
+            x=starts,
+            y=shape,
+            name=f'Cluster {cluster + 1} ({size:,} meters)',
+            mode='lines',
+            line=dict(width=2),
+            hovertemplate=f'Cluster {cluster + 1}<br>%{{x}}<br>%{{y:.2f}}× average<extra></extra>'
+        ))
+    
+    fig.add_hline(y=1, line_dash='dot', line_color='gray')
+    fig.update_layout(
+        title=f'Typical {label.capitalize()} by Meter Cluster',
+        xaxis_title='Period',
+        yaxis_title='Usage relative to the meter\'s average',
+        hovermode="x unified",
+        hoverlabel=dict(bgcolor="white", font_size=12),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        height=400,
+        margin=dict(l=60, r=60, t=80, b=60),
+        plot_bgcolor='rgba(245,250,255,0.5)'
+    )
+    
+    fig.update_yaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        tickformat=".2f"
+    )
+    
+    return fig
+
+
+def cost_per_unit_figure(df, year_label, forecast=None):
+    import plotly.express as px
+    
+    # Create line chart for cost per unit
+    fig = px.line(
+        df,
+        x='year',
+        y='costPerUnit',
+        title=f'Cost per Cubic Foot ({year_label})',
+        labels={'year': 'Year', 'costPerUnit': 'Cost per Cubic Foot ($)'},
+        markers=True
+    )
+    
+    # Add a trendline
+    fig.add_trace(
+        go.Scatter(
+            x=df['year'],
+            y=linear_trend(df['year'], df['costPerUnit']),
+            mode='lines',
+            line=dict(color='rgba(255, 99, 132, 0.3)', width=2, dash='dash'),
+            name='Trend',
+            hoverinfo='skip'
+        )
+    )
+    
+    # Customize layout
+    fig.update_layout(
+        hovermode="x unified",
+        hoverlabel=dict(bgcolor="white", font_size=12),
+        height=500,
+        margin=dict(l=60, r=60, t=80, b=60),
+        plot_bgcolor='rgba(245,250,255,0.5)'
+    )
+    
+    fig.update_traces(
+        selector=dict(name='costPerUnit'),
+        line=dict(color='#10B981', width=3),
+        marker=dict(size=8, color='#10B981'),
+        hovertemplate='Year: %{x}<br>Cost per Cubic Foot: $%{y:.4f}<extra></extra>'
+    )
+    
+    if forecast is not None:
+        add_forecast(fig, forecast, 'rgba(16, 185, 129, 1)', '$.4f')
+    
+    fig.update_xaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        tickmode='linear'
+    )
+    
+    fig.update_yaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        tickprefix="$",
+        tickformat=".4f"
+    )
+    
+    return fig
+
+
+def year_over_year_figure(df):
+    # Create a year-over-year change chart
+    # Filter out the first year since it has no previous year for comparison
+    yoy_df = df.dropna()
+    
+    # Create the figure
+    fig = go.Figure()
+    
+    # Add usage change bars
+    fig.add_trace(go.Bar(
+        x=yoy_df['year'],
+        y=yoy_df['usage_change'],
+        name='Usage Change (%)',
+        marker_color='#AB2330',
+        hovertemplate='Year: %{x}<br>Usage Change: %{y:.1f}%<extra></extra>'
+    ))
+    
+    # Add cost change bars
+    fig.add_trace(go.Bar(
+        x=yoy_df['year'],
+        y=yoy_df['cost_change'],
+        name='Cost Change (%)',
+        marker_color='#AB2330',
+        hovertemplate='Year: %{x}<br>Cost Change: %{y:.1f}%<extra></extra>'
+    ))
+    
+    # Add zero line
+    fig.add_shape(
+        type="line",
+        x0=yoy_df['year'].min() - 0.5,
+        x1=yoy_df['year'].max() + 0.5,
+        y0=0,
+        y1=0,
+        line=dict(color="gray", width=1, dash="dash"),
+    )
+    
+    # Update layout
+    fig.update_layout(
+        title='Year-over-Year Percentage Changes',
+        xaxis_title='Year',
+        yaxis_title='Change (%)',
+        barmode='group',
+        hovermode="x unified",
+        hoverlabel=dict(bgcolor="white", font_size=12),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        height=400,
+        margin=dict(l=60, r=60, t=80, b=60),
+        plot_bgcolor='rgba(245,250,255,0.5)'
+    )
+    
+    fig.update_xaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        tickmode='linear'
+    )
+    
+    fig.update_yaxes(
+        showgrid=True,
+        gridwidth=1,
+        gridcolor='rgba(211,211,211,0.5)',
+        ticksuffix="%"
+    )
+    
+    return fig
@@ -0,0 +1,351 @@
+import numpy as np
+import pandas as pd
+
+from figure_cache import LRUCache
+
+FORECAST_METHODS = {
+    'linear': 'Linear trend',
+    'damped': 'Damped trend',
+    'seasonal': 'Seasonal exponential smoothing'
+}
+
+DEFAULT_HORIZON = 3
+
+# Half-width of the forecast bands in standard errors (a central 80% interval)
+BAND_Z = 1.2816
+
+# Months per season for the seasonal model, which is fitted on monthly totals
+SEASON_LENGTH = 12
+
+# Relative difference allowed between the reading-level and yearly totals of a column
+# before the seasonal model treats the readings as someone else's, e.g. the metered costs
+# behind a tariff scenario; covers the yearly totals' rounding to whole units and cents
+SERIES_TOLERANCE = 0.01
+
+# Smoothing parameters tried for every series; each series keeps the combination with the
+# smallest one-step-ahead squared error
+ALPHAS = [0.1, 0.3, 0.5, 0.7, 0.9]
+BETAS = [0.05, 0.1, 0.2, 0.4]
+GAMMAS = [0.05, 0.2, 0.4]
+PHIS = [0.8, 0.9, 0.98]
+
+# Series fitted per batch; bounds the (parameter combinations x series) working arrays
+FIT_CHUNK_SERIES = 4096
+
+FORECAST_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def series_matrix(values, counts, years=None):
+    # Series stored back to back (each `count` long, in order) as the rows of one matrix,
+    # right-aligned so every series ends in the last column, with NaN before its start.
+    # With `years`, each value sits at its year's offset from the series' last year, so
+    # missing years are NaN gaps rather than closed up.
+    counts = np.asarray(counts, dtype='int64')
+    rows = np.repeat(np.arange(len(counts)), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    if years is None:
+        width = int(counts.max()) if len(counts) else 0
+        columns = width - counts[rows] + (np.arange(len(rows)) - starts)
+    else:
+        years = np.asarray(years, dtype='int64')
+        ends = np.cumsum(counts) - 1
+        spans = years[ends] - years[ends - counts + 1] + 1
+        width = int(spans.max()) if len(counts) else 0
+        columns = width - 1 - (years[ends][rows] - years)
+    matrix = np.full((len(counts), width), np.nan)
+    matrix[rows, columns] = values
+    return matrix
+
+
+def fit_linear(y):
+    # Least-squares line through each row's observed (non-NaN) columns
+    observed = ~np.isnan(y)
+    x = np.arange(y.shape[1], dtype='float64')
+    count = observed.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.where(observed, x, 0.0).sum(axis=1) / count
+        y_mean = np.where(observed, y, 0.0).sum(axis=1) / count
+        dx = np.where(observed, x - x_mean[:, None], 0.0)
+        dy = np.where(observed, y - y_mean[:, None], 0.0)
+        sxx = (dx ** 2).sum(axis=1)
+        slope = np.where(sxx > 0, (dx * dy).sum(axis=1) / sxx, 0.0)
+        intercept = y_mean - slope * x_mean
+        residuals = np.where(observed, y - (intercept[:, None] + slope[:, None] * x), 0.0)
+        sigma = np.where(count > 2, np.sqrt((residuals ** 2).sum(axis=1) / (count - 2)), np.nan)
+    return {
+        'slope': slope,
+        'intercept': intercept,
+        'x_mean': x_mean,
+        'sxx': sxx,
+        'count': count,
+        'sigma': sigma,
+        'last_x': np.full(len(y), y.shape[1] - 1, dtype='float64')
+    }
+
+
+def linear_trend(x, y):
+    # In-sample least-squares line for one series, e.g. a chart's trend line, fitted
+    # against the years themselves, so a missing year doesn't bend it
+    x = np.asarray(x, dtype='int64')
+    fit = fit_linear(series_matrix(np.asarray(y, dtype='float64'), [len(x)], x))
+    return fit['intercept'][0] + fit['slope'][0] * (x - x[0])
+
+
+def _damped_sums(phi, steps):
+    # phi + phi**2 + ... + phi**h for every h in steps
+    return np.cumsum(phi[..., None] ** np.arange(1, steps.max() + 1), axis=-1)[..., steps - 1]
+
+
+def _grid(*values):
+    return [grid.ravel() for grid in np.meshgrid(*values, indexing='ij')]
+
+
+def _run_damped(y, alpha, beta, phi):
+    # Additive damped-trend exponential smoothing (error-correction form) for every
+    # parameter combination (rows of alpha/beta/phi) and every series (rows of y) at once.
+    # Each series starts at its first observation: level y0, then trend y1 - y0.
+    combos, (count, width) = len(alpha), y.shape
+    alpha, beta, phi = alpha[:, None], beta[:, None], phi[:, None]
+    level = np.zeros((combos, count))
+    trend = np.zeros((combos, count))
+    sse = np.zeros((combos, count))
+    seen = np.zeros(count, dtype='int64')
+    for t in range(width):
+        observed = y[:, t]
+        valid = ~np.isnan(observed)
+        first = valid & (seen == 0)
+        second = valid & (seen == 1)
+        later = valid & (seen >= 2)
+        # A missing year within the series moves the states on a step with nothing to correct
+        missing = ~valid & (seen >= 2)
+
+        level[:, first] = observed[first]
+        trend[:, second] = observed[second] - level[:, second]
+        level[:, second] = observed[second]
+
+        predicted = level[:, later] + phi * trend[:, later]
+        error = observed[later] - predicted
+        sse[:, later] += error ** 2
+        level[:, later] = predicted + alpha * error
+        trend[:, later] = phi * trend[:, later] + alpha * beta * error
+        level[:, missing] += phi * trend[:, missing]
+        trend[:, missing] *= phi
+        seen += valid
+    return level, trend, sse, np.maximum(seen - 2, 0)
+
+
+def _run_seasonal(y, alpha, beta, gamma, phi, season):
+    # Additive Holt-Winters with a damped trend, for every parameter combination and series.
+    # Rows need at least two full seasons; the first two initialize level, trend and the
+    # seasonal indices, and the recursion runs from the second season on.
+    combos, (count, width) = len(alpha), y.shape
+    alpha, beta, gamma, phi = alpha[:, None], beta[:, None], gamma[:, None], phi[:, None]
+    rows = np.arange(count)
+    start = np.argmax(~np.isnan(y), axis=1)
+    positions = np.minimum(start[:, None] + np.arange(2 * season), width - 1)
+    first, second = np.split(np.take_along_axis(y, positions, axis=1), 2, axis=1)
+
+    level = np.broadcast_to(first.mean(axis=1), (combos, count)).copy()
+    trend = np.broadcast_to((second.mean(axis=1) - first.mean(axis=1)) / season, (combos, count)).copy()
+    seasonal = np.broadcast_to(first - first.mean(axis=1)[:, None], (combos, count, season)).copy()
+    sse = np.zeros((combos, count))
+    fitted = np.zeros(count, dtype='int64')
+    for t in range(width):
+        active = t >= start + season
+        if not active.any():
+            continue
+        position = (t - start) % season
+        index = seasonal[:, rows, position]
+        predicted = level + phi * trend + index
+        error = np.where(active, y[:, t] - predicted, 0.0)
+        sse += error ** 2
+        level = np.where(active, level + phi * trend + alpha * error, level)
+        trend = np.where(active, phi * trend + alpha * beta * error, trend)
+        seasonal[:, rows, position] = np.where(active, index + gamma * error, index)
+        fitted += active
+    return level, trend, seasonal, sse, fitted, start
+
+
+def _best(sse, states, params):
+    # Per series, the final states and parameters of its lowest-error combination
+    best = np.argmin(sse, axis=0)
+    columns = np.arange(sse.shape[1])
+    chosen = {name: state[best, columns] for name, state in states.items()}
+    chosen.update({name: values[best] for name, values in params.items()})
+    chosen['sse'] = sse[best, columns]
+    return chosen
+
+
+def _concat(parts):
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def _sigma(sse, errors):
+    # Standard deviation of the one-step-ahead errors; NaN with too few to estimate it
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(errors > 1, np.sqrt(sse / np.maximum(errors - 1, 1)), np.nan)
+
+
+def fit_damped(y):
+    alpha, beta, phi = _grid(ALPHAS, BETAS, PHIS)
+    parts = []
+    for lo in range(0, len(y), FIT_CHUNK_SERIES):
+        level, trend, sse, errors = _run_damped(y[lo:lo + FIT_CHUNK_SERIES], alpha, beta, phi)
+        part = _best(sse, {'level': level, 'trend': trend}, {'alpha': alpha, 'beta': beta, 'phi': phi})
+        part['errors'] = errors
+        parts.append(part)
+    fit = _concat(parts)
+    fit['sigma'] = _sigma(fit.pop('sse'), fit.pop('errors'))
+    return fit
+
+
+def fit_seasonal(y, season=SEASON_LENGTH):
+    alpha, beta, gamma, phi = _grid(ALPHAS, BETAS, GAMMAS, PHIS)
+    parts = []
+    for lo in range(0, len(y), FIT_CHUNK_SERIES):
+        chunk = y[lo:lo + FIT_CHUNK_SERIES]
+        level, trend, seasonal, sse, errors, start = _run_seasonal(chunk, alpha, beta, gamma, phi, season)
+        part = _best(
+            sse,
+            {'level': level, 'trend': trend, 'seasonal': seasonal},
+            {'alpha': alpha, 'beta': beta, 'gamma': gamma, 'phi': phi}
+        )
+        part['errors'] = errors
+        # Position in the season of the first forecast step
+        part['phase'] = (chunk.shape[1] - start) % season
+        parts.append(part)
+    fit = _concat(parts)
+    fit['sigma'] = _sigma(fit.pop('sse'), fit.pop('errors'))
+    return fit
+
+
+def forecast_paths(method, fit, row, steps):
+    # Point forecasts and standard errors of one fitted series, `steps` periods ahead
+    if method == 'linear':
+        x = fit['last_x'][row] + steps
+        point = fit['intercept'][row] + fit['slope'][row] * x
+        with np.errstate(invalid='ignore', divide='ignore'):
+            spread = 1 + 1 / fit['count'][row] + (x - fit['x_mean'][row]) ** 2 / fit['sxx'][row]
+        return point, fit['sigma'][row] * np.sqrt(spread)
+
+    alpha, beta, phi = fit['alpha'][row], fit['beta'][row], fit['phi'][row]
+    sums = _damped_sums(np.asarray(phi), steps)
+    point = fit['level'][row] + sums * fit['trend'][row]
+
+    # Variance grows with the squared weights c_j = alpha * (1 + beta * phi_j) of the
+    # earlier forecast errors, plus gamma once per full season for the seasonal model
+    weights = alpha * (1 + beta * np.concatenate([[0.0], sums[:-1]]))
+    if method == 'seasonal':
+        season = fit['seasonal'].shape[1]
+        point = point + fit['seasonal'][row][(fit['phase'][row] + steps - 1) % season]
+        weights = weights + fit['gamma'][row] * ((steps - 1) % season == 0) * (steps > 1)
+    weights[0] = 0.0
+    return point, fit['sigma'][row] * np.sqrt(1 + np.cumsum(weights ** 2))
+
+
+class FittedSeries:
+    # Fitted models for every series of one column: parameters and final states as arrays
+    # with one entry per series, so thousands of meters cost one batched fit. Annual models
+    # forecast whole years; the seasonal model is fitted on monthly totals and its monthly
+    # forecasts are summed into years.
+
+    def __init__(self, method, keys, last_periods, fit, monthly=False):
+        self.method = method
+        self.rows = {key: row for row, key in enumerate(keys)}
+        self.last_periods = last_periods
+        self.fit = fit
+        self.monthly = monthly
+
+    def nbytes(self):
+        return sum(array.nbytes for array in self.fit.values())
+
+    def forecast(self, key, horizon):
+        # Frame of year, forecast, lower and upper for the `horizon` years after the series' last
+        row = self.rows.get(key)
+        if row is None:
+            return None
+
+        last = self.last_periods[row]
+        if not self.monthly:
+            steps = np.arange(1, horizon + 1)
+            point, error = forecast_paths(self.method, self.fit, row, steps)
+            years = int(last) + steps
+        else:
+            # Months up to the end of the last forecast year; those still in the last observed
+            # year are dropped, and variances of the rest are summed per year
+            months_left = 12 - last.month
+            steps = np.arange(1, months_left + 12 * horizon + 1)
+            monthly_point, monthly_error = forecast_paths(self.method, self.fit, row, steps)
+            target = (np.arange(len(steps)) - months_left) // 12
+            keep = target >= 0
+            point = np.bincount(target[keep], weights=monthly_point[keep], minlength=horizon)
+            error = np.sqrt(np.bincount(target[keep], weights=monthly_error[keep] ** 2, minlength=horizon))
+            years = last.year + 1 + np.arange(horizon)
+
+        # Usage, cost and unit price can't go below zero, whatever the band width
+        return pd.DataFrame({
+            'year': years,
+            'forecast': point,
+            'lower': np.maximum(point - BAND_Z * error, 0.0),
+            'upper': point + BAND_Z * error
+        })
+
+
+def fit_matrix(method, y):
+    if method == 'linear':
+        return fit_linear(y)
+    if method == 'seasonal':
+        return fit_seasonal(y)
+    return fit_damped(y)
+
+
+def fitted_method(method, dataset, level, column):
+    # The seasonal model needs monthly totals, which exist for the whole portfolio of
+    # timestamped data only, and it isn't used for the cost per unit, a ratio of totals.
+    # Elsewhere it falls back to the damped trend model.
+    if method != 'seasonal':
+        return method
+    if level == 'all' and column != 'costPerUnit' and dataset.series is not None:
+        monthly = dataset.series.index.to_period('M').nunique()
+        if monthly >= 2 * SEASON_LENGTH and series_matches(dataset, column):
+            return method
+    return 'damped'
+
+
+def series_matches(dataset, column, tolerance=SERIES_TOLERANCE):
+    # Whether the reading-level totals add up to the dataset's own yearly totals, e.g. not
+    # the metered costs behind a re-priced dataset; only then are their months fitted
+    series = dataset.series[column]
+    totals = series.groupby(series.index.year).sum()
+    expected = dataset.df.set_index(dataset.df['year'].astype('int64'))[column].reindex(totals.index)
+    return bool(np.allclose(totals.to_numpy(), expected.to_numpy(dtype='float64'), rtol=tolerance, atol=1.0))
+
+
+def fit_view(dataset, level, column, method):
+    # Fit every series at one selection level of a dataset in a single batch
+    method = fitted_method(method, dataset, level, column)
+    if method == 'seasonal':
+        monthly = dataset.series[column].resample('MS').sum()
+        fit = fit_matrix(method, monthly.to_numpy(dtype='float64')[None, :])
+        return FittedSeries(method, [None], [monthly.index[-1]], fit, monthly=True)
+
+    if level == 'all':
+        frame, keys, counts = dataset.df, [None], [len(dataset.df)]
+    else:
+        rollups = dataset.rollups
+        frame = rollups.frames[level]
+        keys = list(rollups.spans[level])
+        counts = [stop - start for start, stop in rollups.spans[level].values()]
+    y = series_matrix(frame[column].to_numpy(dtype='float64'), counts, frame['year'].to_numpy())
+    ends = np.cumsum(counts) - 1
+    return FittedSeries(method, keys, frame['year'].to_numpy()[ends], fit_matrix(method, y))
+
+
+class ForecastCache(LRUCache):
+    # Fitted models keyed by dataset version, level, column and method; sized by their arrays
+
+    def size_of(self, value):
+        return value.nbytes()
+
+
+FORECASTS = ForecastCache(FORECAST_CACHE_BYTES)
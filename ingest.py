@@ -0,0 +1,489 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import pandas as pd
+
+from data_sources import READING_COLUMNS, default_source, dtypes_for
+from dataset_store import STORE
+
+# Background ingestion of new readings from a metering head-end's HTTP API. A poll asks
+# for every reading after the newest one already loaded, one page at a time: the first
+# page says how many pages there are, the rest are fetched concurrently over a small pool
+# of keep-alive connections and appended to the shared dataset store in page order. The
+# service runs its own asyncio event loop on a daemon thread, so dashboard reruns only
+# ever see the latest published dataset version and never wait on the network.
+#
+# The API is expected to answer GET <url>?since=<ISO timestamp>&page=<n>&page_size=<k>
+# with {"pages": <page count>, "readings": [{"timestamp": ..., "site": ..., "usage": ...,
+# "cost": ...}, ...]}, readings ordered by timestamp. A stub server answering the same
+# way runs locally for testing:
+#
+#     python ingest.py stub --port 8765
+#     WATER_USAGE_API_URL=http://127.0.0.1:8765/readings streamlit run app.py
+
+# Environment variables that turn on background ingestion and set its polling interval
+API_URL_ENV = 'WATER_USAGE_API_URL'
+API_INTERVAL_ENV = 'WATER_USAGE_API_INTERVAL'
+
+DEFAULT_INTERVAL = 60.0
+DEFAULT_PAGE_SIZE = 5000
+
+# Open connections per API host
+DEFAULT_CONNECTIONS = 4
+
+# Pages fetched but not yet appended; fetching pauses once this many are waiting, so a
+# slow store can't make the service buffer an unbounded backlog
+DEFAULT_PENDING_PAGES = 8
+
+# Readings appended to the store at once; each append publishes a dataset version
+DEFAULT_BATCH_ROWS = 50_000
+
+# Attempts per page, with exponential backoff and jitter between them
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+DEFAULT_TIMEOUT = 30.0
+
+# Statuses worth retrying: rate limiting and server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger('water_usage.ingest')
+
+
+class ConnectionPool:
+    # Keep-alive HTTP/1.1 connections to one host, at most `size` in use at once
+
+    def __init__(self, host, port, size=DEFAULT_CONNECTIONS):
+        self.host = host
+        self.port = port
+        self.idle = []
+        self.slots = asyncio.Semaphore(size)
+        self.opened = 0
+
+    async def get(self, target, timeout=DEFAULT_TIMEOUT):
+        # (status, headers, body) of a GET request
+        async with self.slots:
+            connection = self.idle.pop() if self.idle else None
+            if connection is None:
+                connection = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+                self.opened += 1
+            try:
+                status, headers, body, reusable = await asyncio.wait_for(self._exchange(connection, target), timeout)
+            except BaseException:
+                connection[1].close()
+                raise
+            if reusable:
+                self.idle.append(connection)
+            else:
+                connection[1].close()
+            return status, headers, body
+
+    async def _exchange(self, connection, target):
+        reader, writer = connection
+        writer.write(
+            f"GET {target} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+            "Accept: application/json\r\nConnection: keep-alive\r\n\r\n".encode('latin-1')
+        )
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("The API closed the connection")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        reusable = headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            parts = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                parts.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b''.join(parts)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            reusable = False
+        return status, headers, body, reusable
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle.clear()
+
+
+def readings_frame(records):
+    # Readings from an API page, with the dtypes used for loaded files
+    readings = pd.DataFrame.from_records(records)
+    columns = [column for column in READING_COLUMNS if column in readings.columns]
+    missing = {'timestamp', 'usage', 'cost'} - set(columns)
+    if len(readings) and missing:
+        raise ValueError(f"API readings are missing required fields: {', '.join(sorted(missing))}")
+    readings = readings[columns].astype(dtypes_for(columns))
+    if 'timestamp' in readings.columns:
+        readings['timestamp'] = pd.to_datetime(readings['timestamp'])
+    return readings
+
+
+class IngestionService:
+    # Polls the API for readings newer than the source's dataset and appends them to the
+    # shared store. status() is safe to call from any thread.
+
+    def __init__(self, source, url, interval=DEFAULT_INTERVAL, page_size=DEFAULT_PAGE_SIZE,
+                 connections=DEFAULT_CONNECTIONS, pending_pages=DEFAULT_PENDING_PAGES,
+                 batch_rows=DEFAULT_BATCH_ROWS, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 timeout=DEFAULT_TIMEOUT, store=STORE):
+        parts = urlsplit(url)
+        if parts.scheme != 'http' or not parts.hostname:
+            raise ValueError(f"Unsupported API URL '{url}'. Expected http://host[:port]/path")
+        self.source = source
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or '/'
+        self.interval = interval
+        self.page_size = page_size
+        self.connections = connections
+        self.pending_pages = pending_pages
+        self.batch_rows = batch_rows
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.store = store
+
+        # Newest reading already in the store; polls ask for anything after it
+        series = store.get(source).series
+        self.cursor = series.index[-1] if series is not None and len(series) else None
+
+        self.stopping = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.counters = {
+            'polls': 0,
+            'pages': 0,
+            'readings': 0,
+            'retries': 0,
+            'errors': 0,
+            'last_poll': None,
+            'last_error': None,
+            'version': None
+        }
+
+    def status(self):
+        with self.lock:
+            return dict(self.counters, cursor=self.cursor, running=self.thread is not None and self.thread.is_alive())
+
+    def _add(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                self.counters[name] += count
+
+    def _set(self, **values):
+        with self.lock:
+            self.counters.update(values)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='water-usage-ingest', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def _run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        pool = ConnectionPool(self.host, self.port, self.connections)
+        try:
+            while not self.stopping.is_set():
+                try:
+                    await self.poll(pool)
+                except Exception as error:
+                    # The next poll resumes after the last appended reading
+                    logger.warning("Ingestion poll failed: %s", error)
+                    self._add(errors=1)
+                    self._set(last_error=str(error))
+                await asyncio.to_thread(self.stopping.wait, self.interval)
+        finally:
+            pool.close()
+
+    def target(self, since, page):
+        query = {'page': page, 'page_size': self.page_size}
+        if since is not None:
+            query['since'] = since.isoformat()
+        return f"{self.path}?{urlencode(query)}"
+
+    async def fetch_page(self, pool, since, page):
+        # One page of readings, retried on connection errors, timeouts and 429/5xx answers
+        target = self.target(since, page)
+        for attempt in range(self.retries):
+            retry_after = None
+            try:
+                status, headers, body = await pool.get(target, self.timeout)
+                if status == 200:
+                    payload = json.loads(body)
+                    return int(payload.get('pages', 1)), readings_frame(payload.get('readings', []))
+                if status not in RETRY_STATUSES:
+                    raise ValueError(f"{self.url} answered page {page} with HTTP {status}")
+                error = ConnectionError(f"{self.url} answered page {page} with HTTP {status}")
+                retry_after = headers.get('retry-after')
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as failure:
+                error = failure
+            if attempt + 1 == self.retries:
+                raise error
+            self._add(retries=1)
+            delay = min(MAX_BACKOFF, self.backoff * 2 ** attempt) * (0.5 + random.random())
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            await asyncio.sleep(delay)
+
+    async def poll(self, pool):
+        # Fetches everything after the cursor and appends it in page order. Returns the
+        # number of readings appended. Pages are numbered from the cursor the poll started
+        # at, even once earlier pages have been appended.
+        self._add(polls=1)
+        self._set(last_poll=time.time())
+        with self.lock:
+            since = self.cursor
+        pages, first = await self.fetch_page(pool, since, 1)
+        self._add(pages=1)
+
+        # A page is only requested once there is room for it among the pending pages
+        room = asyncio.Semaphore(self.pending_pages)
+        fetches = asyncio.Queue()
+
+        async def request_pages():
+            for page in range(2, pages + 1):
+                await room.acquire()
+                fetches.put_nowait(asyncio.create_task(self.fetch_page(pool, since, page)))
+
+        requester = asyncio.create_task(request_pages())
+        batch = [first]
+        appended = 0
+        try:
+            for _ in range(2, pages + 1):
+                fetch = await fetches.get()
+                _, readings = await fetch
+                room.release()
+                self._add(pages=1)
+                batch.append(readings)
+                if sum(len(readings) for readings in batch) >= self.batch_rows:
+                    appended += await self.append(batch)
+                    batch = []
+            appended += await self.append(batch)
+        finally:
+            # After a failed page, the pages already requested are abandoned
+            requester.cancel()
+            abandoned = [requester]
+            while not fetches.empty():
+                abandoned.append(fetches.get_nowait())
+                abandoned[-1].cancel()
+            await asyncio.gather(*abandoned, return_exceptions=True)
+        return appended
+
+    async def append(self, batch):
+        batch = [readings for readings in batch if len(readings)]
+        if not batch:
+            return 0
+        readings = pd.concat(batch, ignore_index=True)
+        # Appending rebuilds the dataset's aggregates; off the event loop so fetches continue
+        dataset = await asyncio.to_thread(self.store.append, self.source, readings)
+        with self.lock:
+            self.cursor = readings['timestamp'].max()
+        self._add(readings=len(readings))
+        self._set(version=dataset.version)
+        return len(readings)
+
+
+# One service per source and URL in this server process
+_services = {}
+_services_lock = threading.Lock()
+
+
+def ingestion_for(source):
+    # The running ingestion service for the source, started on first use, or None when
+    # no API URL is configured
+    url = os.environ.get(API_URL_ENV)
+    if not url:
+        return None
+    key = (source.cache_key()[:2], url)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            interval = float(os.environ.get(API_INTERVAL_ENV, DEFAULT_INTERVAL))
+            service = IngestionService(source, url, interval=interval).start()
+            _services[key] = service
+        return service
+
+
+class StubMeterAPI:
+    # A local stand-in for the head-end API serving a frame of readings, for testing.
+    # `failure_rate` of the requests are answered with 503 and `latency` seconds are added
+    # to every answer. New readings can be added while it runs with extend().
+
+    def __init__(self, readings, host='127.0.0.1', port=0, failure_rate=0.0, latency=0.0, seed=0):
+        self.readings = readings.sort_values('timestamp', ignore_index=True)
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/readings"
+
+    def extend(self, readings):
+        with self.lock:
+            self.readings = pd.concat([self.readings, readings], ignore_index=True).sort_values(
+                'timestamp', ignore_index=True, kind='stable'
+            )
+
+    def page(self, since, page, page_size):
+        with self.lock:
+            readings = self.readings
+        if since is not None:
+            readings = readings.iloc[readings['timestamp'].searchsorted(since, side='right'):]
+        pages = max(1, -(-len(readings) // page_size))
+        rows = readings.iloc[(page - 1) * page_size:page * page_size].copy()
+        rows['timestamp'] = rows['timestamp'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+        return {'pages': pages, 'page': page, 'readings': rows.to_dict('records')}
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with api.lock:
+                    api.requests += 1
+                    fail = api.random.random() < api.failure_rate
+                if api.latency:
+                    time.sleep(api.latency)
+                if fail:
+                    self.send_error(503, "Stub failure")
+                    return
+                query = parse_qs(urlsplit(self.path).query)
+                since = query.get('since', [None])[0]
+                payload = api.page(
+                    pd.Timestamp(since) if since else None,
+                    int(query.get('page', ['1'])[0]),
+                    int(query.get('page_size', [str(DEFAULT_PAGE_SIZE)])[0])
+                )
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except ConnectionError:
+                    # The client gave up on the page, e.g. after another page failed
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='stub-meter-api', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest meter readings from a head-end HTTP API.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    stub = commands.add_parser('stub', help="Serve synthetic readings the way the API does")
+    stub.add_argument('--port', type=int, default=8765)
+    stub.add_argument('--meters', type=int, default=20)
+    stub.add_argument('--days', type=int, default=30, help="Days of hourly readings served")
+    stub.add_argument('--start', default='2024-01-01', help="Timestamp of the first reading")
+    stub.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of requests answered with 503")
+    stub.add_argument('--latency', type=float, default=0.0, help="Seconds added to every answer")
+
+    poll = commands.add_parser('poll', help="Poll the API once into the dashboard's data source and report")
+    poll.add_argument('url')
+    poll.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    poll.add_argument('--connections', type=int, default=DEFAULT_CONNECTIONS)
+    poll.add_argument('--pending-pages', type=int, default=DEFAULT_PENDING_PAGES)
+    poll.add_argument('--retries', type=int, default=DEFAULT_RETRIES)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'stub':
+        from benchmark import synthetic_readings
+        readings = synthetic_readings(args.meters * args.days * 24, args.meters, '1h', start=args.start)
+        api = StubMeterAPI(
+            readings[['timestamp', 'site', 'usage', 'cost']], port=args.port,
+            failure_rate=args.failure_rate, latency=args.latency
+        )
+        print(f"Serving {len(readings):,} readings at {api.url}")
+        try:
+            api.server.serve_forever()
+        except KeyboardInterrupt:
+            api.stop()
+        return 0
+
+    source = default_source()
+    service = IngestionService(
+        source, args.url, page_size=args.page_size, connections=args.connections,
+        pending_pages=args.pending_pages, retries=args.retries
+    )
+
+    async def poll_once():
+        pool = ConnectionPool(service.host, service.port, service.connections)
+        try:
+            return await service.poll(pool), pool.opened
+        finally:
+            pool.close()
+
+    started = time.perf_counter()
+    appended, opened = asyncio.run(poll_once())
+    status = service.status()
+    print(
+        f"Appended {appended:,} readings from {status['pages']} pages in {time.perf_counter() - started:.2f} s "
+        f"over {opened} connections ({status['retries']} retries); dataset v{status['version']}"
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import os
+import threading
+from collections import deque
+
+import numpy as np
+
+from figures import live_figure
+
+# Live mode for wall displays: a panel that refreshes on a timer without rerunning the rest
+# of the dashboard. Every refresh checks the shared store for a newer dataset version, takes
+# only the readings after the newest one already on the chart and appends them to the
+# chart's traces, dropping the oldest once the window is full. The window's totals are
+# updated from the added and dropped readings instead of being summed again.
+#
+# Each session keeps its own window by default. In shared mode (WATER_USAGE_SHARED=1),
+# for servers with many simultaneous sessions such as wall displays, every session on the
+# same source and window size reads one process-wide window instead, so live mode adds no
+# per-session copy of the readings. A shared window never changes a figure a session may
+# still be sending; every refresh with new readings gets a new one.
+
+# Environment variable that turns on shared mode
+SHARED_ENV = 'WATER_USAGE_SHARED'
+
+# Seconds between refreshes offered in the sidebar
+REFRESH_INTERVALS = [2, 5, 10, 30, 60]
+DEFAULT_REFRESH = 5
+
+# Readings kept on the live chart; bounds the memory each session holds for it
+LIVE_WINDOWS = [500, 1000, 2000, 5000, 10000]
+DEFAULT_LIVE_POINTS = 2000
+
+# Updates whose arrivals a window remembers, so a session that missed a few refreshes of a
+# shared window still totals everything that arrived since it last drew
+ARRIVALS_KEPT = 100
+
+# Shared windows by source and window size
+_shared_windows = {}
+_shared_lock = threading.Lock()
+
+
+class LiveWindow:
+    # The latest portfolio readings of one source, their totals and the chart showing
+    # them, kept in a session's state between refreshes (or process-wide in shared mode)
+
+    def __init__(self, source_key, max_points=DEFAULT_LIVE_POINTS, shared=False):
+        self.source_key = source_key
+        self.max_points = max_points
+        self.shared = shared
+        self.version = None
+        self.timestamps = np.empty(0, dtype='datetime64[ns]')
+        self.usage = np.empty(0)
+        self.cost = np.empty(0)
+        self.totals = {'usage': 0.0, 'cost': 0.0}
+        self.added = {'readings': 0, 'usage': 0.0, 'cost': 0.0}
+        # (dataset version, readings added) of the latest updates
+        self.arrivals = deque(maxlen=ARRIVALS_KEPT)
+        self.fig = None
+        # Whether the points changed since the chart last got them
+        self.stale = True
+        # Held while a session updates and reads the window
+        self.lock = threading.Lock()
+
+    def update(self, dataset):
+        # Takes the readings a newer dataset version added; returns how many arrived. The
+        # first update fills the window and counts nothing as arrived.
+        first = self.version is None
+        self.added = {'readings': 0, 'usage': 0.0, 'cost': 0.0}
+        if dataset.version == self.version or dataset.series is None:
+            return 0
+        self.version = dataset.version
+        series = dataset.series
+
+        # Everything after the newest reading on the chart arrived. That reading is taken
+        # again too, since an append can add to it, and only its increase counts.
+        start = 0
+        retaken = (0, 0.0, 0.0)
+        if len(self.timestamps):
+            start = series.index.searchsorted(self.timestamps[-1], side='left')
+            retaken = (1, self.usage[-1], self.cost[-1])
+            self._drop_last()
+        arrived = series.iloc[start:]
+        usage = arrived['usage'].to_numpy(dtype='float64')
+        cost = arrived['cost'].to_numpy(dtype='float64')
+
+        # Arrivals are counted before the window is cut, since a batch larger than the
+        # window still arrived in full
+        shown = max(0, len(arrived) - self.max_points)
+        self._append(arrived.index[shown:].to_numpy().astype('datetime64[ns]'), usage[shown:], cost[shown:])
+        if first:
+            return 0
+        self.added = {
+            'readings': len(arrived) - retaken[0],
+            'usage': float(usage.sum() - retaken[1]),
+            'cost': float(cost.sum() - retaken[2])
+        }
+        self.arrivals.append((self.version, self.added))
+        return self.added['readings']
+
+    def arrived_since(self, version):
+        # Readings added by the updates after a dataset version, e.g. the one a session last
+        # drew; nothing for a session drawing the window for the first time
+        arrived = {'readings': 0, 'usage': 0.0, 'cost': 0.0}
+        if version is None:
+            return arrived
+        for update, added in self.arrivals:
+            if update > version:
+                arrived = {name: arrived[name] + added[name] for name in arrived}
+        return arrived
+
+    def _drop_last(self):
+        self.totals['usage'] -= self.usage[-1]
+        self.totals['cost'] -= self.cost[-1]
+        self.timestamps = self.timestamps[:-1]
+        self.usage = self.usage[:-1]
+        self.cost = self.cost[:-1]
+
+    def _append(self, timestamps, usage, cost):
+        self.stale = True
+        self.timestamps = np.concatenate([self.timestamps, timestamps])
+        self.usage = np.concatenate([self.usage, usage])
+        self.cost = np.concatenate([self.cost, cost])
+        self.totals['usage'] += usage.sum()
+        self.totals['cost'] += cost.sum()
+
+        overflow = len(self.timestamps) - self.max_points
+        if overflow > 0:
+            self.totals['usage'] -= self.usage[:overflow].sum()
+            self.totals['cost'] -= self.cost[:overflow].sum()
+            self.timestamps = self.timestamps[overflow:]
+            self.usage = self.usage[overflow:]
+            self.cost = self.cost[overflow:]
+
+    def figure(self):
+        # The chart is built once; later refreshes only swap its traces' points. A shared
+        # window's chart is rebuilt instead, since other sessions may be sending the old one.
+        if self.fig is None or (self.shared and self.stale):
+            self.fig = live_figure(self.timestamps, self.usage, self.cost)
+        elif self.stale:
+            self.fig.data[0].update(x=self.timestamps, y=self.usage)
+            self.fig.data[1].update(x=self.timestamps, y=self.cost)
+        self.stale = False
+        return self.fig
+
+
+def shared_mode():
+    return os.environ.get(SHARED_ENV) == '1'
+
+
+def shared_window(source_key, max_points):
+    # The process-wide window of a source and size; a new source version (e.g. a rewritten
+    # file) gets a new one
+    slot = (source_key[:2], max_points)
+    with _shared_lock:
+        live = _shared_windows.get(slot)
+        if live is None or live.source_key != source_key:
+            live = LiveWindow(source_key, max_points, shared=True)
+            _shared_windows[slot] = live
+        return live
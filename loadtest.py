@@ -0,0 +1,385 @@
+import argparse
+import ctypes
+import gc
+import heapq
+import json
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from benchmark import environment, package_path
+from data_sources import DATA_PATH_ENV
+from live import SHARED_ENV
+from sites import LEVELS
+
+# Load test for many simultaneous dashboard sessions in one server process. Each simulated
+# user is a Streamlit AppTest of app.py with its own session state, driven headlessly
+# through a random sequence of the interactions real users make: switching tabs, moving
+# the year range, picking sites, toggling forecasts and live mode, paging the data table.
+# Between interactions a user pauses for a random think time.
+#
+# Every open session is active at once. Their reruns are served one at a time in the order
+# they arrive, as one server process does: Streamlit runs each session's script on its own
+# thread, but a rerun is Python holding the GIL for most of its time. (AppTest swaps
+# process-wide Streamlit state during a run, so its runs can't overlap anyway.) A rerun's
+# service time is measured; its response time adds the time it waited behind other
+# sessions' reruns, on a simulated clock, so the test takes as long as the reruns and not
+# the think times.
+#
+# Sessions are added in steps (e.g. 1, then 10, then 50 in total) and kept open, so
+# memory is measured as the server's resident memory grows with the number of open
+# sessions. Every step reports response and service time percentiles, overall and per
+# interaction, and the memory per open session:
+#
+#     WATER_USAGE_DATA=readings.parquet python loadtest.py --sessions 1 10 50
+#     WATER_USAGE_DATA=readings.parquet python loadtest.py --sessions 1 10 50 --shared
+#
+# Every session reads the one dataset the process holds (dataset_store.STORE). --shared
+# also runs them in shared mode (WATER_USAGE_SHARED=1, see live.py), where sessions in live
+# mode read one process-wide window of the latest readings instead of each keeping its own.
+
+DEFAULT_SESSIONS = [1, 10, 50]
+
+# Interactions each open session makes in every step, after its first page load
+DEFAULT_INTERACTIONS = 10
+
+# Mean seconds a user pauses between interactions; think times are exponential
+DEFAULT_THINK_SECONDS = 5.0
+
+LATENCY_PERCENTILES = [50, 90, 95, 99]
+
+# The tabs a session can switch to, as labelled in app.py
+TABS = ["📊 Combined View", "💧 Water Usage", "💰 Cost", "📈 Cost per Unit", "📋 Data Table"]
+
+
+def resident_bytes():
+    # Current resident memory of this process, from /proc; None where that isn't available.
+    # Freed heap pages are handed back to the OS first, so the figure tracks what the open
+    # sessions and caches actually hold.
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def state_bytes(value, seen=None):
+    # Rough size of what the app keeps in a session's state: arrays and frames by their
+    # buffers, figures by their JSON, other objects by their attributes
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if hasattr(value, 'to_plotly_json'):
+        return len(value.to_json())
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(state_bytes(item, seen) for item in value.values())
+    if isinstance(value, (list, tuple, set, frozenset, deque)):
+        return sys.getsizeof(value) + sum(state_bytes(item, seen) for item in value)
+    if hasattr(value, '__dict__') and not isinstance(value, type):
+        return sys.getsizeof(value) + state_bytes(vars(value), seen)
+    return sys.getsizeof(value)
+
+
+def session_state_bytes(at):
+    # Size of a session's own state, leaving out Streamlit's internal keys
+    return sum(
+        state_bytes(value) for key, value in at.session_state.to_dict().items() if not str(key).startswith('$$')
+    )
+
+
+def find(elements, key):
+    # The widget with a key among an AppTest element list, or None when it isn't shown
+    for element in elements:
+        if element.key == key:
+            return element
+    return None
+
+
+# Each interaction changes one widget of a session (an AppTest) and returns True, or
+# returns False when the widget isn't on the session's page; the harness then reruns it
+
+def switch_tab(at, rng):
+    at.session_state['view_tab'] = TABS[rng.integers(len(TABS))]
+    return True
+
+
+def move_years(at, rng):
+    slider = next((slider for slider in at.sidebar.slider if slider.label == "Select Years"), None)
+    if slider is None:
+        return False
+    first, last = slider.min, slider.max
+    if last - first < 2:
+        return False
+    low = int(rng.integers(first, last - 1))
+    slider.set_range(low, int(rng.integers(low + 1, last + 1)))
+    return True
+
+
+def pick_site(at, rng):
+    level = find(at.sidebar.radio, 'site_level')
+    if level is None:
+        return False
+    if level.value == 'all' or rng.random() < 0.3:
+        level.set_value(LEVELS[rng.integers(len(LEVELS))])
+        return True
+    choice = find(at.sidebar.selectbox, f'site_key_{level.value}')
+    if choice is None:
+        return False
+    choice.set_value(choice.options[rng.integers(len(choice.options))])
+    return True
+
+
+def toggle_forecast(at, rng):
+    show = find(at.sidebar.checkbox, 'forecast_show')
+    if show is None:
+        return False
+    show.set_value(not show.value)
+    return True
+
+
+def change_resolution(at, rng):
+    resolution = find(at.sidebar.radio, 'chart_resolution')
+    if resolution is None:
+        return False
+    resolution.set_value('readings' if resolution.value == 'annual' else 'annual')
+    return True
+
+
+def toggle_live(at, rng):
+    show = find(at.sidebar.checkbox, 'live_show')
+    if show is None:
+        return False
+    show.set_value(not show.value)
+    return True
+
+
+def page_table(at, rng):
+    page = next((page for page in at.main.number_input if (page.key or '').startswith('table_page_')), None)
+    if page is None:
+        # Opens the data table; the next page_table pages it
+        at.session_state['view_tab'] = "📋 Data Table"
+        return True
+    page.set_value(int(rng.integers(1, page.max + 1)) if page.max else 1)
+    return True
+
+
+# Interactions and how often users make them, relative to each other
+INTERACTIONS = {
+    'switch_tab': (switch_tab, 4),
+    'move_years': (move_years, 3),
+    'pick_site': (pick_site, 2),
+    'toggle_forecast': (toggle_forecast, 1),
+    'change_resolution': (change_resolution, 1),
+    'toggle_live': (toggle_live, 1),
+    'page_table': (page_table, 2)
+}
+
+
+class Session:
+    # One simulated user: an AppTest of the dashboard with its own session state, and every
+    # rerun it made as (interaction, service seconds, response seconds)
+
+    def __init__(self, app, timeout, seed):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(app, default_timeout=timeout)
+        self.rng = np.random.default_rng(seed)
+        self.reruns = []
+        self.errors = []
+        self.pending = 0
+
+    def interact(self):
+        # Make the next interaction and return its name; the first is loading the page
+        if not self.reruns:
+            return 'first_page'
+        names = list(INTERACTIONS)
+        weights = np.array([weight for _, weight in INTERACTIONS.values()], dtype='float64')
+        # Switching tabs always applies, so this ends
+        while True:
+            name = names[self.rng.choice(len(names), p=weights / weights.sum())]
+            if INTERACTIONS[name][0](self.at, self.rng):
+                return name
+
+    def rerun(self, interaction):
+        # Rerun the script; returns its service time in seconds
+        started = time.perf_counter()
+        self.at.run()
+        seconds = time.perf_counter() - started
+        if self.at.exception:
+            self.errors.append(f"{interaction}: {self.at.exception[0].message}")
+        return seconds
+
+
+def serve(sessions, rng, think):
+    # Every pending rerun of the sessions, served one at a time in order of arrival. A
+    # session's next interaction arrives a think time after its last response. Returns
+    # (interaction, service seconds, response seconds) of every rerun.
+    arrivals = [(rng.exponential(think), number) for number, session in enumerate(sessions) if session.pending]
+    heapq.heapify(arrivals)
+    clock = 0.0
+    served = []
+    while arrivals:
+        arrival, number = heapq.heappop(arrivals)
+        session = sessions[number]
+        interaction = session.interact()
+        service = session.rerun(interaction)
+        clock = max(clock, arrival) + service
+        rerun = (interaction, service, clock - arrival)
+        session.reruns.append(rerun)
+        served.append(rerun)
+        session.pending -= 1
+        if session.pending:
+            heapq.heappush(arrivals, (clock + rng.exponential(think), number))
+    return served
+
+
+def percentiles(seconds):
+    row = {f'p{q}_ms': float(np.percentile(seconds, q) * 1000) for q in LATENCY_PERCENTILES}
+    row['max_ms'] = float(np.max(seconds) * 1000)
+    return row
+
+
+def latency_summary(served):
+    # Rerun count and response and service time percentiles in ms, overall and per interaction
+    frame = pd.DataFrame(served, columns=['interaction', 'service', 'response'])
+
+    def summary(rows):
+        return {'reruns': len(rows), 'response': percentiles(rows['response']), 'service': percentiles(rows['service'])}
+
+    return summary(frame), {name: summary(rows) for name, rows in frame.groupby('interaction')}
+
+
+def run(args):
+    if args.data:
+        os.environ[DATA_PATH_ENV] = args.data
+    if args.shared:
+        os.environ[SHARED_ENV] = '1'
+    app = package_path('app.py')
+
+    # A first session loads the dataset and warms the process-wide caches, as the first
+    # visitor does on a server; it isn't counted
+    warmup = Session(app, args.timeout, args.seed)
+    warmup.pending = args.interactions + 1
+    serve([warmup], np.random.default_rng(args.seed), args.think)
+    if warmup.errors:
+        raise RuntimeError(warmup.errors[0])
+    del warmup
+    gc.collect()
+
+    rng = np.random.default_rng(args.seed)
+    sessions = []
+    previous = resident_bytes()
+    results = []
+    for total in sorted(set(args.sessions)):
+        added = total - len(sessions)
+        sessions += [Session(app, args.timeout, args.seed + len(sessions) + i + 1) for i in range(added)]
+        for session in sessions:
+            # New sessions load their first page, then interact like everyone else
+            session.pending = args.interactions + (0 if session.reruns else 1)
+
+        started = time.perf_counter()
+        served = serve(sessions, rng, args.think)
+        seconds = time.perf_counter() - started
+        gc.collect()
+        resident = resident_bytes()
+        state = [session_state_bytes(session.at) for session in sessions]
+
+        overall, by_interaction = latency_summary(served)
+        result = {
+            'sessions': total,
+            'added': added,
+            'seconds': seconds,
+            'reruns_per_second': len(served) / seconds,
+            'latency': overall,
+            'interactions': by_interaction,
+            'resident_bytes': resident,
+            # Resident memory the step's added sessions brought with them, per session
+            'bytes_per_session': None if resident is None else (resident - previous) / added,
+            'state_bytes_per_session': float(np.mean(state)),
+            'errors': [error for session in sessions for error in session.errors]
+        }
+        for session in sessions:
+            session.errors = []
+        previous = resident
+        results.append(result)
+        report(result)
+    return results
+
+
+def report(result):
+    latency = result['latency']
+    response = ' '.join(f"p{q} {latency['response'][f'p{q}_ms']:>7.0f}" for q in LATENCY_PERCENTILES)
+    memory = f" | session state {result['state_bytes_per_session'] / 1024:,.0f} KB per session"
+    if result['bytes_per_session'] is not None:
+        memory += (
+            f" | {result['resident_bytes'] / 1024 / 1024:,.1f} MB resident,"
+            f" {result['bytes_per_session'] / 1024:,.0f} KB per added session"
+        )
+    print(
+        f"{result['sessions']:>6} sessions {latency['reruns']:>6} reruns | response ms {response}"
+        f" | service p50 {latency['service']['p50_ms']:.0f} ms{memory}",
+        flush=True
+    )
+    for name, row in result['interactions'].items():
+        print(
+            f"{'':>14}{name:<20} {row['reruns']:>5} reruns | response p50 {row['response']['p50_ms']:>7.0f}"
+            f" p95 {row['response']['p95_ms']:>7.0f} | service p50 {row['service']['p50_ms']:>7.0f} ms"
+        )
+    for error in result['errors'][:5]:
+        print(f"{'':>14}ERROR {error}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load test the dashboard with simultaneous simulated sessions via Streamlit's AppTest."
+    )
+    parser.add_argument('--data', default=os.environ.get(DATA_PATH_ENV),
+                        help=f"Meter export to serve (default: ${DATA_PATH_ENV}, or the sample data)")
+    parser.add_argument('--sessions', type=int, nargs='+', default=DEFAULT_SESSIONS,
+                        help="Open sessions in each step, e.g. 1 10 50")
+    parser.add_argument('--interactions', type=int, default=DEFAULT_INTERACTIONS,
+                        help="Interactions per session in each step, after its first page")
+    parser.add_argument('--think', type=float, default=DEFAULT_THINK_SECONDS,
+                        help="Mean seconds a user pauses between interactions")
+    parser.add_argument('--shared', action='store_true',
+                        help=f"Run the sessions in shared mode ({SHARED_ENV}=1)")
+    parser.add_argument('--timeout', type=float, default=600, help="Seconds allowed for one rerun")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='loadtest.json', help="Where to write the results")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Streamlit's deprecation warnings would be repeated for every rerun of every session
+    from streamlit import config
+    from streamlit import logger as streamlit_logger
+    config.set_option('logger.level', 'error')
+    streamlit_logger.set_log_level('error')
+    results = run(args)
+
+    with open(args.out, 'w') as f:
+        json.dump({'environment': environment(), 'options': vars(args), 'results': results}, f, indent=2)
+    print(f"Wrote {len(results)} steps to {args.out}")
+    return 1 if any(result['errors'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
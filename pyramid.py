@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+# Rollup pyramid over the portfolio's reading-level totals. Every level above the readings
+# keeps, per bucket, the sum, lowest and highest reading of usage and cost plus the number
+# of readings, and is rolled up from the level below it. A reading-level chart asks for the
+# coarsest level with at least as many buckets in its range as its point budget, so a chart
+# of ten years of 15-minute readings downsamples a few thousand daily buckets instead of
+# every reading, and zooming in moves down the pyramid to the readings themselves. New
+# readings only roll up the buckets they fall in again.
+
+# Width of each level's buckets as a NumPy datetime unit, finest first
+PYRAMID_LEVELS = {'day': 'D', 'month': 'M', 'year': 'Y'}
+
+# How each level's buckets are described on charts
+LEVEL_NAMES = {'day': 'daily', 'month': 'monthly', 'year': 'yearly'}
+
+PYRAMID_COLUMNS = ['usage', 'cost']
+
+
+def _truncate(timestamps, unit):
+    # Start of the bucket holding each timestamp, as datetime64[ns]
+    return np.asarray(timestamps, dtype='datetime64[ns]').astype(f'datetime64[{unit}]').astype('datetime64[ns]')
+
+
+def roll_up(frame, unit):
+    # Buckets of one level from the rows below it: the readings (a series frame) or the
+    # buckets of a finer level. Rows must be sorted by time.
+    starts = _truncate(frame.index.to_numpy(), unit)
+    parts = {}
+    for column in PYRAMID_COLUMNS:
+        if 'count' in frame.columns:
+            sums, lows, highs = (frame[f'{column}_{stat}'].to_numpy() for stat in ['sum', 'min', 'max'])
+        else:
+            sums = lows = highs = frame[column].to_numpy(dtype='float64')
+        parts[f'{column}_sum'] = (np.add, sums)
+        parts[f'{column}_min'] = (np.minimum, lows)
+        parts[f'{column}_max'] = (np.maximum, highs)
+    counts = frame['count'].to_numpy() if 'count' in frame.columns else np.ones(len(frame), dtype='int64')
+    parts['count'] = (np.add, counts)
+
+    # Rows are sorted, so each bucket is a run of equal starts, reduced in one pass
+    first = np.flatnonzero(starts[1:] != starts[:-1]) + 1
+    if len(starts):
+        first = np.concatenate([[0], first])
+    return pd.DataFrame(
+        {name: reduce.reduceat(values, first) for name, (reduce, values) in parts.items()},
+        index=pd.DatetimeIndex(starts[first], name='timestamp')
+    )
+
+
+class RollupPyramid:
+    # Day, month and year buckets of a dataset's reading-level totals, built once per
+    # dataset version. Treat it as read-only: extend() returns a new pyramid that shares
+    # nothing mutable with this one.
+
+    def __init__(self, series, levels=None):
+        self.series = series
+        if levels is None:
+            levels = {}
+            below = series
+            for level, unit in PYRAMID_LEVELS.items():
+                below = levels[level] = roll_up(below, unit)
+        self.levels = levels
+
+    def extend(self, series, since):
+        # Pyramid of `series`, which holds this pyramid's readings plus newer or re-summed
+        # ones from `since` on. Each level keeps its buckets before the one holding `since`
+        # and rolls up the rest from the level below.
+        levels = {}
+        below = series
+        for level, unit in PYRAMID_LEVELS.items():
+            start = _truncate([since], unit)[0]
+            kept = self.levels[level]
+            kept = kept.iloc[:kept.index.searchsorted(start, side='left')]
+            changed = below.iloc[below.index.searchsorted(start, side='left'):]
+            below = levels[level] = pd.concat([kept, roll_up(changed, unit)])
+        return RollupPyramid(series, levels)
+
+    def span(self, level, start, end):
+        # Row range [lo, hi) of a level's buckets (or the readings) overlapping start..end
+        if level == 'interval':
+            index = self.series.index
+            return index.searchsorted(start, side='left'), index.searchsorted(end, side='right')
+        index = self.levels[level].index
+        first = _truncate([pd.Timestamp(start).to_datetime64()], PYRAMID_LEVELS[level])[0]
+        return index.searchsorted(first, side='left'), index.searchsorted(end, side='right')
+
+    def level_for(self, start, end, budget):
+        # Coarsest level with at least `budget` buckets between start and end, so a chart
+        # downsampled to the budget loses nothing to the rollup; the readings when no level
+        # is that fine
+        for level in reversed(PYRAMID_LEVELS):
+            lo, hi = self.span(level, start, end)
+            if hi - lo >= budget:
+                return level
+        return 'interval'
+
+    def points(self, level, column, start, end, method='lttb'):
+        # Values to chart for `column` between start and end at a level, indexed by
+        # timestamp: the readings themselves, each bucket's mean reading for LTTB, or each
+        # bucket's lowest and highest reading for min/max buckets, so every peak survives
+        lo, hi = self.span(level, start, end)
+        if level == 'interval':
+            return self.series.iloc[lo:hi]
+        buckets = self.levels[level].iloc[lo:hi]
+        if method == 'minmax':
+            values = np.column_stack([buckets[f'{column}_min'], buckets[f'{column}_max']]).ravel()
+            return pd.DataFrame({column: values}, index=buckets.index.repeat(2))
+        values = buckets[f'{column}_sum'].to_numpy() / buckets['count'].to_numpy()
+        return pd.DataFrame({column: values}, index=buckets.index)
+
+
+def resolution_label(level, method):
+    # What a chart at a level shows, e.g. 'daily means'; None for the readings themselves
+    if level == 'interval':
+        return None
+    return f"{LEVEL_NAMES[level]} {'lows and highs' if method == 'minmax' else 'means'}"
@@ -0,0 +1,152 @@
+import numpy as np
+
+
+class RangeQueries:
+    # Answers the stats dict for any contiguous run of rows in a year-level frame without
+    # rescanning it: sums come from prefix sums (O(1)), extrema from sparse tables (O(1)),
+    # and year bounds are located by binary search (O(log n)).
+    #
+    # The frame may hold many series back to back (e.g. every site, sorted by site then
+    # year). Queries never cross a series, so the sparse tables only need enough levels for
+    # the longest series (`max_span` rows).
+
+    def __init__(self, df, max_span=None):
+        self.years = df['year'].to_numpy()
+        self.usage = df['usage'].to_numpy()
+        self.cost = df['cost'].to_numpy()
+        self.cost_per_unit = df['costPerUnit'].to_numpy()
+
+        self.usage_prefix = np.concatenate([[0], np.cumsum(self.usage)])
+        self.cost_prefix = np.concatenate([[0.0], np.cumsum(self.cost)])
+
+        levels = max(1, int(max_span if max_span is not None else len(self.years)).bit_length())
+        self.min_usage = sparse_table(self.usage, levels, np.less_equal)
+        self.max_usage = sparse_table(self.usage, levels, np.greater_equal)
+        self.min_cost = sparse_table(self.cost, levels, np.less_equal)
+        self.max_cost = sparse_table(self.cost, levels, np.greater_equal)
+
+    def positions(self, first_year, last_year, start=0, stop=None):
+        # Row range [lo, hi) covering the years within one series' rows [start, stop)
+        stop = len(self.years) if stop is None else stop
+        series_years = self.years[start:stop]
+        lo = start + int(np.searchsorted(series_years, first_year, side='left'))
+        hi = start + int(np.searchsorted(series_years, last_year, side='right'))
+        return lo, hi
+
+    def _extreme(self, table, values, lo, hi, keep_left):
+        level = (hi - lo).bit_length() - 1
+        left = table[level][lo]
+        right = table[level][hi - (1 << level)]
+        return left if keep_left(values[left], values[right]) else right
+
+    def stats(self, lo, hi):
+        if hi <= lo:
+            raise ValueError("The selected range contains no years")
+
+        count = hi - lo
+        total_usage = self.usage_prefix[hi] - self.usage_prefix[lo]
+        total_cost = self.cost_prefix[hi] - self.cost_prefix[lo]
+        min_usage = self._extreme(self.min_usage, self.usage, lo, hi, np.less_equal)
+        max_usage = self._extreme(self.max_usage, self.usage, lo, hi, np.greater_equal)
+        min_cost = self._extreme(self.min_cost, self.cost, lo, hi, np.less_equal)
+        max_cost = self._extreme(self.max_cost, self.cost, lo, hi, np.greater_equal)
+        return {
+            'total_usage': total_usage,
+            'total_cost': total_cost,
+            'avg_usage': total_usage / count,
+            'avg_cost': total_cost / count,
+            'min_usage': self.usage[min_usage],
+            'max_usage': self.usage[max_usage],
+            'min_cost': self.cost[min_cost],
+            'max_cost': self.cost[max_cost],
+            'min_year_usage': int(self.years[min_usage]),
+            'max_year_usage': int(self.years[max_usage]),
+            'min_year_cost': int(self.years[min_cost]),
+            'max_year_cost': int(self.years[max_cost]),
+            'cost_per_unit_increase': ((self.cost_per_unit[hi - 1] / self.cost_per_unit[lo]) - 1) * 100
+        }
+
+
+def sparse_table(values, levels, keep_left):
+    # table[k][i] is the position of the extreme of values[i:i + 2**k]. On ties the left
+    # (earlier) position wins, matching idxmin/idxmax.
+    positions = np.arange(len(values), dtype=np.int32)
+    table = [positions]
+    for level in range(1, levels):
+        half = 1 << (level - 1)
+        previous = table[-1]
+        if len(previous) <= half:
+            break
+        left = previous[:-half]
+        right = previous[half:]
+        table.append(np.where(keep_left(values[left], values[right]), left, right))
+    return table
+
+
+class CrossingIndex:
+    # First position at which each series reaches a level, for any number of series and
+    # levels at once. Within a series the running maximum never decreases, so "first row at
+    # or above t" is a binary search in it. Values are replaced by their rank among all
+    # values and offset by series, which makes the running maxima of every series one sorted
+    # integer array: a whole batch of (series, level) queries is a single searchsorted.
+    # Running minima answer "first row at or below t" the same way.
+    #
+    # Queries limited to a window that starts after a series already reached the level
+    # descend a sparse table of range maxima (or minima) instead, in O(log n).
+
+    def __init__(self, values, spans):
+        self.values = np.asarray(values, dtype='float64')
+        self.starts = np.array([start for start, _ in spans], dtype='int64')
+        self.stops = np.array([stop for _, stop in spans], dtype='int64')
+        self.levels, ranks = np.unique(self.values, return_inverse=True)
+
+        series = np.repeat(np.arange(len(spans), dtype='int64'), self.stops - self.starts)
+        count = len(self.levels) + 1
+        # Series offsets keep one series' running maximum from leaking into the next
+        self.rising = np.maximum.accumulate(series * count + ranks)
+        self.falling = np.maximum.accumulate(series * count + (len(self.levels) - 1 - ranks))
+        self.count = count
+
+        max_span = int((self.stops - self.starts).max()) if len(spans) else 1
+        table_levels = max(1, max_span.bit_length())
+        self.max_table = sparse_table(self.values, table_levels, np.greater_equal)
+        self.min_table = sparse_table(self.values, table_levels, np.less_equal)
+
+    def first_positions(self, series, thresholds, below=False, lo=None, hi=None):
+        # Row of the first value >= threshold (<= with below=True) for each (series,
+        # threshold) pair, within rows [lo, hi) when given; -1 where it never got there.
+        # All arguments broadcast against each other.
+        series, thresholds = np.broadcast_arrays(np.asarray(series, dtype='int64'), np.asarray(thresholds, dtype='float64'))
+        lo = self.starts[series] if lo is None else np.broadcast_to(np.asarray(lo, dtype='int64'), series.shape)
+        hi = self.stops[series] if hi is None else np.broadcast_to(np.asarray(hi, dtype='int64'), series.shape)
+
+        if below:
+            rank = len(self.levels) - np.searchsorted(self.levels, thresholds, side='right')
+            keys = self.falling
+        else:
+            rank = np.searchsorted(self.levels, thresholds, side='left')
+            keys = self.rising
+        first = np.searchsorted(keys, series * self.count + rank, side='left')
+        first = np.where(first < self.stops[series], first, -1)
+
+        # A series that got there before the window may do so again inside it
+        earlier = (first >= 0) & (first < lo)
+        if earlier.any():
+            first[earlier] = self._descend(lo[earlier], hi[earlier], thresholds[earlier], below)
+        return np.where((first >= lo) & (first < hi), first, -1)
+
+    def _descend(self, lo, hi, thresholds, below):
+        # First row in [lo, hi) reaching the threshold: the largest jumps over rows whose
+        # extreme doesn't reach it, from the biggest power of two down
+        table = self.min_table if below else self.max_table
+        reaches = np.less_equal if below else np.greater_equal
+        position = lo.copy()
+        for level in range(len(table) - 1, -1, -1):
+            step = 1 << level
+            fits = position + step <= hi
+            candidate = np.where(fits, position, 0)
+            extreme = self.values[table[level][np.minimum(candidate, len(table[level]) - 1)]]
+            skip = fits & ~reaches(extreme, thresholds)
+            position = np.where(skip, position + step, position)
+        found = (position < hi) & reaches(self.values[np.minimum(position, len(self.values) - 1)], thresholds)
+        return np.where(found, position, -1)
@@ -0,0 +1,137 @@
+import argparse
+import json
+import math
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from analysis import analyze
+from data_sources import YEARLY_COLUMNS, default_source, open_source
+from figures import combined_figure, cost_figure, cost_per_unit_figure, usage_figure, year_over_year_figure
+from stats import add_yoy_changes, compute_stats
+
+# Headless batch reports: the dashboard's metrics and figures for many data files (and
+# optionally every site in them), computed in a process pool.
+#
+#     python report.py exports/*.parquet --out reports --per-site --workers 8
+
+REPORT_FIGURES = {
+    'combined': lambda df, year_label: combined_figure(df, year_label),
+    'usage': lambda df, year_label: usage_figure(df, year_label),
+    'cost': lambda df, year_label: cost_figure(df, year_label),
+    'cost_per_unit': lambda df, year_label: cost_per_unit_figure(df, year_label),
+    'year_over_year': lambda df, year_label: year_over_year_figure(df)
+}
+
+
+def slug(name):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(name)).strip('_') or 'unnamed'
+
+
+def to_builtin(value):
+    # JSON-safe copy of an analysis result: numpy scalars become Python ones, NaN becomes null
+    if isinstance(value, dict):
+        return {str(key): to_builtin(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_builtin(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def write_report(name, yearly, out_dir, with_figures):
+    if len(yearly) < 2:
+        raise ValueError("At least two years of data are needed for a report")
+
+    df = add_yoy_changes(yearly.reset_index(drop=True))
+    result = analyze(df, compute_stats(df))
+    result['name'] = name
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'report.json'), 'w') as f:
+        json.dump(to_builtin(result), f, indent=2, allow_nan=False)
+
+    files = ['report.json']
+    if with_figures:
+        year_label = f"{result['first_year']}-{result['last_year']}"
+        for figure_name, build in REPORT_FIGURES.items():
+            file_name = f"{figure_name}.html"
+            build(df, year_label).write_html(os.path.join(out_dir, file_name), include_plotlyjs='cdn')
+            files.append(file_name)
+    return files
+
+
+def run_job(job):
+    # Runs in a worker process. A job carries either a data file path, which the worker
+    # loads itself, or a small per-site frame the parent already split out.
+    name, path, yearly, out_dir, with_figures = job
+    try:
+        if yearly is None:
+            yearly = (open_source(path) if path else default_source()).load()
+        files = write_report(name, yearly, out_dir, with_figures)
+        return {'name': name, 'status': 'ok', 'out_dir': out_dir, 'files': files}
+    except Exception as error:
+        return {'name': name, 'status': 'error', 'out_dir': out_dir, 'error': f"{type(error).__name__}: {error}"}
+
+
+def build_jobs(paths, out, per_site, with_figures):
+    jobs = []
+    for path in paths or [None]:
+        name = os.path.splitext(os.path.basename(path))[0] if path else 'sample'
+        dataset_dir = os.path.join(out, slug(name))
+        jobs.append((name, path, None, dataset_dir, with_figures))
+        if not per_site:
+            continue
+
+        # The file is parsed once here; workers only receive each site's few yearly rows
+        site_yearly = (open_source(path) if path else default_source()).load_sites()
+        if site_yearly is None:
+            continue
+        for site, frame in site_yearly.groupby('site', observed=True, sort=True):
+            jobs.append((
+                f"{name}/{site}",
+                path,
+                frame[YEARLY_COLUMNS],
+                os.path.join(dataset_dir, 'sites', slug(site)),
+                with_figures
+            ))
+    return jobs
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Write water usage reports (JSON plus HTML figures) without the dashboard.")
+    parser.add_argument('paths', nargs='*', help="Meter exports (.csv, .parquet, .arrow). Defaults to the dashboard's data source.")
+    parser.add_argument('--out', default='reports', help="Output directory (default: reports)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument('--per-site', action='store_true', help="Also write a report for every site in each file")
+    parser.add_argument('--no-figures', action='store_true', help="Only write the JSON reports")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workers = args.workers or os.cpu_count() or 1
+    jobs = build_jobs(args.paths, args.out, args.per_site, not args.no_figures)
+
+    # Many small site jobs are handed out in chunks to keep the pickling overhead down
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_job, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+
+    failed = [result for result in results if result['status'] != 'ok']
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, 'summary.json'), 'w') as f:
+        json.dump({'reports': len(results), 'failed': len(failed), 'results': results}, f, indent=2)
+
+    print(f"Wrote {len(results) - len(failed)} of {len(results)} reports to {args.out}")
+    for result in failed:
+        print(f"  {result['name']}: {result['error']}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
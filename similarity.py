@@ -0,0 +1,394 @@
+import math
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_sources import READING_CHUNK_ROWS
+from dataset_store import STORE
+from figure_cache import LRUCache
+
+# Cross-meter similarity: Pearson correlation of usage between every pair of meters,
+# clusters of meters with similar consumption profiles, and each meter's correlation with
+# covariates such as weather or occupancy. A meter's profile is its usage per period: per
+# year for annual data, per day (or per few days, to bound memory) for interval readings.
+# Profiles are centered and scaled to unit length once, so a block of correlations is a
+# single matrix product. Blocks of meters are multiplied against all meters in turn and
+# only each meter's best matches are kept, so 10,000 meters never need their
+# 10,000 x 10,000 correlation matrix in memory at once.
+
+SIMILARITY_CACHE_BYTES = 256 * 1024 * 1024
+
+# Meters x periods held in a profile matrix. Interval data covering more days than fit is
+# summed over several days per period.
+PROFILE_CELLS = 8_000_000
+
+DAY_NS = 24 * 3600 * 10 ** 9
+
+# Meters whose correlations with every meter are computed at once; bounds the block held
+# in memory to this many rows times the number of meters
+CORRELATION_BLOCK_ROWS = 1024
+
+# Best matches kept per meter; any shorter list is answered from the same result
+SIMILAR_METERS = 25
+
+CLUSTER_COUNTS = [2, 3, 4, 5, 6, 8, 10, 12]
+DEFAULT_CLUSTERS = 6
+CLUSTER_ITERATIONS = 30
+
+# Environment variable naming a CSV or Parquet file of covariates: a 'timestamp', 'date' or
+# 'year' column plus one numeric column per covariate (e.g. temperature, occupancy)
+COVARIATES_ENV = 'WATER_USAGE_COVARIATES'
+
+
+class MeterProfiles:
+    # Usage per meter and period. `usage` has one row per site in `sites` and one column per
+    # period starting at `starts`; `scaled` holds the same rows centered and scaled to unit
+    # length, so the dot product of two rows is their correlation. Meters whose usage
+    # never changes have no correlation and a zero row.
+
+    def __init__(self, sites, starts, usage, label, first_day=None, stride=None):
+        self.sites = sites
+        self.starts = starts
+        self.usage = usage
+        self.label = label
+        self.first_day = first_day
+        self.stride = stride
+        self.scaled, self.constant = scale_rows(usage)
+        self.nbytes = usage.nbytes + self.scaled.nbytes
+
+    def position(self, site):
+        return self.sites.get_loc(site)
+
+
+def scale_rows(values, block_rows=CORRELATION_BLOCK_ROWS):
+    # Rows centered and divided by their length, as float32, one block of rows at a time
+    scaled = np.zeros(values.shape, dtype='float32')
+    constant = np.zeros(len(values), dtype=bool)
+    for start in range(0, len(values), block_rows):
+        block = values[start:start + block_rows].astype('float64')
+        block -= block.mean(axis=1, keepdims=True)
+        norms = np.sqrt((block ** 2).sum(axis=1))
+        varying = norms > 0
+        scaled[start:start + block_rows][varying] = block[varying] / norms[varying, None]
+        constant[start:start + block_rows] = ~varying
+    return scaled, constant
+
+
+def meter_profiles(source, dataset, chunk_rows=READING_CHUNK_ROWS, cells=PROFILE_CELLS, store=STORE):
+    # Every meter's usage per year, or per day(s) from its timestamped readings
+    site_yearly = dataset.rollups.site_yearly
+    sites = site_yearly['site'].cat.categories
+    if dataset.series is None:
+        years = np.unique(site_yearly['year'].to_numpy())
+        usage = np.zeros((len(sites), len(years)), dtype='float32')
+        usage[site_yearly['site'].cat.codes.to_numpy(), np.searchsorted(years, site_yearly['year'].to_numpy())] = (
+            site_yearly['usage'].to_numpy()
+        )
+        return MeterProfiles(sites, pd.Index(years, name='year'), usage, 'annual usage')
+
+    # Readings are summed per period once per source version and kept up to date with the
+    # readings appended to the dataset; a version's profiles regroup those sums
+    def build():
+        first_day = dataset.series.index[0].floor('D')
+        days = (dataset.series.index[-1].floor('D') - first_day).days + 1
+        stride = max(1, math.ceil(days * len(sites) / cells))
+        return PeriodSums(source, sites, first_day, stride, days // stride + 1, cells, chunk_rows)
+
+    scan = store.scan(dataset, ('period_sums', cells), build)
+    days = (dataset.series.index[-1].floor('D') - scan.first_day).days + 1
+    usage, stride = scan.profile(sites, days, cells)
+    periods = usage.shape[1]
+    starts = pd.DatetimeIndex(scan.first_day + pd.to_timedelta(np.arange(periods) * stride, unit='D'), name='start')
+    label = 'daily usage' if stride == 1 else f'{stride}-day usage'
+    return MeterProfiles(sites, starts, usage.astype('float32'), label, scan.first_day, stride)
+
+
+class PeriodSums:
+    # Usage per meter and period of `stride` days from first_day over a source's readings,
+    # summed chunk by chunk once per source version and kept up to date with the readings
+    # appended to its dataset (see DatasetStore.scan). Rows follow `sites`, which grows as
+    # appended readings bring new meters. Once the sums pass twice `cells`, neighbouring
+    # periods are merged and the stride doubles, so ingestion never grows them unbounded.
+
+    def __init__(self, source, sites, first_day, stride, periods, cells=PROFILE_CELLS,
+                 chunk_rows=READING_CHUNK_ROWS):
+        self.sites = sites
+        self.first_day = first_day
+        self.stride = stride
+        self.cells = cells
+        self.sums = np.zeros((len(sites), periods))
+        self.lock = threading.Lock()
+        for chunk in source.iter_readings(['timestamp', 'site', 'usage'], chunk_rows):
+            self._add(chunk)
+
+    def append(self, readings):
+        if 'timestamp' not in readings.columns:
+            return
+        with self.lock:
+            self._add(readings)
+
+    def _add(self, readings):
+        # Readings without a site belong to no meter; readings before first_day to no period
+        readings = readings[readings['site'].notna()]
+        offsets = readings['timestamp'].to_numpy().astype('datetime64[ns]').astype('int64') - self.first_day.value
+        period = offsets // DAY_NS // self.stride
+        site = readings['site'].astype('category')
+        arrived = site.cat.categories.difference(self.sites)
+        if len(arrived):
+            self.sites = self.sites.append(arrived)
+            self.sums = np.vstack([self.sums, np.zeros((len(arrived), self.sums.shape[1]))])
+        codes = self.sites.get_indexer(site.cat.categories)[site.cat.codes.to_numpy()]
+        valid = period >= 0
+        if not valid.any():
+            return
+        if period[valid].max() >= self.sums.shape[1]:
+            grown = np.zeros((len(self.sites), period[valid].max() + 1))
+            grown[:, :self.sums.shape[1]] = self.sums
+            self.sums = grown
+
+        periods = self.sums.shape[1]
+        keys = codes[valid].astype('int64') * periods + period[valid]
+        sums = pd.Series(readings['usage'].to_numpy(dtype='float64')[valid]).groupby(keys).sum()
+        self.sums.reshape(-1)[sums.index.to_numpy()] += sums.to_numpy()
+        while self.sums.size > 2 * self.cells and self.sums.shape[1] > 1:
+            self.sums = merge_periods(self.sums, 2)
+            self.stride *= 2
+
+    def profile(self, sites, days, cells=PROFILE_CELLS):
+        # Usage of `sites` per period over `days` days from first_day, and the period's
+        # length: the shortest multiple of the stride that keeps sites x periods within
+        # `cells`. A trailing period with fewer days than the others is left out.
+        with self.lock:
+            sums, known, stride = self.sums, self.sites, self.stride
+        group = math.ceil(max(1, math.ceil(days * len(sites) / cells)) / stride)
+        stride *= group
+        periods = max(1, days // stride)
+        if sums.shape[1] < periods * group:
+            sums = np.hstack([sums, np.zeros((len(sums), periods * group - sums.shape[1]))])
+        grouped = merge_periods(sums[:, :periods * group], group)
+        usage = np.zeros((len(sites), periods))
+        rows = sites.get_indexer(known)
+        usage[rows[rows >= 0]] = grouped[rows >= 0]
+        return usage, stride
+
+    def nbytes(self):
+        return self.sums.nbytes + int(self.sites.memory_usage(deep=True))
+
+
+def merge_periods(sums, group):
+    # Sums of every `group` neighbouring columns; a short last group is padded with zeros
+    columns = -(-sums.shape[1] // group) * group
+    if columns > sums.shape[1]:
+        sums = np.hstack([sums, np.zeros((len(sums), columns - sums.shape[1]))])
+    return sums.reshape(len(sums), columns // group, group).sum(axis=2)
+
+
+def top_correlations(profiles, k=SIMILAR_METERS, block_rows=CORRELATION_BLOCK_ROWS):
+    # Each meter's k most correlated other meters, best first: (positions, correlations),
+    # both meters x k. Computed one block of meters at a time against all of them.
+    scaled = profiles.scaled
+    n = len(scaled)
+    k = min(k, n - 1)
+    neighbours = np.zeros((n, max(k, 0)), dtype='int32')
+    scores = np.zeros((n, max(k, 0)), dtype='float32')
+    if k <= 0:
+        return neighbours, scores
+
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        block = scaled[start:stop] @ scaled.T
+        # A meter is not its own match
+        block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        top = np.argpartition(block, -k, axis=1)[:, -k:]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        neighbours[start:stop] = np.take_along_axis(top, order, axis=1)
+        scores[start:stop] = np.take_along_axis(top_scores, order, axis=1)
+    return neighbours, scores
+
+
+def similar_meters(profiles, correlations, site, k):
+    # The k meters whose profiles correlate best with the site's, as a frame
+    neighbours, scores = correlations
+    position = profiles.position(site)
+    if profiles.constant[position]:
+        return pd.DataFrame({'site': [], 'correlation': []})
+    k = min(k, neighbours.shape[1])
+    return pd.DataFrame({
+        'site': profiles.sites[neighbours[position, :k]],
+        'correlation': scores[position, :k]
+    })
+
+
+def cluster_profiles(profiles, clusters=DEFAULT_CLUSTERS, iterations=CLUSTER_ITERATIONS,
+                     block_rows=CORRELATION_BLOCK_ROWS, seed=0):
+    # Spherical k-means on the scaled profiles: meters are grouped by the correlation of
+    # their profiles with each cluster's mean profile. Returns (cluster of each meter,
+    # its correlation with that cluster's mean, each cluster's typical shape). Clusters are
+    # numbered by size, largest first; a shape is the members' usage relative to their own
+    # average, averaged per period.
+    scaled = profiles.scaled
+    n = len(scaled)
+    clusters = max(1, min(clusters, n))
+    rng = np.random.default_rng(seed)
+
+    def nearest(centers):
+        labels = np.empty(n, dtype='int32')
+        fit = np.empty(n, dtype='float32')
+        for start in range(0, n, block_rows):
+            block = scaled[start:start + block_rows] @ centers.T
+            labels[start:start + block_rows] = block.argmax(axis=1)
+            fit[start:start + block_rows] = block.max(axis=1)
+        return labels, fit
+
+    # k-means++ seeding: each new center is drawn in proportion to how badly the centers
+    # so far fit each meter
+    centers = scaled[[rng.integers(n)]]
+    for _ in range(1, clusters):
+        _, fit = nearest(centers)
+        weights = np.maximum(1.0 - fit.astype('float64'), 0.0)
+        if weights.sum() <= 0:
+            break
+        centers = np.vstack([centers, scaled[rng.choice(n, p=weights / weights.sum())]])
+
+    labels = None
+    for _ in range(iterations):
+        updated, fit = nearest(centers)
+        if labels is not None and (updated == labels).all():
+            break
+        labels = updated
+        sums = np.zeros(centers.shape, dtype='float64')
+        for start in range(0, n, block_rows):
+            np.add.at(sums, labels[start:start + block_rows], scaled[start:start + block_rows])
+        norms = np.sqrt((sums ** 2).sum(axis=1))
+        # A cluster left empty takes over the meter its center fits worst
+        for empty in np.flatnonzero(norms == 0):
+            worst = int(fit.argmin())
+            sums[empty] = scaled[worst]
+            norms[empty] = np.sqrt((sums[empty] ** 2).sum()) or 1.0
+            fit[worst] = 1.0
+        centers = (sums / norms[:, None]).astype('float32')
+    labels, fit = nearest(centers)
+
+    # Renumber by size, largest cluster first
+    sizes = np.bincount(labels, minlength=len(centers))
+    order = np.argsort(-sizes, kind='stable')
+    labels = np.argsort(order)[labels].astype('int32')
+
+    means = profiles.usage.mean(axis=1, keepdims=True)
+    relative = np.divide(profiles.usage, means, out=np.zeros(profiles.usage.shape, dtype='float32'), where=means > 0)
+    shapes = np.zeros((len(centers), relative.shape[1]), dtype='float64')
+    np.add.at(shapes, labels, relative)
+    shapes /= np.maximum(np.bincount(labels, minlength=len(centers)), 1)[:, None]
+    return labels, fit, shapes.astype('float32')
+
+
+def cluster_summary(profiles, clustering):
+    # One row per cluster: its size, its most typical meter and how closely its members follow it
+    labels, fit, _ = clustering
+    rows = []
+    for cluster in range(int(labels.max()) + 1 if len(labels) else 0):
+        members = np.flatnonzero(labels == cluster)
+        if len(members) == 0:
+            continue
+        rows.append({
+            'cluster': cluster + 1,
+            'meters': len(members),
+            'typical_meter': profiles.sites[members[fit[members].argmax()]],
+            'mean_correlation': float(fit[members].mean())
+        })
+    return pd.DataFrame(rows)
+
+
+def covariates_path():
+    return os.environ.get(COVARIATES_ENV) or None
+
+
+def load_covariates(path):
+    # Covariate values keyed by 'timestamp' (from a 'timestamp' or 'date' column) or 'year'
+    extension = os.path.splitext(path)[1].lower()
+    frame = pd.read_parquet(path) if extension in ('.parquet', '.pq') else pd.read_csv(path)
+    for column in ['timestamp', 'date']:
+        if column in frame.columns:
+            frame = frame.rename(columns={column: 'timestamp'})
+            frame['timestamp'] = pd.to_datetime(frame['timestamp'])
+            break
+    else:
+        if 'year' not in frame.columns:
+            raise ValueError("Covariates need a 'timestamp', 'date' or 'year' column")
+    names = [
+        column for column in frame.columns
+        if column not in ('timestamp', 'year') and pd.api.types.is_numeric_dtype(frame[column])
+    ]
+    if not names:
+        raise ValueError("Covariates need at least one numeric column besides the time column")
+    return frame, names
+
+
+def covariate_correlations(profiles, covariates, block_rows=CORRELATION_BLOCK_ROWS):
+    # Correlation of every meter's profile, and of the portfolio total, with each covariate
+    # averaged over the same periods; periods a covariate doesn't cover are left out.
+    # Returns (meters x covariates frame, portfolio Series).
+    frame, names = covariates
+    if profiles.stride is None:
+        if 'year' in frame.columns:
+            keys = frame['year'].astype('int64')
+        else:
+            keys = frame['timestamp'].dt.year
+        means = frame[names].groupby(keys.to_numpy()).mean().reindex(profiles.starts)
+    else:
+        if 'timestamp' not in frame.columns:
+            raise ValueError("Covariates for interval readings need a 'timestamp' or 'date' column")
+        offsets = (frame['timestamp'].dt.floor('D') - profiles.first_day).dt.days.to_numpy()
+        means = frame[names].groupby(offsets // profiles.stride).mean().reindex(range(len(profiles.starts)))
+
+    meters = np.full((len(profiles.sites), len(names)), np.nan, dtype='float32')
+    portfolio = {}
+    total = profiles.usage.sum(axis=0, dtype='float64')
+    for column, name in enumerate(names):
+        values = means[name].to_numpy(dtype='float64')
+        covered = ~np.isnan(values)
+        if covered.sum() < 3:
+            portfolio[name] = np.nan
+            continue
+        covariate = values[covered] - values[covered].mean()
+        spread = np.sqrt((covariate ** 2).sum())
+        if spread == 0:
+            portfolio[name] = np.nan
+            continue
+        covariate /= spread
+
+        # r = (centered usage . scaled covariate) / length of centered usage, by block
+        for start in range(0, len(meters), block_rows):
+            block = profiles.usage[start:start + block_rows][:, covered].astype('float64')
+            block -= block.mean(axis=1, keepdims=True)
+            norms = np.sqrt((block ** 2).sum(axis=1))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                meters[start:start + block_rows, column] = np.where(norms > 0, block @ covariate / norms, np.nan)
+        centered = total[covered] - total[covered].mean()
+        length = np.sqrt((centered ** 2).sum())
+        portfolio[name] = float(centered @ covariate / length) if length > 0 else np.nan
+
+    return pd.DataFrame(meters, index=profiles.sites, columns=names), pd.Series(portfolio)
+
+
+class SimilarityCache(LRUCache):
+    # Profiles, correlations, clusterings and covariate correlations keyed by dataset
+    # version (and options), sized by their arrays and frames
+
+    def size_of(self, value):
+        parts = value if isinstance(value, tuple) else (value,)
+        size = 0
+        for part in parts:
+            if isinstance(part, pd.DataFrame):
+                size += int(part.memory_usage(deep=True).sum())
+            elif isinstance(part, pd.Series):
+                size += int(part.memory_usage(deep=True))
+            else:
+                size += int(getattr(part, 'nbytes', 0))
+        return size
+
+
+SIMILARITY = SimilarityCache(SIMILARITY_CACHE_BYTES)
@@ -0,0 +1,68 @@
+import numpy as np
+
+from data_sources import compact_frame
+from range_queries import RangeQueries
+from stats import add_yoy_changes, compute_grouped_stats, stats_row
+
+ALL_SITES = 'All sites'
+
+# Selection levels offered in the sidebar, from widest to narrowest
+LEVELS = ['all', 'site_group', 'site']
+
+VIEW_COLUMNS = ['year', 'usage', 'cost', 'costPerUnit', 'usage_change', 'cost_change']
+
+
+class SiteRollups:
+    # Year-level frames and stats for every group and every site, built with one vectorized
+    # pass per level when the dataset is loaded. Switching the sidebar selection is then a
+    # slice of a precomputed frame and a row lookup; raw readings are never touched again.
+
+    def __init__(self, site_yearly):
+        self.site_yearly = site_yearly
+        self.frames = {}
+        self.spans = {}
+        self.stats = {}
+        self.ranges = {}
+
+        self._build_level('site', site_yearly)
+        self._build_level('site_group', group_yearly(site_yearly))
+
+        self.sites = list(self.spans['site'])
+        self.groups = list(self.spans['site_group'])
+
+    def _build_level(self, level, frame):
+        frame = compact_frame(add_yoy_changes(frame.reset_index(drop=True), by=level))
+        codes = frame[level].cat.codes.to_numpy()
+        present, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+        labels = frame[level].cat.categories[present]
+
+        self.frames[level] = frame
+        self.spans[level] = {
+            label: (int(start), int(start + count)) for label, start, count in zip(labels, starts, counts)
+        }
+        self.stats[level] = compute_grouped_stats(frame, level)
+        self.ranges[level] = RangeQueries(frame, max_span=counts.max())
+
+    def options(self, level):
+        return self.sites if level == 'site' else self.groups
+
+    def select(self, level, key, years=None):
+        # Frame and stats for one group or site, optionally limited to a (first, last) year range
+        start, stop = self.spans[level][key]
+        if years is None:
+            stats = stats_row(self.stats[level], key)
+        else:
+            ranges = self.ranges[level]
+            start, stop = ranges.positions(years[0], years[1], start, stop)
+            stats = ranges.stats(start, stop)
+        df = self.frames[level].iloc[start:stop][VIEW_COLUMNS].reset_index(drop=True)
+        return df, stats
+
+
+def group_yearly(site_yearly):
+    # Per-group yearly totals from the per-site rows
+    totals = site_yearly.groupby(['site_group', 'year'], observed=True, sort=True)[['usage', 'cost']].sum()
+    totals = totals.reset_index()
+    totals['costPerUnit'] = totals['cost'] / totals['usage']
+    totals['site_group'] = totals['site_group'].astype('category')
+    return compact_frame(totals)
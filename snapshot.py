@@ -0,0 +1,179 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import zipfile
+
+import numpy as np
+import plotly.graph_objects as go
+
+from data_sources import default_source
+from dataset_store import STORE, Dataset
+from figure_cache import FIGURES, figure_key
+from figures import combined_figure, year_over_year_figure
+from sites import SiteRollups
+from timing import span
+
+# Prebuilt snapshots for fast cold starts. A snapshot holds a loaded dataset's frames and
+# stats, plus the figures of the first page a new session sees, serialized. A worker
+# started with one seeds its dataset store and figure cache from the file. The first
+# session then skips reading and aggregating the readings and building those figures, and
+# never imports plotly.express. Each frame is stored as an uncompressed Arrow IPC member
+# of a zip archive, next to a JSON manifest.
+#
+#     WATER_USAGE_DATA=readings.parquet python snapshot.py snapshot.zip
+#     WATER_USAGE_DATA=readings.parquet WATER_USAGE_SNAPSHOT=snapshot.zip streamlit run app.py
+#
+# A snapshot records the version of the source it was built from. When the source has
+# changed since, the snapshot is ignored and the data is loaded from the source as usual.
+
+SNAPSHOT_ENV = 'WATER_USAGE_SNAPSHOT'
+
+# Bumped whenever the layout of the archive changes; older snapshots are ignored
+SNAPSHOT_FORMAT = 1
+
+# Figures on the first page: the default tab and the year-over-year chart, for the whole
+# portfolio and every year
+SNAPSHOT_VIEWS = {
+    'combined': lambda df: combined_figure(df, f"{int(df['year'].iloc[0])}-{int(df['year'].iloc[-1])}"),
+    'year_over_year': year_over_year_figure
+}
+
+logger = logging.getLogger('water_usage.snapshot')
+
+# Snapshot paths this process has already booted from (or found stale)
+_booted = set()
+_boot_lock = threading.Lock()
+
+
+def _encode_stat(value):
+    # NumPy scalars keep their dtype through the JSON manifest
+    if isinstance(value, np.generic):
+        return [value.item(), value.dtype.name]
+    return [value, None]
+
+
+def _decode_stat(encoded):
+    value, dtype = encoded
+    return value if dtype is None else np.dtype(dtype).type(value)
+
+
+def _frame_bytes(frame):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(frame)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _read_frame(data):
+    import pyarrow as pa
+    return pa.ipc.open_file(pa.py_buffer(data)).read_all().to_pandas()
+
+
+def write_snapshot(source, path):
+    # Load the source (or reuse its loaded dataset) and write its snapshot to `path`
+
+    # Imported for its side effect: the figures get the plotly template Streamlit installs
+    # when it is imported, exactly as when the dashboard builds them
+    import streamlit  # noqa: F401
+
+    dataset = STORE.get(source)
+    frames = {
+        'df': dataset.df,
+        'site_yearly': dataset.rollups.site_yearly if dataset.rollups is not None else None,
+        'series': dataset.series
+    }
+    frames = {name: frame for name, frame in frames.items() if frame is not None}
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'source_key': list(dataset.source_key),
+        'stats': {name: _encode_stat(value) for name, value in dataset.stats.items()},
+        'frames': list(frames),
+        'figures': {view: build(dataset.df).to_json() for view, build in SNAPSHOT_VIEWS.items()}
+    }
+
+    # Written under a temporary name and renamed, so a booting worker never reads a partial file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with zipfile.ZipFile(temporary, 'w', zipfile.ZIP_STORED) as archive:
+        for name, frame in frames.items():
+            archive.writestr(f"{name}.arrow", _frame_bytes(frame))
+        archive.writestr('manifest.json', json.dumps(manifest))
+    os.replace(temporary, path)
+    return manifest
+
+
+def read_snapshot(path, source_key=None):
+    # (manifest, frames) of a snapshot, or None when it has another format or, given a
+    # source key, was built from another version of the source. Frames are only read
+    # when the manifest matches.
+    with zipfile.ZipFile(path) as archive:
+        manifest = json.loads(archive.read('manifest.json'))
+        if manifest.get('format') != SNAPSHOT_FORMAT:
+            return None
+        if source_key is not None and tuple(manifest['source_key']) != tuple(source_key):
+            return None
+        frames = {name: _read_frame(archive.read(f"{name}.arrow")) for name in manifest['frames']}
+    return manifest, frames
+
+
+def boot_snapshot(source, path=None):
+    # Seed the dataset store and figure cache from the configured snapshot, once per
+    # process. Returns the seeded dataset, or None when there is no usable snapshot.
+    path = path or os.environ.get(SNAPSHOT_ENV)
+    if not path:
+        return None
+    with _boot_lock:
+        if path in _booted:
+            return None
+        _booted.add(path)
+
+        key = source.cache_key()
+        with span('snapshot_boot'):
+            try:
+                snapshot = read_snapshot(path, key)
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile) as error:
+                logger.warning("Couldn't read snapshot %s: %s", path, error)
+                return None
+            if snapshot is None:
+                logger.warning("Snapshot %s was built from other data; loading from the source", path)
+                return None
+            manifest, frames = snapshot
+
+            def build(version):
+                stats = {name: _decode_stat(value) for name, value in manifest['stats'].items()}
+                site_yearly = frames.get('site_yearly')
+                rollups = SiteRollups(site_yearly) if site_yearly is not None else None
+                return Dataset(version, key, frames['df'], stats, rollups, frames.get('series'))
+
+            dataset = STORE.seed(key, build)
+            # The figures were validated when they were built, so they are restored as is
+            for view, spec in manifest['figures'].items():
+                FIGURES.put(figure_key(view, dataset.version), go.Figure(json.loads(spec), _validate=False))
+        return dataset
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write a snapshot of the dashboard's data source for fast cold starts."
+    )
+    parser.add_argument('path', help="Snapshot file to write, e.g. snapshot.zip")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The same source the dashboard opens, so the snapshot's source version matches
+    manifest = write_snapshot(default_source(), args.path)
+    print(
+        f"Wrote {args.path}: {', '.join(manifest['frames'])} frames and "
+        f"{', '.join(manifest['figures'])} figures for {manifest['source_key'][0]}"
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,302 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+
+import pandas as pd
+
+from backing_store import backing_dir
+from data_sources import (
+    READING_CHUNK_ROWS, ArrowSource, CSVSource, DataSource, ParquetSource, aggregate_series, aggregate_site_yearly,
+    aggregate_yearly, yearly_from_sites
+)
+
+# Optional embedded query backend for meter exports larger than memory. The readings are
+# never loaded into pandas: the year, site-year and per-timestamp totals the dashboard
+# keeps are GROUP BY queries, and the meter-level table pages are filtered, sorted and
+# limited in SQL, so only the rows on the page come back. DuckDB queries the Parquet or
+# CSV file in place; SQLite, which needs nothing beyond the standard library, first copies
+# the readings into an indexed database file next to the backing store, chunk by chunk.
+#
+#     WATER_USAGE_SQL_BACKEND=duckdb WATER_USAGE_DATA=readings.parquet streamlit run app.py
+
+# Environment variable choosing the backend: 'duckdb' or 'sqlite'
+SQL_BACKEND_ENV = 'WATER_USAGE_SQL_BACKEND'
+
+SQL_BACKENDS = ['duckdb', 'sqlite']
+
+# Reading columns offered for sorting and filtering meter-level pages, and their SQL
+TABLE_COLUMNS = {
+    'timestamp': 'ts',
+    'year': 'year',
+    'site': 'site',
+    'usage': 'usage',
+    'cost': 'cost'
+}
+
+
+def _digest(value):
+    return hashlib.sha1(repr(value).encode()).hexdigest()[:16]
+
+
+def _quote(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+class DuckDBEngine:
+    # Queries the source file in place through a `readings` view
+
+    def __init__(self, source, columns):
+        import duckdb
+        self.connection = duckdb.connect()
+        self.lock = threading.Lock()
+
+        if isinstance(source, ParquetSource):
+            scan = f"read_parquet({_quote(source.path)}, file_row_number = true)"
+            reading = 'file_row_number'
+        elif isinstance(source, CSVSource):
+            scan = f"read_csv_auto({_quote(source.path)})"
+            reading = 'row_number() OVER ()'
+        else:
+            import pyarrow.dataset as ds
+            self.connection.register('arrow_readings', ds.dataset(source.path, format='ipc'))
+            scan = 'arrow_readings'
+            reading = 'row_number() OVER ()'
+
+        year = 'year' if 'year' in columns else 'year("timestamp")'
+        selected = [f'{reading} AS reading', f'CAST({year} AS BIGINT) AS year']
+        if 'timestamp' in columns:
+            selected.append('epoch_ns(CAST("timestamp" AS TIMESTAMP)) AS ts')
+        selected += [
+            f'CAST({column} AS VARCHAR) AS {column}' for column in ['site', 'site_group'] if column in columns
+        ]
+        selected += [f'CAST({column} AS DOUBLE) AS {column}' for column in ['usage', 'cost', 'costPerUnit'] if column in columns]
+        self.connection.execute(f"CREATE VIEW readings AS SELECT {', '.join(selected)} FROM {scan}")
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, list(params)).df()
+
+
+class SQLiteEngine:
+    # Queries a copy of the readings in an SQLite file, built once per source version.
+    # Other processes serving the same file reuse it.
+
+    def __init__(self, source, columns, chunk_rows=READING_CHUNK_ROWS):
+        directory = backing_dir() or os.path.join(tempfile.gettempdir(), 'water-usage-sql')
+        os.makedirs(directory, exist_ok=True)
+        # Named after the source (path) and the version (mtime and size) it holds
+        key = source.cache_key()
+        self.prefix = f"readings-{_digest(key[:2])}-"
+        self.path = os.path.join(directory, f"{self.prefix}{_digest(key)}.sqlite")
+        if not os.path.exists(self.path):
+            self._build(source, columns, chunk_rows)
+            self._remove_old_versions(directory)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def _build(self, source, columns, chunk_rows):
+        # Written under a temporary name and renamed, so no process sees a partial file
+        partial = f"{self.path}.{os.getpid()}.partial"
+        connection = sqlite3.connect(partial)
+        try:
+            definitions = ['reading INTEGER PRIMARY KEY', 'year INTEGER NOT NULL']
+            if 'timestamp' in columns:
+                definitions.append('ts INTEGER')
+            definitions += [f'{column} TEXT' for column in ['site', 'site_group'] if column in columns]
+            definitions += [f'{column} REAL' for column in ['usage', 'cost', 'costPerUnit'] if column in columns]
+            connection.execute(f"CREATE TABLE readings ({', '.join(definitions)})")
+
+            for chunk in source.iter_readings(columns, chunk_rows):
+                rows = pd.DataFrame(index=chunk.index)
+                if 'year' in chunk.columns:
+                    rows['year'] = chunk['year'].astype('int64')
+                else:
+                    rows['year'] = pd.DatetimeIndex(chunk['timestamp']).year.astype('int64')
+                if 'timestamp' in chunk.columns:
+                    rows['ts'] = pd.to_datetime(chunk['timestamp']).astype('datetime64[ns]').astype('int64')
+                for column in ['site', 'site_group']:
+                    if column in chunk.columns:
+                        rows[column] = chunk[column].astype(object).where(chunk[column].notna(), None)
+                for column in ['usage', 'cost', 'costPerUnit']:
+                    if column in chunk.columns:
+                        rows[column] = chunk[column].astype('float64')
+                rows.to_sql('readings', connection, if_exists='append', index=False)
+
+            connection.execute("CREATE INDEX readings_year ON readings (year)")
+            if 'site' in columns:
+                connection.execute("CREATE INDEX readings_site ON readings (site, year)")
+            if 'timestamp' in columns:
+                connection.execute("CREATE INDEX readings_ts ON readings (ts)")
+            # Sorted and filtered table pages walk these instead of sorting every reading
+            connection.execute("CREATE INDEX readings_usage ON readings (usage)")
+            connection.execute("CREATE INDEX readings_cost ON readings (cost)")
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(partial, self.path)
+
+    def _remove_old_versions(self, directory):
+        # Databases (and their journals) of older versions of the same source, like the
+        # backing store's files. Processes with one open keep reading it until they close
+        # it. Partial files are left to the process building them.
+        current = os.path.basename(self.path)
+        for name in os.listdir(directory):
+            if name.startswith(self.prefix) and not name.startswith(current) and not name.endswith('.partial'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return pd.read_sql_query(sql, self.connection, params=list(params))
+
+
+# Query engines, one per source file
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+class SQLSource(DataSource):
+    # A meter export answered by an embedded SQL engine. Loading runs aggregate queries
+    # instead of reading the file; chunked scans (anomalies, tariffs) read the file as usual.
+
+    backed = True
+    queryable = True
+
+    def __init__(self, source, backend='duckdb'):
+        if backend not in SQL_BACKENDS:
+            raise ValueError(f"Unknown SQL backend '{backend}'. Expected one of: {', '.join(SQL_BACKENDS)}")
+        if not isinstance(source, (ParquetSource, CSVSource, ArrowSource)):
+            raise ValueError("The SQL backend needs a Parquet, CSV or Arrow file")
+        self.source = source
+        self.path = source.path
+        self.backend = backend
+
+    def cache_key(self):
+        return (type(self).__name__, self.path) + self.source.cache_key()[2:] + (self.backend,)
+
+    def columns(self):
+        return self.source.columns()
+
+    def read(self):
+        return self.source.read()
+
+    def iter_readings(self, columns, chunk_rows=READING_CHUNK_ROWS):
+        return self.source.iter_readings(columns, chunk_rows)
+
+    def engine(self):
+        # One engine per file version, shared by every rerun and session; a rewritten file
+        # gets a new one
+        key = self.cache_key()
+        with _engines_lock:
+            engine = _engines.get(key[:2])
+            if engine is None or engine[0] != key:
+                columns = self.columns()
+                if 'year' not in columns and 'timestamp' not in columns:
+                    raise ValueError("Readings need either a 'timestamp' or a 'year' column")
+                if self.backend == 'duckdb':
+                    engine = (key, DuckDBEngine(self.source, columns))
+                else:
+                    engine = (key, SQLiteEngine(self.source, columns))
+                _engines[key[:2]] = engine
+            return engine[1]
+
+    def aggregate(self):
+        # The same frames DataSource.aggregate builds, from totals computed in SQL. The
+        # pandas aggregation then runs on one row per year (or site-year, or timestamp).
+        engine = self.engine()
+        columns = self.columns()
+
+        series = None
+        if 'timestamp' in columns:
+            totals = engine.query(
+                "SELECT ts, SUM(usage) AS usage, SUM(cost) AS cost FROM readings GROUP BY ts ORDER BY ts"
+            )
+            totals['timestamp'] = pd.to_datetime(totals['ts'].astype('int64'))
+            series = aggregate_series(totals)
+
+        if 'site' in columns:
+            totals = engine.query(
+                "SELECT site, year, SUM(usage) AS usage, SUM(cost) AS cost "
+                "FROM readings WHERE site IS NOT NULL GROUP BY site, year ORDER BY site, year"
+            )
+            if 'site_group' in columns:
+                # Each site's group comes from its first reading, as when loading in pandas
+                first = engine.query(
+                    "SELECT site, site_group FROM readings "
+                    "WHERE reading IN (SELECT MIN(reading) FROM readings WHERE site IS NOT NULL GROUP BY site)"
+                )
+                totals['site_group'] = totals['site'].map(dict(zip(first['site'], first['site_group'])))
+            site_yearly = aggregate_site_yearly(totals)
+            return yearly_from_sites(site_yearly), site_yearly, series
+
+        # Annual exports with one row per year keep their published cost per unit
+        published = ", MAX(costPerUnit) AS costPerUnit" if 'costPerUnit' in columns else ""
+        totals = engine.query(
+            f"SELECT year, SUM(usage) AS usage, SUM(cost) AS cost, COUNT(*) AS readings{published} "
+            "FROM readings GROUP BY year ORDER BY year"
+        )
+        if published and (totals['readings'] > 1).any():
+            totals = totals.drop(columns='costPerUnit')
+        return aggregate_yearly(totals.drop(columns='readings')), None, series
+
+    def _where(self, sites=None, years=None, filter_column=None, low=None, high=None):
+        conditions = []
+        params = []
+        if sites is not None:
+            conditions.append(f"site IN ({', '.join('?' * len(sites))})")
+            params += [str(site) for site in sites]
+        if years is not None:
+            conditions.append("year BETWEEN ? AND ?")
+            params += [int(years[0]), int(years[1])]
+        if filter_column is not None:
+            column = TABLE_COLUMNS[filter_column]
+            if column == 'ts':
+                low = None if low is None else pd.Timestamp(low).value
+                high = None if high is None else pd.Timestamp(high).value
+            if low is not None:
+                conditions.append(f"{column} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"{column} <= ?")
+                params.append(high)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def count_readings(self, sites=None, years=None, filter_column=None, low=None, high=None):
+        where, params = self._where(sites, years, filter_column, low, high)
+        return int(self.engine().query(f"SELECT COUNT(*) AS readings FROM readings{where}", params).iloc[0, 0])
+
+    def readings_page(self, offset, limit, sites=None, years=None, sort_by=None, descending=False,
+                      filter_column=None, low=None, high=None):
+        # One page of meter-level readings, filtered, sorted and limited by the engine
+        columns = [column for column in TABLE_COLUMNS if column in self.table_columns()]
+        selected = ', '.join(TABLE_COLUMNS[column] for column in columns)
+        where, params = self._where(sites, years, filter_column, low, high)
+        order = f"{TABLE_COLUMNS[sort_by]} {'DESC' if descending else 'ASC'}, reading" if sort_by else "reading"
+        page = self.engine().query(
+            f"SELECT {selected} FROM readings{where} ORDER BY {order} LIMIT ? OFFSET ?",
+            params + [int(limit), int(offset)]
+        )
+        if 'ts' in page.columns:
+            page['ts'] = pd.to_datetime(page['ts'].astype('int64'))
+        page.columns = columns
+        return page
+
+    def table_columns(self):
+        columns = self.columns()
+        shown = [column for column in ['timestamp', 'year', 'site', 'usage', 'cost'] if column in columns]
+        # Timestamped readings get their year in SQL
+        if 'timestamp' in shown and 'year' not in shown:
+            shown.insert(1, 'year')
+        return shown
+
+
+def sql_source(source):
+    # The source behind the configured SQL backend, or the source itself when none is set
+    backend = os.environ.get(SQL_BACKEND_ENV)
+    if not backend:
+        return source
+    return SQLSource(source, backend)
@@ -0,0 +1,250 @@
+import numpy as np
+import pandas as pd
+
+from data_sources import reading_years
+
+
+def add_yoy_changes(df, by=None):
+    # Year-over-year percentage changes, computed within each `by` group when given
+    usage = df['usage'] if by is None else df.groupby(by, observed=True, sort=False)['usage']
+    cost = df['cost'] if by is None else df.groupby(by, observed=True, sort=False)['cost']
+    df['usage_change'] = usage.pct_change() * 100
+    df['cost_change'] = cost.pct_change() * 100
+    return df
+
+
+def compute_stats(df):
+    return {
+        'total_usage': df['usage'].sum(),
+        'total_cost': df['cost'].sum(),
+        'avg_usage': df['usage'].mean(),
+        'avg_cost': df['cost'].mean(),
+        'min_usage': df['usage'].min(),
+        'max_usage': df['usage'].max(),
+        'min_cost': df['cost'].min(),
+        'max_cost': df['cost'].max(),
+        'min_year_usage': int(df.loc[df['usage'].idxmin(), 'year']),
+        'max_year_usage': int(df.loc[df['usage'].idxmax(), 'year']),
+        'min_year_cost': int(df.loc[df['cost'].idxmin(), 'year']),
+        'max_year_cost': int(df.loc[df['cost'].idxmax(), 'year']),
+        'cost_per_unit_increase': ((df['costPerUnit'].iloc[-1] / df['costPerUnit'].iloc[0]) - 1) * 100
+    }
+
+
+def compute_grouped_stats(df, by):
+    # compute_stats for every `by` group at once. `df` must be sorted by (by, year) and have
+    # a default index. Returns a frame indexed by group with one column per stats key.
+    grouped = df.groupby(by, observed=True, sort=False)
+    stats = grouped.agg(
+        total_usage=('usage', 'sum'),
+        total_cost=('cost', 'sum'),
+        avg_usage=('usage', 'mean'),
+        avg_cost=('cost', 'mean'),
+        min_usage=('usage', 'min'),
+        max_usage=('usage', 'max'),
+        min_cost=('cost', 'min'),
+        max_cost=('cost', 'max')
+    )
+
+    # idxmin/idxmax return row labels, which are positions with a default index
+    years = df['year'].to_numpy()
+    stats['min_year_usage'] = years[grouped['usage'].idxmin().to_numpy()]
+    stats['max_year_usage'] = years[grouped['usage'].idxmax().to_numpy()]
+    stats['min_year_cost'] = years[grouped['cost'].idxmin().to_numpy()]
+    stats['max_year_cost'] = years[grouped['cost'].idxmax().to_numpy()]
+
+    cost_per_unit = grouped['costPerUnit']
+    stats['cost_per_unit_increase'] = ((cost_per_unit.last() / cost_per_unit.first()) - 1) * 100
+    return stats
+
+
+def stats_row(grouped_stats, key):
+    # One group's stats as the dict compute_stats returns, keeping each column's dtype
+    position = grouped_stats.index.get_loc(key)
+    row = {column: grouped_stats[column].iat[position] for column in grouped_stats.columns}
+    for column in YEAR_KEYS:
+        row[column] = int(row[column])
+    return row
+
+
+YEAR_KEYS = {'min_year_usage', 'max_year_usage', 'min_year_cost', 'max_year_cost'}
+
+STAT_KEYS = [
+    'total_usage', 'total_cost', 'avg_usage', 'avg_cost',
+    'min_usage', 'max_usage', 'min_cost', 'max_cost',
+    'min_year_usage', 'max_year_usage', 'min_year_cost', 'max_year_cost',
+    'cost_per_unit_increase'
+]
+
+
+class IncrementalStats:
+    # Keeps the year-level series and the summary stats up to date as readings are appended.
+    #
+    # Readings arrive in time order, so a batch can only touch the trailing (still open)
+    # year or add new years after it. Every earlier year is closed: its totals never change
+    # again, so it is folded into running totals and extrema once and never looked at
+    # afterwards. That keeps append() proportional to the batch size rather than the history.
+    #
+    # Each year keeps its raw sums, which batches are added to, and the rounded values the
+    # year-level frame shows (whole cubic feet and cents). Changes and stats are taken from
+    # the shown values, like compute_stats over add_yoy_changes(aggregate_yearly(readings)).
+
+    def __init__(self, yearly=None):
+        self.years = []
+        self.usage = []
+        self.cost = []
+        self.shown_usage = []
+        self.shown_cost = []
+        self.cost_per_unit = []
+        self.usage_change = []
+        self.cost_change = []
+
+        # Totals of the shown values over closed years only
+        self.closed_usage = 0
+        self.closed_cost = 0.0
+
+        # (value, year) extrema over closed years only
+        self.closed_min_usage = None
+        self.closed_max_usage = None
+        self.closed_min_cost = None
+        self.closed_max_cost = None
+
+        if yearly is not None:
+            # Seeded years are shown as given: the frame's values are already rounded
+            for row in yearly[['year', 'usage', 'cost', 'costPerUnit']].itertuples(index=False):
+                self._add_year(int(row.year), int(row.usage), float(row.cost), float(row.costPerUnit), rounded=False)
+
+    def append(self, readings, shown=None):
+        # `shown` optionally gives the frame's year, usage, cost and costPerUnit for the years
+        # the batch touches, e.g. summed from the per-site rows by yearly_from_sites, so the
+        # frame agrees with them; by default they're the batch's sums, rounded
+        if len(readings) == 0:
+            return self
+
+        years = reading_years(readings)
+        totals = readings[['usage', 'cost']].groupby(years.to_numpy(), sort=True).sum()
+        if self.years and totals.index[0] < self.years[-1]:
+            raise ValueError(
+                f"Readings for {int(totals.index[0])} arrived after {self.years[-1]}; only appends are supported"
+            )
+
+        if shown is not None:
+            shown = shown.set_index(shown['year'].astype('int64'))
+        for year, usage, cost in zip(totals.index, totals['usage'], totals['cost']):
+            year = int(year)
+            if self.years and year == self.years[-1]:
+                self._extend_open_year(float(usage), float(cost))
+            else:
+                self._add_year(year, float(usage), float(cost), float(cost) / float(usage))
+            if shown is not None and year in shown.index:
+                row = shown.loc[year]
+                self._restate_open_year(int(row['usage']), float(row['cost']), float(row['costPerUnit']))
+        return self
+
+    def _add_year(self, year, usage, cost, cost_per_unit, rounded=True):
+        # The previously open year is now complete
+        if self.years:
+            self._close_year(len(self.years) - 1)
+
+        self.years.append(year)
+        self.usage.append(usage)
+        self.cost.append(cost)
+        self.shown_usage.append(shown_usage(usage) if rounded else usage)
+        self.shown_cost.append(shown_cost(cost) if rounded else cost)
+        self.cost_per_unit.append(cost_per_unit)
+        self.usage_change.append(None)
+        self.cost_change.append(None)
+        self._update_trailing_changes()
+
+    def _extend_open_year(self, usage, cost):
+        self.usage[-1] += usage
+        self.cost[-1] += cost
+        self.shown_usage[-1] = shown_usage(self.usage[-1])
+        self.shown_cost[-1] = shown_cost(self.cost[-1])
+        self.cost_per_unit[-1] = self.cost[-1] / self.usage[-1]
+        self._update_trailing_changes()
+
+    def _restate_open_year(self, usage, cost, cost_per_unit):
+        self.shown_usage[-1] = usage
+        self.shown_cost[-1] = cost
+        self.cost_per_unit[-1] = cost_per_unit
+        self._update_trailing_changes()
+
+    def _update_trailing_changes(self):
+        # Only the open year's YoY change can move; earlier changes are between closed years
+        if len(self.years) < 2:
+            return
+        self.usage_change[-1] = (self.shown_usage[-1] / self.shown_usage[-2] - 1) * 100
+        self.cost_change[-1] = (self.shown_cost[-1] / self.shown_cost[-2] - 1) * 100
+
+    def _close_year(self, index):
+        year = self.years[index]
+        usage = self.shown_usage[index]
+        cost = self.shown_cost[index]
+        self.closed_usage += usage
+        self.closed_cost += cost
+        # Strict comparisons keep the earliest year on ties, like idxmin/idxmax
+        if self.closed_min_usage is None or usage < self.closed_min_usage[0]:
+            self.closed_min_usage = (usage, year)
+        if self.closed_max_usage is None or usage > self.closed_max_usage[0]:
+            self.closed_max_usage = (usage, year)
+        if self.closed_min_cost is None or cost < self.closed_min_cost[0]:
+            self.closed_min_cost = (cost, year)
+        if self.closed_max_cost is None or cost > self.closed_max_cost[0]:
+            self.closed_max_cost = (cost, year)
+
+    def _extreme(self, closed, open_value, smaller):
+        # Combine the closed-year extreme with the open year; ties go to the earlier closed year
+        open_extreme = (open_value, self.years[-1])
+        if closed is None:
+            return open_extreme
+        if smaller:
+            return open_extreme if open_value < closed[0] else closed
+        return open_extreme if open_value > closed[0] else closed
+
+    def stats(self):
+        if not self.years:
+            raise ValueError("No readings have been added yet")
+
+        count = len(self.years)
+        total_usage = self.closed_usage + self.shown_usage[-1]
+        total_cost = self.closed_cost + self.shown_cost[-1]
+        min_usage = self._extreme(self.closed_min_usage, self.shown_usage[-1], smaller=True)
+        max_usage = self._extreme(self.closed_max_usage, self.shown_usage[-1], smaller=False)
+        min_cost = self._extreme(self.closed_min_cost, self.shown_cost[-1], smaller=True)
+        max_cost = self._extreme(self.closed_max_cost, self.shown_cost[-1], smaller=False)
+        return {
+            'total_usage': total_usage,
+            'total_cost': total_cost,
+            'avg_usage': total_usage / count,
+            'avg_cost': total_cost / count,
+            'min_usage': min_usage[0],
+            'max_usage': max_usage[0],
+            'min_cost': min_cost[0],
+            'max_cost': max_cost[0],
+            'min_year_usage': min_usage[1],
+            'max_year_usage': max_usage[1],
+            'min_year_cost': min_cost[1],
+            'max_year_cost': max_cost[1],
+            'cost_per_unit_increase': ((self.cost_per_unit[-1] / self.cost_per_unit[0]) - 1) * 100
+        }
+
+    def frame(self):
+        # Year-level frame with change columns, in the same shape as the full recompute
+        return pd.DataFrame({
+            'year': np.asarray(self.years, dtype='int64'),
+            'usage': np.asarray(self.shown_usage, dtype='int64'),
+            'cost': np.asarray(self.shown_cost, dtype='float64'),
+            'costPerUnit': np.asarray(self.cost_per_unit, dtype='float64'),
+            'usage_change': np.asarray(self.usage_change, dtype='float64'),
+            'cost_change': np.asarray(self.cost_change, dtype='float64')
+        })
+
+
+def shown_usage(usage):
+    # Whole cubic feet, rounded like aggregate_yearly does
+    return int(np.round(usage))
+
+
+def shown_cost(cost):
+    return float(np.round(cost, 2))
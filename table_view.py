@@ -0,0 +1,57 @@
+import numpy as np
+
+from figure_cache import LRUCache
+
+PAGE_SIZES = [25, 50, 100, 500]
+
+# Upper bound on the size of all cached row orders
+ROW_ORDER_BYTES = 64 * 1024 * 1024
+
+
+class RowOrderCache(LRUCache):
+    # Filtered and sorted row positions, sized by their array
+
+    def size_of(self, positions):
+        return positions.nbytes
+
+
+def column_values(frame, column):
+    # Column as an array; a named index (e.g. reading timestamps) counts as a column
+    if column == frame.index.name:
+        return frame.index.to_numpy()
+    return frame[column].to_numpy()
+
+
+def ordered_positions(frame, sort_by=None, descending=False, filter_column=None, low=None, high=None):
+    # Row positions passing the filter, in display order. Only the filter and sort columns
+    # are read; no rows are materialized.
+    positions = np.arange(len(frame))
+    if filter_column is not None and (low is not None or high is not None):
+        values = column_values(frame, filter_column)
+        mask = np.ones(len(frame), dtype=bool)
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values <= high
+        positions = np.flatnonzero(mask)
+
+    if sort_by is not None:
+        values = column_values(frame, sort_by)[positions]
+        if descending:
+            # Reversing a stable sort of the reversed values keeps ties in row order, as
+            # ORDER BY column DESC, reading does
+            order = len(values) - 1 - np.argsort(values[::-1], kind='stable')[::-1]
+        else:
+            order = np.argsort(values, kind='stable')
+        positions = positions[order]
+    return positions
+
+
+def page_of(frame, positions, page, page_size):
+    # Materialize only the rows on the requested (1-based) page
+    start = (page - 1) * page_size
+    return frame.take(positions[start:start + page_size])
+
+
+# Shared by all sessions; keys carry the dataset version and filter state
+ROW_ORDERS = RowOrderCache(ROW_ORDER_BYTES)
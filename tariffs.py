@@ -0,0 +1,267 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_sources import READING_CHUNK_ROWS, compact_frame, yearly_from_sites
+from dataset_store import STORE, build_dataset
+from figure_cache import LRUCache
+from timing import span
+
+# Tariff scenarios: what the metered usage would have cost under a different rate structure.
+# Usage is billed per meter and calendar month, so block allowances and fixed charges apply
+# to each monthly bill the way a utility applies them. Monthly usage per meter is
+# aggregated from the readings once per dataset version; re-pricing it under a tariff is a
+# handful of vectorized array operations however many bills there are.
+
+TARIFF_CACHE_BYTES = 128 * 1024 * 1024
+
+# Months of a (meter, year, month) billing key; years fit in four digits
+KEY_MONTHS = 12
+KEY_YEARS = 10000
+
+
+class Tariff:
+    # A monthly rate structure: increasing-block volumetric rates, a fixed charge per
+    # bill and an optional multiplier on the volumetric charge in peak-season months.
+    # `blocks` is a list of (upper limit in cubic feet per month, rate per cubic foot);
+    # the last block has no upper limit, whatever limit it was given.
+
+    def __init__(self, name, blocks, fixed_charge=0.0, season_months=(), season_factor=1.0):
+        if not blocks:
+            raise ValueError("A tariff needs at least one block")
+        limits = [limit for limit, _ in blocks[:-1]]
+        rates = [rate for _, rate in blocks]
+        if any(limit is None or limit <= 0 for limit in limits):
+            raise ValueError("Every block but the last needs a positive upper limit")
+        if any(upper <= lower for lower, upper in zip(limits, limits[1:])):
+            raise ValueError("Block limits must increase from one block to the next")
+        if any(rate is None or rate < 0 for rate in rates):
+            raise ValueError("Block rates can't be negative")
+        if fixed_charge < 0:
+            raise ValueError("The fixed charge can't be negative")
+        if season_factor <= 0:
+            raise ValueError("The seasonal factor must be positive")
+        if any(month not in range(1, 13) for month in season_months):
+            raise ValueError("Season months run from 1 to 12")
+
+        self.name = name
+        # Lower bound of every block, and the charge for all usage below it
+        self.bounds = np.array([0.0] + [float(limit) for limit in limits])
+        self.rates = np.array(rates, dtype='float64')
+        self.base = np.concatenate([[0.0], np.cumsum(np.diff(self.bounds) * self.rates[:-1])])
+        self.fixed_charge = float(fixed_charge)
+        self.season_months = tuple(sorted(set(int(month) for month in season_months)))
+        self.season_factor = float(season_factor)
+
+    def key(self):
+        return (
+            tuple(self.bounds.tolist()), tuple(self.rates.tolist()), self.fixed_charge,
+            self.season_months, self.season_factor
+        )
+
+    def blocks(self):
+        limits = self.bounds[1:].tolist() + [None]
+        return list(zip(limits, self.rates.tolist()))
+
+    def volumetric(self, usage):
+        # Block charge of each monthly usage: the charge below its block plus its usage
+        # within the block at the block's rate
+        usage = np.maximum(np.asarray(usage, dtype='float64'), 0.0)
+        block = np.searchsorted(self.bounds, usage, side='right') - 1
+        return self.base[block] + (usage - self.bounds[block]) * self.rates[block]
+
+    def bills(self, usage, months):
+        charges = self.volumetric(usage)
+        if self.season_months and self.season_factor != 1.0:
+            charges = np.where(np.isin(months, self.season_months), charges * self.season_factor, charges)
+        return charges + self.fixed_charge
+
+
+TARIFF_PRESETS = {
+    'flat': Tariff("Flat rate", [(None, 0.15)]),
+    'tiered': Tariff("Three-tier conservation rate", [(5000, 0.12), (20000, 0.16), (None, 0.22)], fixed_charge=25.0),
+    'seasonal': Tariff(
+        "Seasonal tiers", [(5000, 0.12), (20000, 0.16), (None, 0.22)], fixed_charge=25.0,
+        season_months=(6, 7, 8, 9), season_factor=1.25
+    )
+}
+
+
+def monthly_usage(source, dataset, chunk_rows=READING_CHUNK_ROWS, store=STORE):
+    # Usage per meter and calendar month: 'year', 'month', 'usage' and, for multi-site
+    # data, 'site'. Each meter-year's usage in the dataset is split over its months in
+    # proportion to the timestamped readings, including those appended after the source
+    # was loaded; years without readings are billed as twelve equal months.
+    sites = dataset.rollups.site_yearly if dataset.rollups is not None else None
+    yearly = sites if sites is not None else dataset.df
+    keys = ['site', 'year'] if sites is not None else ['year']
+
+    months = yearly[keys + ['usage']].loc[yearly.index.repeat(KEY_MONTHS)].reset_index(drop=True)
+    months['month'] = np.tile(np.arange(1, KEY_MONTHS + 1, dtype='int8'), len(yearly))
+    months['year'] = months['year'].astype('int64')
+    if 'timestamp' not in source.columns():
+        months['usage'] = months['usage'] / KEY_MONTHS
+        return months
+
+    categories = sites['site'].cat.categories if sites is not None else None
+    shares = monthly_shares(source, dataset, categories, chunk_rows, store)
+    shares = shares.reindex(pd.MultiIndex.from_frame(months[keys + ['month']])).to_numpy()
+    # Meter-years the readings don't cover keep an even split
+    covered = pd.Series(~np.isnan(shares)).groupby([months[key] for key in keys], observed=True).transform('any')
+    months['usage'] = months['usage'] * np.where(covered.to_numpy(), np.nan_to_num(shares), 1 / KEY_MONTHS)
+    return months
+
+
+def monthly_totals(chunks, categories=None):
+    # Usage per billing key of the readings in `chunks`: year * 12 + month - 1, plus the
+    # site's code in `categories` times KEY_YEARS * 12 when there are site categories
+    partial = []
+    for chunk in chunks:
+        if categories is not None:
+            # Readings without a site are in no meter-year, as in the site rollups
+            chunk = chunk[chunk['site'].notna()]
+        timestamps = pd.DatetimeIndex(chunk['timestamp'])
+        keys = (timestamps.year.to_numpy().astype('int64') * KEY_MONTHS) + timestamps.month.to_numpy() - 1
+        if categories is not None:
+            site = chunk['site'].astype('category')
+            codes = categories.get_indexer(site.cat.categories)[site.cat.codes.to_numpy()]
+            keys = keys + codes.astype('int64') * KEY_YEARS * KEY_MONTHS
+        partial.append(chunk['usage'].groupby(keys).sum())
+    if not partial:
+        return pd.Series(dtype='float64')
+    return pd.concat(partial).groupby(level=0, sort=True).sum()
+
+
+class MonthlyTotals:
+    # Monthly totals of a source's readings, summed chunk by chunk once per source version
+    # and kept up to date with the readings appended to its dataset (see
+    # DatasetStore.scan). Keys refer to `sites`, which grows as appended readings bring new
+    # meters; None when the readings have no sites.
+
+    def __init__(self, source, sites, chunk_rows=READING_CHUNK_ROWS):
+        self.columns = ['timestamp', 'usage'] + (['site'] if sites is not None else [])
+        self.sites = sites
+        self.totals = monthly_totals(source.iter_readings(self.columns, chunk_rows), sites)
+        self.lock = threading.Lock()
+
+    def append(self, readings):
+        # Readings without timestamps can't be placed in a month
+        if 'timestamp' not in readings.columns:
+            return
+        with self.lock:
+            if self.sites is not None:
+                arrived = pd.Index(np.asarray(readings['site'].dropna().unique()))
+                self.sites = self.sites.append(arrived.difference(self.sites))
+            update = monthly_totals([readings[self.columns]], self.sites)
+            self.totals = pd.concat([self.totals, update]).groupby(level=0, sort=True).sum()
+
+    def totals_for(self, categories):
+        # The totals with site codes in `categories`, e.g. a dataset version's site categories
+        with self.lock:
+            totals, sites = self.totals, self.sites
+        if categories is None or sites.equals(categories):
+            return totals
+        keys = totals.index.to_numpy()
+        site_keys = KEY_YEARS * KEY_MONTHS
+        codes = categories.get_indexer(sites)[keys // site_keys]
+        kept = codes >= 0
+        index = codes[kept].astype('int64') * site_keys + keys[kept] % site_keys
+        return pd.Series(totals.to_numpy()[kept], index=index).sort_index()
+
+    def nbytes(self):
+        size = int(self.totals.memory_usage(deep=True))
+        return size if self.sites is None else size + int(self.sites.memory_usage(deep=True))
+
+
+def monthly_shares(source, dataset, categories=None, chunk_rows=READING_CHUNK_ROWS, store=STORE):
+    # Each month's share of its meter-year's usage in the readings, including those
+    # appended to the dataset since the source was loaded. Indexed by (site, year, month),
+    # or (year, month) without site categories.
+    scan = store.scan(dataset, ('monthly_totals',), lambda: MonthlyTotals(source, categories, chunk_rows))
+    totals = scan.totals_for(categories)
+
+    keys = totals.index.to_numpy()
+    levels = [keys // KEY_MONTHS % KEY_YEARS, keys % KEY_MONTHS + 1]
+    names = ['year', 'month']
+    if categories is not None:
+        levels.insert(0, pd.Categorical.from_codes(keys // (KEY_YEARS * KEY_MONTHS), categories))
+        names.insert(0, 'site')
+    usage = totals.to_numpy().astype('float64')
+    year_totals = pd.Series(usage).groupby(keys // KEY_MONTHS).transform('sum').to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(year_totals > 0, usage / year_totals, 1 / KEY_MONTHS)
+    return pd.Series(shares, index=pd.MultiIndex.from_arrays(levels, names=names))
+
+
+def reprice(dataset, months, tariff):
+    # A dataset with the same usage and every cost replaced by the tariff's bills, down to
+    # its reading-level totals. It gets its own version, so figures, forecasts and
+    # milestones are cached per scenario too.
+    charges = pd.Series(tariff.bills(months['usage'].to_numpy(), months['month'].to_numpy()))
+    version = (dataset.version, 'tariff', tariff.key())
+
+    if 'site' in months.columns:
+        bills = charges.groupby([months['site'], months['year']], observed=True).sum()
+        site_yearly = dataset.rollups.site_yearly
+        rows = pd.MultiIndex.from_arrays([site_yearly['site'], site_yearly['year'].astype('int64')])
+        # Costs are kept to the cent per meter-year, as aggregate_site_yearly keeps them
+        cost = bills.reindex(rows, fill_value=0.0).round(2).to_numpy()
+        site_yearly = site_yearly.assign(cost=cost, costPerUnit=cost / site_yearly['usage'].to_numpy())
+        site_yearly = compact_frame(site_yearly)
+        yearly = yearly_from_sites(site_yearly)
+    else:
+        bills = charges.groupby(months['year'].to_numpy()).sum()
+        yearly = dataset.df[['year', 'usage']].copy()
+        cost = bills.reindex(yearly['year'].astype('int64').to_numpy(), fill_value=0.0).round(2).to_numpy()
+        yearly['cost'] = cost
+        yearly['costPerUnit'] = cost / yearly['usage'].to_numpy()
+        yearly = compact_frame(yearly)
+        site_yearly = None
+
+    series = None
+    if dataset.series is not None:
+        series = reprice_series(dataset.series, months, charges)
+    return build_dataset(version, dataset.source_key, yearly, site_yearly, series)
+
+
+def reprice_series(series, months, charges):
+    # Reading-level totals with the usage kept and every calendar month's bills spread over
+    # its readings in proportion to their usage (evenly over a month without usage), so
+    # monthly and yearly sums of the costs are the scenario's
+    keys = months['year'].to_numpy() * KEY_MONTHS + months['month'].to_numpy().astype('int64') - 1
+    bills = charges.groupby(keys).sum()
+    index = series.index
+    reading_keys = index.year.to_numpy().astype('int64') * KEY_MONTHS + index.month.to_numpy() - 1
+    usage = series['usage'].to_numpy(dtype='float64')
+    grouped = pd.Series(usage).groupby(reading_keys)
+    month_usage = grouped.transform('sum').to_numpy()
+    month_readings = grouped.transform('size').to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(month_usage > 0, usage / month_usage, 1 / month_readings)
+    cost = bills.reindex(reading_keys, fill_value=0.0).to_numpy() * shares
+    return series.assign(cost=cost.astype(series['cost'].dtype))
+
+
+def scenario_dataset(source, dataset, tariff):
+    # The dataset re-priced under a tariff; monthly usage and each scenario are cached
+    with span('tariff_billing_usage'):
+        months = TARIFFS.get_or_build(('billing', dataset.version), lambda: monthly_usage(source, dataset))
+    with span('tariff_reprice'):
+        return TARIFFS.get_or_build(('tariff', dataset.version, tariff.key()), lambda: reprice(dataset, months, tariff))
+
+
+class TariffCache(LRUCache):
+    # Monthly billing usage and re-priced datasets keyed by dataset version (and tariff);
+    # sized by their frames
+
+    def size_of(self, value):
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(deep=True).sum())
+        frames = [value.df]
+        if value.rollups is not None:
+            frames += [value.rollups.site_yearly] + list(value.rollups.frames.values())
+        return int(sum(frame.memory_usage(deep=True).sum() for frame in frames))
+
+
+TARIFFS = TariffCache(TARIFF_CACHE_BYTES)
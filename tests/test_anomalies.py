@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from anomalies import AnomalyDetector
+
+DAYS = 40
+
+
+def planted_readings(seed=0):
+    # Hourly readings of three meters for DAYS days, sorted by time as exports are. Meter B
+    # has one spike on day 20; meter C leaks from day 32 on, which more than triples its
+    # night flow but stays within the noise of its daytime readings.
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range('2023-03-01', periods=24 * DAYS, freq='h')
+    hours = timestamps.hour.to_numpy()
+    night = (hours >= 1) & (hours < 5)
+    frames = []
+    for site in ['A', 'B', 'C']:
+        usage = np.where(night, 2.0 + rng.uniform(0, 0.5, len(timestamps)), 10.0 + rng.uniform(0, 8, len(timestamps)))
+        if site == 'B':
+            usage[24 * 20 + 14] = 200.0
+        if site == 'C':
+            usage[24 * 32:] += 6.0
+        frames.append(pd.DataFrame({'timestamp': timestamps, 'site': site, 'usage': usage}))
+    return pd.concat(frames).sort_values(['timestamp', 'site'], ignore_index=True)
+
+
+def scan(readings, chunk_rows):
+    detector = AnomalyDetector()
+    for start in range(0, len(readings), chunk_rows):
+        detector.update(readings.iloc[start:start + chunk_rows])
+    return detector.finish()
+
+
+@pytest.fixture(scope='module')
+def readings():
+    return planted_readings()
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 7, 1000])
+def test_chunking_does_not_change_the_flags(readings, chunk_rows):
+    # Compared with the whole file as one chunk
+    pd.testing.assert_frame_equal(scan(readings, chunk_rows), scan(readings, len(readings)))
+
+
+def test_planted_spike_and_leak_are_flagged(readings):
+    events = scan(readings, len(readings))
+    spikes = events[events['kind'] == 'spike']
+    assert spikes['site'].tolist() == ['B']
+    assert spikes['start'].iloc[0] == pd.Timestamp('2023-03-21 14:00')
+    assert spikes['peak'].iloc[0] == 200.0
+
+    leaks = events[events['kind'] == 'leak']
+    assert leaks['site'].tolist() == ['C']
+    assert leaks['start'].iloc[0] == pd.Timestamp('2023-04-02')
+    assert leaks['count'].iloc[0] == DAYS - 32
+
+
+def test_readings_out_of_time_order_are_rejected(readings):
+    detector = AnomalyDetector().update(readings.iloc[100:200])
+    with pytest.raises(ValueError, match='out of time order'):
+        detector.update(readings.iloc[:50])
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from anomalies import dataset_events
+from data_sources import open_source
+from dataset_store import DatasetStore
+from similarity import meter_profiles
+from tariffs import monthly_shares
+
+
+def hourly_readings(sites, start, hours, seed):
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(start, periods=hours, freq='h')
+    usage = rng.uniform(1, 10, (len(timestamps), len(sites))).round(2)
+    readings = pd.DataFrame({
+        'timestamp': np.repeat(timestamps, len(sites)),
+        'site': np.tile(sites, len(timestamps)),
+        'usage': usage.reshape(-1)
+    })
+    readings['cost'] = (readings['usage'] * 0.12).round(4)
+    return readings
+
+
+@pytest.fixture
+def appended(tmp_path):
+    # A source, two batches appended to it (the second bringing a new meter) and the same
+    # readings written as one file
+    initial = hourly_readings(['A', 'B', 'C'], '2021-11-01', 24 * 200, seed=1)
+    batches = [
+        hourly_readings(['A', 'B', 'C'], '2022-05-20', 24 * 30, seed=2),
+        hourly_readings(['A', 'B', 'C', 'D'], '2022-06-19', 24 * 45, seed=3)
+    ]
+    initial.to_parquet(tmp_path / 'initial.parquet')
+    pd.concat([initial] + batches, ignore_index=True).to_parquet(tmp_path / 'full.parquet')
+    return open_source(str(tmp_path / 'initial.parquet')), batches, open_source(str(tmp_path / 'full.parquet'))
+
+
+def scans(source, dataset, store, cells=8_000_000):
+    categories = dataset.rollups.site_yearly['site'].cat.categories
+    return (
+        dataset_events(source, dataset, store),
+        monthly_shares(source, dataset, categories, store=store),
+        meter_profiles(source, dataset, cells=cells, store=store)
+    )
+
+
+def assert_scans_equal(actual, expected):
+    events, shares, profiles = actual
+    expected_events, expected_shares, expected_profiles = expected
+    pd.testing.assert_frame_equal(events, expected_events)
+    pd.testing.assert_series_equal(shares, expected_shares)
+    assert profiles.sites.equals(expected_profiles.sites)
+    assert profiles.starts.equals(expected_profiles.starts)
+    np.testing.assert_allclose(profiles.usage, expected_profiles.usage, rtol=1e-6)
+
+
+def count_reads(source):
+    reads = []
+    iter_readings = source.iter_readings
+
+    def counted(*args, **kwargs):
+        reads.append(args)
+        return iter_readings(*args, **kwargs)
+
+    source.iter_readings = counted
+    return reads
+
+
+def test_appended_batches_reach_every_scan_once(appended):
+    source, batches, full = appended
+    store = DatasetStore()
+    reads = count_reads(source)
+    dataset = store.get(source)
+    scans(source, dataset, store)
+    assert len(reads) == 3
+
+    for batch in batches:
+        dataset = store.append(source, batch)
+        actual = scans(source, dataset, store)
+    # The scans took the batches from the store; the source was only read once more, by
+    # the first append for its latest site-years
+    assert len(reads) == 4
+    assert_scans_equal(actual, scans(full, DatasetStore().get(full), DatasetStore()))
+
+
+def test_period_sums_merge_periods_as_appends_grow_them(appended):
+    source, batches, _ = appended
+    # Ten more months, which more than double the days the sums cover
+    batches = batches + [hourly_readings(['A', 'B', 'C', 'D'], '2022-08-03', 24 * 300, seed=4)]
+    store = DatasetStore()
+    dataset = store.get(source)
+    cells = 3 * 40
+    first = meter_profiles(source, dataset, cells=cells, store=store)
+    (scan, _), = store.scans.entries.values()
+    first_stride = scan.stride
+    for batch in batches:
+        dataset = store.append(source, batch)
+    profiles = meter_profiles(source, dataset, cells=cells, store=store)
+
+    assert scan.stride == 2 * first_stride and scan.sums.size <= 2 * cells
+    assert profiles.stride % first.stride == 0 and profiles.usage.size <= cells
+    # Whole periods hold every reading from the first day up to the end of the last one
+    readings = pd.concat([pd.read_parquet(source.path)] + batches, ignore_index=True)
+    end = profiles.starts[-1] + pd.Timedelta(days=profiles.stride)
+    covered = readings[readings['timestamp'] < end]
+    expected = covered.groupby('site')['usage'].sum().reindex(profiles.sites).to_numpy()
+    np.testing.assert_allclose(profiles.usage.sum(axis=1), expected, rtol=1e-5)
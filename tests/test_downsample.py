@@ -0,0 +1,98 @@
+import math
+
+import numpy as np
+import pytest
+
+from downsample import downsample, lttb, minmax_buckets
+
+
+def naive_lttb(x, y, threshold):
+    # Point-by-point LTTB as first published: the first and last points, then per bucket of
+    # (n - 2) / (threshold - 2) points the one with the largest triangle
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    buckets = threshold - 2
+    selected = [0]
+    anchor = 0
+    for bucket in range(buckets):
+        start = bucket * (n - 2) // buckets + 1
+        stop = (bucket + 1) * (n - 2) // buckets + 1
+        next_stop = (bucket + 2) * (n - 2) // buckets + 1
+        if bucket + 1 < buckets:
+            next_x = sum(x[stop:next_stop]) / (next_stop - stop)
+            next_y = sum(y[stop:next_stop]) / (next_stop - stop)
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        best, best_area = start, -1.0
+        for i in range(start, stop):
+            area = abs((x[anchor] - next_x) * (y[i] - y[anchor]) - (x[anchor] - x[i]) * (next_y - y[anchor]))
+            if area > best_area:
+                best, best_area = i, area
+        selected.append(best)
+        anchor = best
+    return selected + [n - 1]
+
+
+def naive_minmax(y, threshold):
+    # Each bucket's first minimum and first maximum, skipping missing values and buckets
+    # with none, plus both ends
+    n = len(y)
+    buckets = threshold // 2
+    if threshold >= n or buckets < 1:
+        return list(range(n))
+    size = -(-n // buckets)
+    kept = {0, n - 1}
+    for start in range(0, n, size):
+        present = [i for i in range(start, min(start + size, n)) if not math.isnan(y[i])]
+        if present:
+            kept.add(min(present, key=lambda i: y[i]))
+            kept.add(max(present, key=lambda i: y[i]))
+    return sorted(kept)
+
+
+def random_series(rng, n):
+    x = np.cumsum(rng.integers(1, 4, n)).astype('float64')
+    y = np.round(rng.normal(0, 10, n).cumsum(), 1)
+    return x, y
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_lttb_matches_the_reference(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(2, 3000))
+    x, y = random_series(rng, n)
+    for threshold in [0, 2, 3, 4, int(rng.integers(3, n + 2)), n - 1, n, n + 5]:
+        assert lttb(x, y, threshold).tolist() == naive_lttb(x.tolist(), y.tolist(), threshold)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_minmax_matches_the_reference(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(2, 3000))
+    _, y = random_series(rng, n)
+    # Gaps in the readings, including runs long enough to empty whole buckets
+    for start in rng.integers(0, n, 3):
+        y[start:start + int(rng.integers(1, 200))] = np.nan
+    for threshold in [0, 1, 2, 3, int(rng.integers(2, n + 2)), n - 1, n]:
+        assert minmax_buckets(y, threshold).tolist() == naive_minmax(y.tolist(), threshold)
+
+
+def test_lttb_buckets_have_exact_edges():
+    # 30 rows in 22 buckets, where float steps floored one bucket edge a row early
+    rng = np.random.default_rng(3)
+    for _ in range(50):
+        x, y = random_series(rng, 32)
+        assert lttb(x, y, 24).tolist() == naive_lttb(x.tolist(), y.tolist(), 24)
+
+
+def test_minmax_skips_buckets_past_the_end():
+    # 10 points in 6 buckets of 2: the last bucket only holds padding
+    y = np.arange(10.0)[::-1]
+    assert minmax_buckets(y, 12).tolist() == list(range(10))
+    assert minmax_buckets(y, 11).tolist() == naive_minmax(y.tolist(), 11)
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError, match="Unknown downsampling method"):
+        downsample(np.arange(5), np.arange(5), 3, 'median')
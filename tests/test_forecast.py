@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from forecast import FittedSeries, fit_matrix, linear_trend, series_matrix
+
+
+def test_series_matrix_places_values_by_year():
+    # Two series back to back: 2015-2020 missing 2017-2018, and 2019-2020
+    years = np.array([2015, 2016, 2019, 2020, 2019, 2020])
+    values = np.arange(6, dtype='float64')
+    matrix = series_matrix(values, [4, 2], years)
+    nan = np.nan
+    np.testing.assert_array_equal(matrix, [
+        [0, 1, nan, nan, 2, 3],
+        [nan, nan, nan, nan, 4, 5]
+    ])
+    # Without years, series are only right-aligned by their counts
+    np.testing.assert_array_equal(series_matrix(values, [4, 2]), [[0, 1, 2, 3], [nan, nan, 4, 5]])
+
+
+def test_linear_trend_regresses_on_the_years():
+    years = np.array([2015, 2016, 2019, 2020, 2023])
+    values = 10 + 3.0 * (years - 2015)
+    np.testing.assert_allclose(linear_trend(years, values), values)
+
+
+def test_linear_forecast_continues_across_a_gap():
+    years = np.array([2015, 2016, 2019, 2020, 2021, 2022, 2020, 2021, 2022])
+    values = np.concatenate([10 + 3.0 * (years[:6] - 2015), 5 - 1.0 * (years[6:] - 2020)])
+    keys, counts = ['A', 'B'], [6, 3]
+    fitted = FittedSeries('linear', keys, [2022, 2022], fit_matrix('linear', series_matrix(values, counts, years)))
+    assert fitted.forecast('A', 2)['forecast'].tolist() == pytest.approx([34.0, 37.0])
+    assert fitted.forecast('B', 1)['forecast'].tolist() == pytest.approx([2.0])
+
+
+def test_damped_trend_steps_through_a_missing_year():
+    years = np.array([2015, 2016, 2017, 2019, 2020, 2021])
+    values = 100 + 5.0 * (years - 2015)
+    fit = fit_matrix('damped', series_matrix(values, [len(years)], years))
+    forecast = FittedSeries('damped', [None], [2021], fit).forecast(None, 1)['forecast'].iloc[0]
+    # The damped trend carries on across the missing year, a little below the line
+    assert 125 < forecast <= 135
@@ -0,0 +1,117 @@
+import asyncio
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_sources import open_source
+from dataset_store import DatasetStore
+from ingest import ConnectionPool, IngestionService, StubMeterAPI
+
+PAGE_SIZE = 97
+BATCH_ROWS = 400
+
+
+def hourly_readings(start, hours, seed):
+    rng = np.random.default_rng(seed)
+    sites = ['A', 'B', 'C']
+    timestamps = pd.date_range(start, periods=hours, freq='h')
+    usage = rng.uniform(1, 10, len(timestamps) * len(sites))
+    return pd.DataFrame({
+        'timestamp': np.repeat(timestamps, len(sites)),
+        'site': np.tile(sites, len(timestamps)),
+        'usage': usage,
+        'cost': usage * rng.uniform(0.1, 0.14, len(usage))
+    })
+
+
+class RecordingStore(DatasetStore):
+    # Keeps every batch appended, in order
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def append(self, source, readings):
+        self.batches.append(readings)
+        return super().append(source, readings)
+
+
+def poll(service):
+    async def run():
+        pool = ConnectionPool(service.host, service.port, service.connections)
+        try:
+            return await service.poll(pool)
+        finally:
+            pool.close()
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def feed(tmp_path):
+    # A loaded source, the readings after it served by a stub failing 30% of requests, and
+    # a service polling the stub into a private store
+    initial = hourly_readings('2021-12-01', 24 * 20, seed=1)
+    arriving = hourly_readings('2021-12-21', 24 * 25, seed=2)
+    initial.to_parquet(tmp_path / 'initial.parquet')
+    source = open_source(str(tmp_path / 'initial.parquet'))
+    store = RecordingStore()
+    api = StubMeterAPI(arriving, failure_rate=0.3, seed=3).start()
+    service = IngestionService(
+        source, api.url, page_size=PAGE_SIZE, connections=3, pending_pages=4, batch_rows=BATCH_ROWS,
+        retries=30, backoff=0.001, store=store
+    )
+    yield source, store, api, service, initial, arriving
+    api.stop()
+
+
+def test_poll_appends_every_page_in_order(feed):
+    source, store, api, service, _, arriving = feed
+    assert service.cursor == pd.Timestamp('2021-12-20 23:00')
+
+    assert poll(service) == len(arriving)
+    status = service.status()
+    pages = math.ceil(len(arriving) / PAGE_SIZE)
+    assert status['pages'] == pages
+    # Every 503 was retried, and only those
+    assert status['retries'] > 0
+    assert api.requests == pages + status['retries']
+    assert status['cursor'] == arriving['timestamp'].max()
+    assert status['version'] == store.get(source).version
+
+    # Batches hold whole pages in page order, so together they are the stub's readings in
+    # time order (the meters of one timestamp may come in any order)
+    assert all(len(batch) >= BATCH_ROWS for batch in store.batches[:-1])
+    appended = pd.concat(store.batches, ignore_index=True)
+    assert appended['timestamp'].is_monotonic_increasing
+    appended['site'] = appended['site'].astype(str)
+    pd.testing.assert_frame_equal(
+        appended.sort_values(['timestamp', 'site'], ignore_index=True)[['timestamp', 'site', 'usage', 'cost']],
+        arriving[['timestamp', 'site', 'usage', 'cost']], check_dtype=False
+    )
+
+
+def test_poll_resumes_after_the_cursor(feed):
+    _, store, api, service, _, arriving = feed
+    poll(service)
+    batches = len(store.batches)
+    assert poll(service) == 0
+    assert len(store.batches) == batches
+
+    more = hourly_readings('2022-01-15', 24, seed=4)
+    api.extend(more)
+    assert poll(service) == len(more)
+    assert service.status()['cursor'] == more['timestamp'].max()
+
+
+def test_appended_dataset_matches_a_reload(feed, tmp_path):
+    source, store, _, service, initial, arriving = feed
+    poll(service)
+    dataset = store.get(source)
+
+    pd.concat([initial, arriving], ignore_index=True).to_parquet(tmp_path / 'full.parquet')
+    reloaded = DatasetStore().get(open_source(str(tmp_path / 'full.parquet')))
+    pd.testing.assert_frame_equal(dataset.df, reloaded.df)
+    pd.testing.assert_frame_equal(dataset.rollups.site_yearly, reloaded.rollups.site_yearly)
+    pd.testing.assert_frame_equal(dataset.series, reloaded.series)
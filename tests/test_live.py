@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from live import LiveWindow
+
+
+def growing_series(rng, updates):
+    # Reading-level series of successive dataset versions: each appends some readings, may
+    # add to the newest one and sometimes brings far more than a window holds
+    timestamps = pd.date_range('2024-01-01', periods=1, freq='15min')
+    values = rng.uniform(0, 5, (1, 2))
+    versions = []
+    for version in range(1, updates + 1):
+        values = values.copy()
+        if rng.random() < 0.5:
+            values[-1] += rng.uniform(0, 1, 2)
+        count = int(rng.choice([0, 1, 3, 40, 400]))
+        new = pd.date_range(timestamps[-1], periods=count + 1, freq='15min')[1:]
+        timestamps = timestamps.append(new)
+        values = np.vstack([values, rng.uniform(0, 5, (count, 2))])
+        series = pd.DataFrame(values, index=pd.Index(timestamps, name='timestamp'), columns=['usage', 'cost'])
+        versions.append(SimpleNamespace(version=version, series=series))
+    return versions
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('max_points', [1, 50, 500])
+def test_window_follows_the_series(seed, max_points):
+    rng = np.random.default_rng(seed)
+    window = LiveWindow('source', max_points)
+    previous = None
+    for dataset in growing_series(rng, 40):
+        arrived = window.update(dataset)
+        series = dataset.series
+        shown = series.iloc[-max_points:]
+        np.testing.assert_array_equal(window.timestamps, shown.index.to_numpy())
+        np.testing.assert_array_equal(window.usage, shown['usage'].to_numpy())
+        np.testing.assert_array_equal(window.cost, shown['cost'].to_numpy())
+        assert window.totals['usage'] == pytest.approx(shown['usage'].sum())
+        assert window.totals['cost'] == pytest.approx(shown['cost'].sum())
+
+        if previous is None:
+            assert arrived == 0
+        else:
+            # Readings after the last one drawn, plus what was added to that one
+            last = previous.index[-1]
+            new = series[series.index > last]
+            assert arrived == window.added['readings'] == len(new)
+            for column in ['usage', 'cost']:
+                increase = series.loc[last, column] - previous.loc[last, column]
+                assert window.added[column] == pytest.approx(new[column].sum() + increase)
+        previous = series
+
+        # The same version again changes nothing
+        assert window.update(dataset) == 0
+        assert window.added['readings'] == 0
+
+
+def test_arrivals_add_up_since_a_version():
+    rng = np.random.default_rng(9)
+    datasets = growing_series(rng, 12)
+    window = LiveWindow('source', 50)
+    added = {}
+    for dataset in datasets:
+        window.update(dataset)
+        added[dataset.version] = dict(window.added)
+    assert window.arrived_since(None)['readings'] == 0
+    for version in [1, 5, 11]:
+        since = window.arrived_since(version)
+        later = [added[update] for update in added if update > version]
+        assert since['readings'] == sum(update['readings'] for update in later)
+        assert since['usage'] == pytest.approx(sum(update['usage'] for update in later))
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyramid import PYRAMID_COLUMNS, PYRAMID_LEVELS, RollupPyramid
+
+
+def readings_series(rng, count):
+    # Reading-level totals at irregular times, with gaps of days to months between runs
+    steps = np.where(rng.random(count) < 0.01, rng.integers(1, 24 * 90, count), 1)
+    timestamps = pd.Timestamp('2021-11-28') + pd.to_timedelta(np.cumsum(steps), unit='h')
+    return pd.DataFrame(
+        {column: rng.uniform(0, 10, count).astype('float32') for column in PYRAMID_COLUMNS},
+        index=pd.DatetimeIndex(timestamps, name='timestamp')
+    )
+
+
+def naive_level(series, unit):
+    # Each bucket straight from the readings in it
+    starts = series.index.to_numpy().astype(f'datetime64[{unit}]').astype('datetime64[ns]')
+    grouped = series.astype('float64').groupby(pd.DatetimeIndex(starts, name='timestamp'))
+    frame = pd.DataFrame({
+        f'{column}_{stat}': getattr(grouped[column], stat)() for column in PYRAMID_COLUMNS for stat in ['sum', 'min', 'max']
+    })
+    frame['count'] = grouped.size()
+    return frame
+
+
+def assert_levels_match(pyramid, series):
+    for level, unit in PYRAMID_LEVELS.items():
+        pd.testing.assert_frame_equal(pyramid.levels[level], naive_level(series, unit), check_freq=False, rtol=1e-9)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_extended_pyramid_matches_a_rebuild(seed):
+    rng = np.random.default_rng(seed)
+    series = readings_series(rng, 6000)
+    cuts = np.sort(rng.choice(np.arange(1, len(series)), 6, replace=False))
+    pyramid = RollupPyramid(series.iloc[:cuts[0]])
+    assert_levels_match(pyramid, series.iloc[:cuts[0]])
+
+    for previous, cut in zip(cuts, list(cuts[1:]) + [len(series)]):
+        # An append adds readings after the previous ones and sometimes re-sums the last
+        extended = series.iloc[:cut].copy()
+        since = extended.index[previous]
+        if rng.random() < 0.5:
+            extended.iloc[previous - 1] += np.float32(1.5)
+            since = extended.index[previous - 1]
+        series.iloc[:cut] = extended
+        pyramid = pyramid.extend(extended, since)
+        assert pyramid.series is extended
+        rebuilt = RollupPyramid(extended)
+        for level in PYRAMID_LEVELS:
+            pd.testing.assert_frame_equal(pyramid.levels[level], rebuilt.levels[level])
+        assert_levels_match(pyramid, extended)
+
+
+def test_extend_leaves_the_earlier_pyramid_alone():
+    series = readings_series(np.random.default_rng(11), 2000)
+    pyramid = RollupPyramid(series.iloc[:1500])
+    before = {level: frame.copy() for level, frame in pyramid.levels.items()}
+    pyramid.extend(series, series.index[1499])
+    for level, frame in before.items():
+        pd.testing.assert_frame_equal(pyramid.levels[level], frame)
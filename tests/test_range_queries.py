@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from range_queries import CrossingIndex, RangeQueries, sparse_table
+
+
+def yearly_series(rng, sites):
+    # Year-level rows of several sites back to back, sorted by site then year, each site
+    # over its own years with gaps; few distinct values, so extremes often tie
+    frames = []
+    for site in sites:
+        years = np.sort(rng.choice(np.arange(1990, 2030), rng.integers(1, 25), replace=False))
+        usage = rng.integers(1, 8, len(years)) * 1000.0
+        cost = rng.integers(1, 6, len(years)) * 150.0
+        frames.append(pd.DataFrame({'site': site, 'year': years, 'usage': usage, 'cost': cost}))
+    df = pd.concat(frames, ignore_index=True)
+    df['costPerUnit'] = df['cost'] / df['usage']
+    return df
+
+
+def naive_stats(rows):
+    # The stats computed directly from the selected rows
+    return {
+        'total_usage': rows['usage'].sum(),
+        'total_cost': rows['cost'].sum(),
+        'avg_usage': rows['usage'].mean(),
+        'avg_cost': rows['cost'].mean(),
+        'min_usage': rows['usage'].min(),
+        'max_usage': rows['usage'].max(),
+        'min_cost': rows['cost'].min(),
+        'max_cost': rows['cost'].max(),
+        'min_year_usage': int(rows.loc[rows['usage'].idxmin(), 'year']),
+        'max_year_usage': int(rows.loc[rows['usage'].idxmax(), 'year']),
+        'min_year_cost': int(rows.loc[rows['cost'].idxmin(), 'year']),
+        'max_year_cost': int(rows.loc[rows['cost'].idxmax(), 'year']),
+        'cost_per_unit_increase': (rows['costPerUnit'].iloc[-1] / rows['costPerUnit'].iloc[0] - 1) * 100
+    }
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_range_stats_match_the_selected_rows(seed):
+    rng = np.random.default_rng(seed)
+    df = yearly_series(rng, list('ABCDEFG'))
+    spans = {site: (int(rows[0]), int(rows[-1]) + 1) for site, rows in df.groupby('site').indices.items()}
+    ranges = RangeQueries(df, max_span=max(stop - start for start, stop in spans.values()))
+
+    for _ in range(300):
+        site = rng.choice(list(spans))
+        first_year, last_year = np.sort(rng.integers(1985, 2035, 2))
+        lo, hi = ranges.positions(first_year, last_year, *spans[site])
+        rows = df[(df['site'] == site) & df['year'].between(first_year, last_year)]
+        assert list(range(lo, hi)) == rows.index.tolist()
+        if rows.empty:
+            # Windows falling in a gap or outside the site's years select nothing
+            with pytest.raises(ValueError, match='no years'):
+                ranges.stats(lo, hi)
+        else:
+            assert ranges.stats(lo, hi) == pytest.approx(naive_stats(rows))
+
+
+def test_single_series_over_every_range():
+    df = yearly_series(np.random.default_rng(7), ['A'])
+    ranges = RangeQueries(df)
+    for lo in range(len(df)):
+        for hi in range(lo + 1, len(df) + 1):
+            assert ranges.stats(lo, hi) == pytest.approx(naive_stats(df.iloc[lo:hi]))
+
+
+@pytest.mark.parametrize('keep_left, pick', [(np.less_equal, np.argmin), (np.greater_equal, np.argmax)])
+def test_sparse_table_holds_the_first_extreme_of_each_block(keep_left, pick):
+    values = np.random.default_rng(3).integers(0, 6, 77).astype('float64')
+    table = sparse_table(values, 10, keep_left)
+    # Levels stop once a block would cover every value
+    assert len(table) == 7
+    for level, positions in enumerate(table):
+        size = 1 << level
+        assert len(positions) == len(values) - size + 1
+        expected = [start + pick(values[start:start + size]) for start in range(len(positions))]
+        assert positions.tolist() == expected
+
+
+def naive_first(values, threshold, below, lo, hi):
+    for position in range(lo, hi):
+        if (values[position] <= threshold) if below else (values[position] >= threshold):
+            return position
+    return -1
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('below', [False, True])
+def test_first_positions_match_a_scan(seed, below):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(1, 40, 12)
+    values = rng.integers(0, 30, counts.sum()).astype('float64')
+    stops = np.cumsum(counts)
+    spans = list(zip((stops - counts).tolist(), stops.tolist()))
+    index = CrossingIndex(values, spans)
+    # Levels between, at and beyond the values
+    thresholds = np.concatenate([np.unique(values), [-1.0, 12.5, 31.0]])
+
+    series = np.arange(len(spans))[:, None]
+    positions = index.first_positions(series, thresholds[None, :], below)
+    for row, (start, stop) in enumerate(spans):
+        expected = [naive_first(values, threshold, below, start, stop) for threshold in thresholds]
+        assert positions[row].tolist() == expected
+
+    # Windows within each series, empty ones included
+    for _ in range(200):
+        row = int(rng.integers(len(spans)))
+        start, stop = spans[row]
+        lo, hi = np.sort(rng.integers(start, stop + 1, 2))
+        found = index.first_positions(row, thresholds, below, lo, hi)
+        assert found.tolist() == [naive_first(values, threshold, below, lo, hi) for threshold in thresholds]
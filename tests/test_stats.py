@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_sources import aggregate_yearly, compact_frame, open_source, yearly_from_sites
+from dataset_store import DatasetStore
+from stats import IncrementalStats, add_yoy_changes, compute_stats
+
+
+def synthetic_readings(start, end, seed):
+    # Six-hourly readings with whole cubic feet and whole-cent costs, so a year seeded from
+    # the rounded frame and then extended sums to the same totals as the raw readings
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(start, end, freq='6h', inclusive='left')
+    usage = rng.integers(50, 400, len(timestamps)).astype('float64')
+    rate = rng.integers(9, 16, len(timestamps))
+    return pd.DataFrame({'timestamp': timestamps, 'usage': usage, 'cost': usage * rate / 100})
+
+
+def recomputed(readings):
+    df = compact_frame(add_yoy_changes(aggregate_yearly(readings)))
+    return df, compute_stats(df)
+
+
+def assert_stats_equal(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        assert actual[key] == pytest.approx(value, rel=1e-9), key
+
+
+def test_appends_match_full_recompute():
+    initial = synthetic_readings('2019-01-01', '2021-05-01', seed=1)
+    batches = [
+        # Extends 2021, the last year already in the seed frame
+        synthetic_readings('2021-05-01', '2021-09-01', seed=2),
+        synthetic_readings('2021-09-01', '2021-09-03', seed=3),
+        # Closes 2021 and opens 2022
+        synthetic_readings('2021-09-03', '2022-02-01', seed=4),
+        # Spans several new years in one batch
+        synthetic_readings('2022-02-01', '2024-07-01', seed=5),
+        synthetic_readings('2024-07-01', '2024-07-01', seed=6)
+    ]
+
+    seed_frame, _ = recomputed(initial)
+    engine = IncrementalStats(seed_frame)
+    appended = [initial]
+    for batch in batches:
+        engine.append(batch)
+        appended.append(batch)
+
+        expected_df, expected_stats = recomputed(pd.concat(appended, ignore_index=True))
+        pd.testing.assert_frame_equal(compact_frame(engine.frame()), expected_df)
+        assert_stats_equal(engine.stats(), expected_stats)
+
+
+def test_seed_alone_matches_its_frame():
+    df, stats = recomputed(synthetic_readings('2015-01-01', '2020-01-01', seed=7))
+    engine = IncrementalStats(df)
+    pd.testing.assert_frame_equal(compact_frame(engine.frame()), df)
+    assert_stats_equal(engine.stats(), stats)
+
+
+def test_rejects_readings_for_closed_years():
+    engine = IncrementalStats().append(synthetic_readings('2020-01-01', '2022-03-01', seed=8))
+    with pytest.raises(ValueError, match='only appends are supported'):
+        engine.append(synthetic_readings('2021-06-01', '2021-07-01', seed=9))
+
+
+def site_readings(sites, start, end, seed):
+    # Six-hourly readings with fractional usage and costs for each site
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(start, end, freq='6h', inclusive='left')
+    usage = rng.uniform(50, 400, (len(timestamps), len(sites)))
+    return pd.DataFrame({
+        'timestamp': np.repeat(timestamps, len(sites)),
+        'site': np.tile(sites, len(timestamps)),
+        'usage': usage.reshape(-1),
+        'cost': usage.reshape(-1) * rng.uniform(0.09, 0.16)
+    })
+
+
+def test_multi_site_appends_match_a_reload(tmp_path):
+    initial = site_readings(['A', 'B', 'C'], '2019-01-01', '2021-05-01', seed=10)
+    batches = [
+        # Many small batches into the year loaded last, so their rounding can't add up
+        *[site_readings(['A', 'B', 'C'], day, day + pd.Timedelta(days=3), seed=11 + i)
+          for i, day in enumerate(pd.date_range('2021-05-01', periods=20, freq='3D'))],
+        # Closes 2021 and brings a new site
+        site_readings(['A', 'B', 'C', 'D'], '2021-07-30', '2022-03-01', seed=40)
+    ]
+    initial.to_parquet(tmp_path / 'initial.parquet')
+    pd.concat([initial] + batches, ignore_index=True).to_parquet(tmp_path / 'full.parquet')
+
+    store = DatasetStore()
+    source = open_source(str(tmp_path / 'initial.parquet'))
+    store.get(source)
+    for batch in batches:
+        dataset = store.append(source, batch)
+        # The portfolio frame is the sum of the same version's site rows
+        site_totals = yearly_from_sites(dataset.rollups.site_yearly)
+        assert (dataset.df['usage'].to_numpy() == site_totals['usage'].to_numpy()).all()
+        assert dataset.df['cost'].to_numpy() == pytest.approx(site_totals['cost'].to_numpy(), rel=1e-12)
+        assert_stats_equal(dataset.stats, compute_stats(dataset.df))
+
+    reloaded = DatasetStore().get(open_source(str(tmp_path / 'full.parquet')))
+    pd.testing.assert_frame_equal(dataset.df, reloaded.df)
+    pd.testing.assert_frame_equal(dataset.rollups.site_yearly, reloaded.rollups.site_yearly)
+    assert_stats_equal(dataset.stats, reloaded.stats)
@@ -0,0 +1,44 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from table_view import ordered_positions, page_of
+
+
+@pytest.fixture(scope='module')
+def readings():
+    # Few distinct values, so most rows tie with others
+    rng = np.random.default_rng(0)
+    count = 2000
+    return pd.DataFrame({
+        'site': pd.Categorical(rng.choice(['A', 'B', 'C'], count)),
+        'usage': rng.integers(0, 20, count).astype('float64'),
+        'cost': rng.integers(0, 5, count) * 0.25
+    }, index=pd.Index(pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 50, count), unit='h'), name='timestamp'))
+
+
+def sql_order(readings, sort_by, descending, where=''):
+    # Positions in the order the SQL backend pages its readings
+    frame = readings.reset_index()
+    frame['timestamp'] = frame['timestamp'].astype('int64')
+    frame['site'] = frame['site'].astype(str)
+    with sqlite3.connect(':memory:') as db:
+        frame.rename_axis('reading').reset_index().to_sql('readings', db)
+        direction = 'DESC' if descending else 'ASC'
+        rows = db.execute(f"SELECT reading FROM readings {where} ORDER BY {sort_by} {direction}, reading").fetchall()
+    return np.array([row[0] for row in rows])
+
+
+@pytest.mark.parametrize('sort_by', ['usage', 'site', 'timestamp'])
+@pytest.mark.parametrize('descending', [False, True])
+def test_ties_keep_row_order_both_ways(readings, sort_by, descending):
+    np.testing.assert_array_equal(ordered_positions(readings, sort_by, descending), sql_order(readings, sort_by, descending))
+
+
+def test_filtered_descending_order(readings):
+    positions = ordered_positions(readings, 'cost', True, 'usage', 5, 12)
+    np.testing.assert_array_equal(positions, sql_order(readings, 'cost', True, 'WHERE usage BETWEEN 5 AND 12'))
+    page = page_of(readings, positions, 2, 25)
+    pd.testing.assert_frame_equal(page, readings.take(positions[25:50]))
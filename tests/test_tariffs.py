@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_sources import open_source
+from dataset_store import DatasetStore, build_dataset
+from forecast import fit_view, fitted_method
+from tariffs import Tariff, monthly_usage, reprice
+
+
+def write_readings(path, sites, seed):
+    # Daily readings for 2019-2022 with a summer peak, billed at $0.10 per cubic foot
+    rng = np.random.default_rng(seed)
+    days = pd.date_range('2019-01-01', '2023-01-01', freq='D', inclusive='left')
+    season = 1 + 0.5 * np.sin(2 * np.pi * (days.dayofyear.to_numpy() - 80) / 365)
+    frames = []
+    for site in sites:
+        usage = np.round(rng.uniform(80, 120) * season * rng.uniform(0.9, 1.1, len(days)), 1)
+        frames.append(pd.DataFrame({'timestamp': days, 'site': site, 'usage': usage, 'cost': usage * 0.10}))
+    readings = pd.concat(frames, ignore_index=True)
+    if sites == [None]:
+        readings = readings.drop(columns='site')
+    readings.to_parquet(path)
+    return open_source(str(path))
+
+
+def scenario(source, tariff):
+    dataset = DatasetStore().get(source)
+    return dataset, reprice(dataset, monthly_usage(source, dataset), tariff)
+
+
+@pytest.fixture
+def sites_source(tmp_path):
+    return write_readings(tmp_path / 'sites.parquet', ['A', 'B', 'C'], seed=1)
+
+
+def test_scenario_series_carries_the_scenario_costs(sites_source):
+    actual, priced = scenario(sites_source, Tariff("Triple", [(None, 0.30)]))
+    yearly = priced.series['cost'].groupby(priced.series.index.year).sum()
+    assert yearly.to_numpy() == pytest.approx(priced.df['cost'].to_numpy(), rel=1e-6)
+    assert priced.series['usage'].equals(actual.series['usage'])
+
+
+def test_scenario_forecast_follows_the_scenario_costs(sites_source):
+    actual, priced = scenario(sites_source, Tariff("Triple", [(None, 0.30)]))
+    assert fitted_method('seasonal', priced, 'all', 'cost') == 'seasonal'
+    forecast = fit_view(priced, 'all', 'cost', 'seasonal').forecast(None, 1)
+    last_year = priced.df['cost'].iloc[-1]
+    assert forecast['forecast'].iloc[0] == pytest.approx(last_year, rel=0.15)
+    assert actual.df['cost'].iloc[-1] < 0.5 * last_year
+
+
+def test_seasonal_falls_back_without_the_datasets_own_series(sites_source):
+    actual, priced = scenario(sites_source, Tariff("Triple", [(None, 0.30)]))
+    # Scenario totals over the metered readings, as scenarios were built before
+    mismatched = build_dataset(priced.version, priced.source_key, priced.df, priced.rollups.site_yearly, actual.series)
+    assert fitted_method('seasonal', mismatched, 'all', 'cost') == 'damped'
+    assert fitted_method('seasonal', mismatched, 'all', 'usage') == 'seasonal'
+
+
+def test_site_and_portfolio_scenarios_round_alike(sites_source, tmp_path):
+    tariff = Tariff("Tiered", [(2000, 0.12), (None, 0.2)], fixed_charge=7.5)
+    _, priced = scenario(sites_source, tariff)
+    site_cost = priced.rollups.site_yearly['cost'].to_numpy()
+    assert site_cost == pytest.approx(np.round(site_cost, 2), abs=1e-9)
+
+    _, single = scenario(write_readings(tmp_path / 'one.parquet', [None], seed=2), tariff)
+    cost = single.df['cost'].to_numpy()
+    assert cost == pytest.approx(np.round(cost, 2), abs=1e-9)
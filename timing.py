@@ -0,0 +1,135 @@
+import contextvars
+import cProfile
+import io
+import itertools
+import json
+import logging
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Environment variable that turns on the developer timing panel (also `?dev=1` in the URL)
+DEV_MODE_ENV = 'WATER_USAGE_DEV'
+
+# Durations kept per span name; percentiles and histograms cover this rolling window
+TIMING_WINDOW = 500
+
+# Span events kept for the structured log export
+EVENT_LOG_SIZE = 5000
+
+# Rows of the cProfile report kept for a profiled rerun
+PROFILE_ROWS = 40
+
+logger = logging.getLogger('water_usage.timing')
+
+# Rerun the spans on this thread belong to; Streamlit runs each session's script on its own thread
+_current_rerun = contextvars.ContextVar('current_rerun', default=None)
+
+
+class LatencyTracker:
+    # Rolling per-span latencies shared by every session in the process, plus a bounded log
+    # of individual span events for export
+
+    def __init__(self, window=TIMING_WINDOW, log_size=EVENT_LOG_SIZE):
+        self.window = window
+        self.samples = {}
+        self.events = deque(maxlen=log_size)
+        self.reruns = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds, rerun=None):
+        event = {
+            'time': time.time(),
+            'rerun': rerun,
+            'span': name,
+            'ms': seconds * 1000
+        }
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(event['ms'])
+            self.events.append(event)
+        logger.debug(json.dumps(event))
+
+    def summary(self):
+        # One row per span name: count in the window and latency percentiles in ms
+        with self.lock:
+            samples = {name: np.array(values) for name, values in self.samples.items()}
+        rows = []
+        for name, values in sorted(samples.items()):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            rows.append({
+                'span': name,
+                'count': len(values),
+                'last_ms': values[-1],
+                'p50_ms': p50,
+                'p95_ms': p95,
+                'p99_ms': p99,
+                'max_ms': values.max()
+            })
+        return rows
+
+    def histogram(self, name, bins=20):
+        # (counts, bin edges in ms) over the rolling window of one span
+        with self.lock:
+            values = np.array(self.samples.get(name, ()))
+        if len(values) == 0:
+            return np.zeros(0, dtype='int64'), np.zeros(0)
+        return np.histogram(values, bins=bins)
+
+    def histogram_frame(self, name, bins=20):
+        # The histogram as a frame indexed by each bin's lower edge, ready for st.bar_chart
+        counts, edges = self.histogram(name, bins)
+        return pd.DataFrame({'samples': counts}, index=pd.Index(edges[:-1].round(1), name='ms'))
+
+    def export_jsonl(self):
+        with self.lock:
+            events = list(self.events)
+        return ''.join(json.dumps(event) + '\n' for event in events)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.events.clear()
+
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS.record(name, time.perf_counter() - started, _current_rerun.get())
+
+
+@contextmanager
+def rerun_timing(profile=False):
+    # Times one script run as the 'rerun' span and tags the spans inside it with a rerun
+    # number. With profile=True the run is also captured with cProfile; the yielded dict
+    # gets the report under 'profile' once the block exits.
+    rerun = {'id': next(TIMINGS.reruns), 'profile': None}
+    token = _current_rerun.set(rerun['id'])
+    profiler = cProfile.Profile() if profile else None
+    try:
+        with span('rerun'):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield rerun
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    finally:
+        _current_rerun.reset(token)
+        if profiler is not None:
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_ROWS)
+            rerun['profile'] = report.getvalue()
+
+
+TIMINGS = LatencyTracker()